@@ -0,0 +1,109 @@
+"""
+Compares the WSGI deployment (gunicorn sync workers) with the ASGI one
+(uvicorn) under concurrent clients, for `POST /call_records/` and
+`GET /call_records/telephone_bill/`.
+
+Each server is started as a subprocess with the development settings
+and the same number of workers, then hit by keep-alive clients at each
+concurrency level. Run it against a dedicated database, never a
+production one, since it posts call records:
+
+    $ python -m benchmarks.asgi_vs_wsgi --workers 2 --concurrency 1 16 64
+
+`--subscriber` and `--reference-period` pick the bill to request,
+which should already exist (see `benchmarks.bill_query --seed`).
+Posted call records use call ids starting at `--first-call-id`.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import time
+
+import django
+
+from benchmarks.client import http_request, run, summarize
+
+
+SERVERS = {
+    'wsgi': ['gunicorn', 'sparrow.core.wsgi', '--worker-class', 'sync'],
+    'asgi': ['gunicorn', 'sparrow.core.asgi', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', choices=SERVERS, default=list(SERVERS))
+    parser.add_argument('--workers', type=int, default=2, help='Number of server processes')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per run')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--subscriber', default='1100000000')
+    parser.add_argument('--reference-period', default='201706')
+    parser.add_argument('--first-call-id', type=int, default=2000000000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sparrow.core.settings.development')
+    django.setup()
+
+    from django.db import connection
+
+    call_ids = itertools.count(args.first_call_id)
+    endpoints = {
+        'post': lambda: http_request('POST', '/call_records/', {
+            'type': 'start', 'call_id': next(call_ids), 'timestamp': '2017-06-01T10:00:00Z',
+            'source': '2199998888', 'destination': '2199997777',
+        }),
+        'bill': lambda: http_request(
+            'GET', f'/call_records/telephone_bill/?subscriber={args.subscriber}'
+                   f'&reference_period={args.reference_period}'
+        ),
+    }
+
+    try:
+        for server in args.servers:
+            process = _start(server, args)
+            try:
+                for (endpoint, make_request), concurrency in itertools.product(endpoints.items(),
+                                                                               args.concurrency):
+                    statuses, timings = asyncio.run(
+                        run('127.0.0.1', args.port, make_request, concurrency=concurrency, duration=args.duration)
+                    )
+                    result = summarize(statuses, timings, args.duration)
+                    print('{} {:>4} x{:<3}: {throughput:8.1f} req/s, latency (ms) p50 {p50:.2f}, p99 {p99:.2f}, '
+                          'statuses {statuses}'.format(server, endpoint, concurrency, **result))
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM call_records_callrecord WHERE call_id >= %s', [args.first_call_id])
+
+
+def _start(server, args):
+    env = dict(os.environ, ALLOWED_HOSTS='localhost')
+    command = SERVERS[server] + ['--bind', f'127.0.0.1:{args.port}', '--workers', str(args.workers),
+                                 '--log-level', 'warning']
+    process = subprocess.Popen(command, env=env, stdout=sys.stdout, stderr=sys.stderr)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            asyncio.run(_connect(args.port))
+            return process
+        except OSError:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError(f'{server} server did not start')
+
+
+async def _connect(port):
+    _, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.close()
+
+
+if __name__ == '__main__':
+    main()
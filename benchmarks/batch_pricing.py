@@ -0,0 +1,64 @@
+"""
+Benchmarks pricing and formatting the calls of a large bill, like the
+ones of PBX trunks, one call at a time against the vectorized batch
+functions used by sparrow.
+
+Tariffs are read from the database, so run it against a migrated one:
+
+    $ python -m benchmarks.batch_pricing --calls 100000
+"""
+import argparse
+import datetime
+import os
+import time
+
+import django
+import numpy as np
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=100000, help='Calls of the subscriber')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sparrow.core.settings.development')
+    django.setup()
+
+    from sparrow.call_records.api import format_call_records
+    from sparrow.call_records.pricing import price_call, price_calls
+
+    # NOTE: calls along a month, lasting up to a couple of hours
+    random = np.random.RandomState(args.seed)
+    start_epochs = datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc).timestamp() \
+        + np.sort(random.randint(0, 31 * 86400, args.calls))
+    end_epochs = start_epochs + random.exponential(600, args.calls).astype(np.int64) + random.randint(0, 2, args.calls)
+    start_timestamps = [datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc) for epoch in start_epochs]
+    end_timestamps = [datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc) for epoch in end_epochs]
+
+    # NOTE: warms up the tariffs, so loading them isn't measured
+    price_call(start_timestamps[0], end_timestamps[0])
+
+    began = time.perf_counter()
+    prices = [price_call(start, end)[0] for start, end in zip(start_timestamps, end_timestamps)]
+    one_at_a_time = time.perf_counter() - began
+
+    began = time.perf_counter()
+    priced = price_calls(start_epochs, end_epochs)
+    batch = time.perf_counter() - began
+    assert priced.prices.tolist() == prices
+
+    rows = [('2199990000', int(start * 1000000), end - start, price)
+            for start, end, price in zip(start_epochs.tolist(), end_epochs.tolist(), prices)]
+    began = time.perf_counter()
+    format_call_records(rows)
+    formatting = time.perf_counter() - began
+
+    print(f'{args.calls} calls')
+    print(f'pricing one at a time: {one_at_a_time:.3f}s ({one_at_a_time / args.calls * 1e6:.2f} us/call)')
+    print(f'pricing in batch:      {batch:.3f}s ({batch / args.calls * 1e6:.2f} us/call)')
+    print(f'formatting the bill:   {formatting:.3f}s ({formatting / args.calls * 1e6:.2f} us/call)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Benchmarks the telephone bill query against a large call_records_call
+table, reporting the query plan and its latency for a sample of
+subscribers, by bill size.
+
+Run it against a dedicated database, never a production one:
+
+    $ python -m benchmarks.bill_query --seed 10000000 --subscribers 100000
+    $ python -m benchmarks.bill_query --seed 10000000 --skew 3 --long-calls 0.01
+    $ python -m benchmarks.bill_query --samples 500
+
+`--seed` TRUNCATES call_records_call and fills it with the given
+number of calls spread evenly over 2017, in the order they ended, so
+calls of the same subscriber are scattered across the whole table
+like they are in production. Without it, the existing data is used.
+With `--skew` above 1, a few subscribers make most of the calls, so
+bills of every size are sampled. `--long-calls` is the fraction of
+calls lasting up to `--long-call-days`, which started months before the
+period they're billed in.
+
+Calls are paired when their second record arrives, whatever the age of
+the first (see `sparrow.call_records.ingestion`), then billed in the
+month they ended in and looked up by (source, end_timestamp). So beyond
+the fixed cost of a query, the time of a bill grows with its number of
+calls, and calls that started months earlier cost as much as others.
+
+To compare schemas, run it once per migration, for instance before
+and after `manage.py migrate call_records 0004`.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+import django
+
+
+SEED_QUERY = """
+INSERT INTO call_records_call
+    (call_id, source, destination, start_timestamp, end_timestamp, duration, price, tariff_id)
+SELECT
+    i,
+    (1100000000 + floor(%(subscribers)s * power((i::bigint * 7919 %% %(subscribers)s)::float / %(subscribers)s,
+                                                 %(skew)s)))::bigint::text,
+    '2199990000',
+    end_timestamp - duration,
+    end_timestamp,
+    duration,
+    36 + 9 * (extract(epoch FROM duration)::integer / 60),
+    (SELECT id FROM call_records_tariff ORDER BY effective_from LIMIT 1)
+FROM
+    generate_series(1, %(calls)s) AS i,
+    LATERAL (
+        SELECT
+            timestamptz '2017-01-01' + interval '365 days' / %(calls)s * i AS end_timestamp,
+            (i %% 3600) * interval '1 second'
+                + CASE WHEN i %% 1000 < %(long_calls)s * 1000 THEN (i %% %(long_call_days)s + 1) * interval '1 day'
+                  ELSE interval '0' END AS duration
+    ) AS generated
+"""
+
+BILL_SIZES_QUERY = """
+SELECT
+    source,
+    count(*),
+    count(*) FILTER (WHERE start_timestamp < %(start_reference_date)s)
+FROM
+    call_records_call
+WHERE
+    end_timestamp >= %(start_reference_date)s
+    AND end_timestamp < %(end_reference_date)s
+GROUP BY
+    source
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, metavar='CALLS', help='Truncate and seed this many calls')
+    parser.add_argument('--subscribers', type=int, default=100000, help='Number of subscribers when seeding')
+    parser.add_argument('--skew', type=float, default=1, help='1 for uniformly distributed subscribers')
+    parser.add_argument('--long-calls', type=float, default=0, help='Fraction of calls lasting days when seeding')
+    parser.add_argument('--long-call-days', type=int, default=90)
+    parser.add_argument('--samples', type=int, default=200, help='Number of bills to time')
+    parser.add_argument('--samples-per-size', type=int, default=50,
+                        help='Number of bills to time for each order of magnitude of size')
+    parser.add_argument('--reference-period', default='201706')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sparrow.core.settings.development')
+    django.setup()
+
+    from django.db import connection
+    from sparrow.call_records.api import TELEPHONE_BILL_QUERY, calculate_reference_period_bounds
+
+    with connection.cursor() as cursor:
+        if args.seed:
+            print(f'Seeding {args.seed} calls for {args.subscribers} subscribers...')
+            started_at = time.monotonic()
+            cursor.execute('TRUNCATE call_records_call')
+            cursor.execute(SEED_QUERY, {'calls': args.seed, 'subscribers': args.subscribers, 'skew': args.skew,
+                                        'long_calls': args.long_calls, 'long_call_days': args.long_call_days})
+            # NOTE: index-only scans depend on the visibility map, which
+            # autovacuum would eventually build anyway
+            cursor.execute('VACUUM ANALYZE call_records_call')
+            print(f'Seeded in {time.monotonic() - started_at:.1f}s')
+
+        cursor.execute('SELECT DISTINCT source FROM call_records_call TABLESAMPLE SYSTEM (1) LIMIT %s',
+                       [args.samples])
+        subscribers = [source for source, in cursor.fetchall()]
+        random.shuffle(subscribers)
+        _, start_reference_date, end_reference_date = calculate_reference_period_bounds(args.reference_period)
+
+        def params(subscriber):
+            return {'subscriber': subscriber, 'start_reference_date': start_reference_date,
+                    'end_reference_date': end_reference_date}
+
+        def time_bills(subscribers):
+            timings = []
+            bill_sizes = []
+            for subscriber in subscribers:
+                started_at = time.perf_counter()
+                cursor.execute(TELEPHONE_BILL_QUERY, params(subscriber))
+                bill_sizes.append(len(cursor.fetchall()))
+                timings.append((time.perf_counter() - started_at) * 1000)
+            return timings, bill_sizes
+
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + TELEPHONE_BILL_QUERY, params(subscribers[0]))
+        print('\n'.join(line for line, in cursor.fetchall()))
+
+        timings, bill_sizes = time_bills(subscribers)
+
+        # NOTE: the largest bills are rare among sampled subscribers, so
+        # bills of each order of magnitude of size are sampled apart
+        cursor.execute(BILL_SIZES_QUERY, params(None))
+        buckets = {}
+        long_calls = 0
+        for subscriber, calls, started_before in cursor.fetchall():
+            buckets.setdefault(len(str(calls)), []).append(subscriber)
+            long_calls += started_before
+        by_size = [(digits, time_bills(random.sample(bucket, min(len(bucket), args.samples_per_size))))
+                   for digits, bucket in sorted(buckets.items())]
+
+        cursor.execute("SELECT pg_size_pretty(sum(pg_total_relation_size(relid))) "
+                       "FROM pg_partition_tree('call_records_call')")
+        table_size, = cursor.fetchone()
+
+    print(f'\n{len(timings)} bills, {statistics.mean(bill_sizes):.1f} calls per bill, table size {table_size}')
+    print('latency (ms): p50 {:.3f}, p95 {:.3f}, max {:.3f}'.format(*_percentiles(timings)))
+
+    print(f'\n{long_calls} calls of {args.reference_period} started before it')
+    print(f'{"calls per bill":>16} {"bills":>6} {"p50 (ms)":>9} {"p95 (ms)":>9} {"us per call":>12}')
+    for digits, (bucket_timings, sizes) in by_size:
+        p50, p95, _ = _percentiles(bucket_timings)
+        label = f'{10 ** (digits - 1) if digits > 1 else 0}-{10 ** digits - 1}'
+        per_call = sum(bucket_timings) * 1000 / max(sum(sizes), 1)
+        print(f'{label:>16} {len(sizes):>6} {p50:>9.3f} {p95:>9.3f} {per_call:>12.1f}')
+
+
+def _percentiles(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)], timings[-1]
+
+
+if __name__ == '__main__':
+    main()
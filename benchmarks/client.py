@@ -0,0 +1,100 @@
+"""
+Minimal asyncio HTTP/1.1 client shared by the HTTP benchmarks: it
+keeps connections alive whenever the server allows it, so the client
+is never the bottleneck.
+"""
+import asyncio
+import json
+import time
+
+
+def http_request(method, path, data=None):
+    """
+    Returns the raw bytes of a request, with `data` as a JSON body
+    """
+    body = json.dumps(data).encode() if data is not None else b''
+    return (f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n').encode() + body
+
+
+async def run(host, port, make_request, *, concurrency, duration):
+    """
+    Runs `concurrency` clients sending requests from `make_request` for
+    `duration` seconds. Returns the count of each response status and
+    the latency of every request, in milliseconds
+    """
+    statuses = {}
+    timings = []
+    deadline = time.monotonic() + duration
+
+    async def client():
+        writer = None
+        try:
+            while time.monotonic() < deadline:
+                started_at = time.perf_counter()
+                # NOTE: gunicorn sync workers close connections after each
+                # response, reconnecting is part of their latency
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                writer.write(make_request())
+                status, keep_alive = await _read_response(reader)
+                timings.append((time.perf_counter() - started_at) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+                if not keep_alive:
+                    writer.close()
+                    writer = None
+        finally:
+            if writer is not None:
+                writer.close()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return statuses, timings
+
+
+def summarize(statuses, timings, duration):
+    """
+    Returns the throughput and latency percentiles (ms) of a run
+    """
+    timings = sorted(timings)
+
+    def percentile(p):
+        return round(timings[min(len(timings) - 1, int(len(timings) * p / 100))], 3) if timings else None
+
+    return {
+        'requests': len(timings),
+        'throughput': round(len(timings) / duration, 1),
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': round(timings[-1], 3) if timings else None,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def _read_response(reader):
+    """
+    Reads a response, returning its status and whether the connection
+    is kept alive
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed by the server')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int(await reader.readline(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+
+    return int(status_line.split()[1]), headers.get('connection') != 'close'
@@ -0,0 +1,253 @@
+"""
+Load test of a running sparrow deployment: drives POST /call_records/
+and GET /call_records/telephone_bill/ at a target concurrency and
+reports throughput and p50/p95/p99 latency.
+
+Run it against a dedicated deployment and database, never a production
+one. Seed the database first, then point the load test at the server:
+
+    $ python -m benchmarks.load_test --seed 5000000 --subscribers 100000 --skew 3
+    $ gunicorn sparrow.core.wsgi --workers 4 &
+    $ python -m benchmarks.load_test --url http://127.0.0.1:8000 --concurrency 32
+
+`--seed` TRUNCATES the call records, calls and archived calls and fills
+them with the given number of calls over the 12 months up to
+`--reference-period`. Subscribers are drawn from a power law: with
+`--skew` above 1, a few of them make most of the calls, and get the
+largest bills. Seeding doesn't price calls by tariff bands, prices are
+only realistic.
+
+Posted calls are drawn from the same distribution, in the reference
+period, with call ids above the seeded ones. `--out-of-order` is the
+fraction of calls whose end record arrives first, and `--duplicates`
+the fraction of records sent twice. Bills requested are those of the
+reference period, for subscribers drawn from the same distribution.
+
+Results, along with the options and commit they were measured with,
+are saved as JSON under `benchmarks/results/` (see `--output`). To
+compare a run with an older one, pass its file with `--baseline`.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import subprocess
+import time
+import urllib.parse
+
+import django
+from dateutil.relativedelta import relativedelta
+
+from benchmarks.client import http_request, run, summarize
+
+
+SUBSCRIBERS_OFFSET = 1100000000
+
+SEED_CALLS_QUERY = """
+CREATE TEMPORARY TABLE load_test_calls AS
+SELECT
+    i AS call_id,
+    (%(offset)s + floor(%(subscribers)s * power(random(), %(skew)s)))::bigint::text AS source,
+    (%(offset)s + floor(%(subscribers)s * random()))::bigint::text AS destination,
+    start_timestamp,
+    start_timestamp + duration AS end_timestamp,
+    duration
+FROM
+    generate_series(1, %(calls)s) AS i,
+    LATERAL (
+        SELECT
+            %(start)s + (%(end)s - %(start)s) * random() AS start_timestamp,
+            -- NOTE: exponentially distributed, 3 minutes on average
+            -ln(1 - random()) * interval '3 minutes' AS duration
+        -- NOTE: referencing i makes it run once per call
+        WHERE i > 0
+    ) AS generated
+"""
+
+SEED_CALL_RECORDS_QUERY = """
+INSERT INTO call_records_callrecord (is_start, call_id, timestamp, source, destination)
+SELECT true, call_id, start_timestamp, ('1' || source)::bigint, ('1' || destination)::bigint FROM load_test_calls
+UNION ALL
+SELECT false, call_id, end_timestamp, NULL, NULL FROM load_test_calls
+"""
+
+SEED_CALLS_TABLE_QUERY = """
+INSERT INTO call_records_call
+    (call_id, source, destination, start_timestamp, end_timestamp, duration, price, tariff_id)
+SELECT
+    call_id,
+    source,
+    destination,
+    start_timestamp,
+    end_timestamp,
+    duration,
+    36 + 9 * (extract(epoch FROM duration)::integer / 60),
+    (SELECT id FROM call_records_tariff ORDER BY effective_from LIMIT 1)
+FROM
+    load_test_calls
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, metavar='CALLS', help='Truncate and seed this many calls, then exit')
+    parser.add_argument('--subscribers', type=int, default=100000)
+    parser.add_argument('--skew', type=float, default=2, help='1 for uniformly distributed subscribers')
+    parser.add_argument('--random-seed', type=int, default=0)
+    parser.add_argument('--reference-period', default='201706')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--scenarios', nargs='+', choices=['ingestion', 'bills'], default=['ingestion', 'bills'])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help='Seconds per scenario')
+    parser.add_argument('--out-of-order', type=float, default=0.1)
+    parser.add_argument('--duplicates', type=float, default=0.01)
+    parser.add_argument('--output', help='Defaults to benchmarks/results/load-test-<date>.json')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sparrow.core.settings.development')
+    django.setup()
+
+    reference_month = datetime.datetime.strptime(args.reference_period, '%Y%m').replace(tzinfo=datetime.timezone.utc)
+    if args.seed:
+        return seed(args, reference_month)
+
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT coalesce(max(call_id), 0) FROM call_records_callrecord')
+        last_call_id, = cursor.fetchone()
+
+    rng = random.Random(args.random_seed)
+    url = urllib.parse.urlsplit(args.url)
+    results = {}
+    for scenario in args.scenarios:
+        make_request = {
+            'ingestion': lambda: ingestion_requests(args, rng, reference_month, last_call_id + 1),
+            'bills': lambda: bill_requests(args, rng),
+        }[scenario]()
+
+        statuses, timings = asyncio.run(run(url.hostname, url.port or 80, lambda: next(make_request),
+                                            concurrency=args.concurrency, duration=args.duration))
+        results[scenario] = summarize(statuses, timings, args.duration)
+        print('{:<10} {throughput:8.1f} req/s, latency (ms) p50 {p50}, p95 {p95}, p99 {p99}, max {max}, '
+              'statuses {statuses}'.format(scenario, **results[scenario]))
+
+    report = {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': _current_commit(),
+        'options': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'seed')},
+        'results': results,
+    }
+
+    output = args.output or os.path.join(
+        os.path.dirname(__file__), 'results', f'load-test-{datetime.datetime.now():%Y%m%dT%H%M%S}.json'
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f'Results saved to {output}')
+
+    if args.baseline:
+        compare(args.baseline, report)
+
+
+def seed(args, reference_month):
+    from django.db import connection, transaction
+    from sparrow.call_records import partitions
+    from sparrow.call_records.summaries import rebuild_bill_summaries
+
+    start = reference_month - relativedelta(months=11)
+    end = reference_month + relativedelta(months=1)
+    print(f'Seeding {args.seed} calls for {args.subscribers} subscribers (skew {args.skew}), '
+          f'from {start:%Y-%m} to {reference_month:%Y-%m}...')
+    started_at = time.monotonic()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for month in range(13):
+            partitions.create_partition(cursor, (start + relativedelta(months=month)).date())
+
+        # NOTE: archived calls of a previous run would be billed along
+        # with the seeded ones, and their call ids refused
+        cursor.execute('TRUNCATE call_records_callrecord, call_records_call, call_records_billsummary, '
+                       'call_records_callarchive, call_records_archivedcallid')
+        # NOTE: setseed takes a value between -1 and 1
+        cursor.execute('SELECT setseed(%s)', [random.Random(args.random_seed).uniform(-1, 1)])
+        cursor.execute(SEED_CALLS_QUERY, {'offset': SUBSCRIBERS_OFFSET, 'subscribers': args.subscribers,
+                                          'skew': args.skew, 'calls': args.seed, 'start': start, 'end': end})
+        cursor.execute(SEED_CALL_RECORDS_QUERY)
+        cursor.execute(SEED_CALLS_TABLE_QUERY)
+        cursor.execute('DROP TABLE load_test_calls')
+        rebuild_bill_summaries()
+
+    with connection.cursor() as cursor:
+        cursor.execute('VACUUM ANALYZE call_records_callrecord')
+        cursor.execute('VACUUM ANALYZE call_records_call')
+    print(f'Seeded in {time.monotonic() - started_at:.1f}s')
+
+
+def ingestion_requests(args, rng, reference_month, first_call_id):
+    """
+    Yields requests posting the records of new calls, some of them out
+    of order or duplicated
+    """
+    month_seconds = ((reference_month + relativedelta(months=1)) - reference_month).total_seconds()
+    for call_id in itertools.count(first_call_id):
+        start_timestamp = reference_month + datetime.timedelta(seconds=rng.uniform(0, month_seconds))
+        end_timestamp = start_timestamp + datetime.timedelta(seconds=rng.expovariate(1 / 180))
+        destination = str(SUBSCRIBERS_OFFSET + rng.randrange(args.subscribers))
+        records = [
+            {'type': 'start', 'call_id': call_id, 'timestamp': start_timestamp.isoformat(),
+             'source': _subscriber(args, rng), 'destination': destination},
+            {'type': 'end', 'call_id': call_id, 'timestamp': end_timestamp.isoformat()},
+        ]
+        if rng.random() < args.out_of_order:
+            records.reverse()
+
+        for record in records:
+            yield http_request('POST', '/call_records/', record)
+            if rng.random() < args.duplicates:
+                yield http_request('POST', '/call_records/', record)
+
+
+def bill_requests(args, rng):
+    while True:
+        yield http_request('GET', '/call_records/telephone_bill/?' + urllib.parse.urlencode({
+            'subscriber': _subscriber(args, rng), 'reference_period': args.reference_period,
+        }))
+
+
+def compare(baseline_path, report):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    print(f'\nCompared with {baseline_path} (commit {baseline.get("commit")}):')
+    for scenario, result in report['results'].items():
+        if scenario not in baseline['results']:
+            continue
+
+        changes = []
+        for metric in ['throughput', 'p50', 'p95', 'p99']:
+            before, after = baseline['results'][scenario][metric], result[metric]
+            if before and after is not None:
+                changes.append(f'{metric} {before} -> {after} ({(after - before) / before:+.1%})')
+        print(f'{scenario:<10} ' + ', '.join(changes))
+
+
+def _subscriber(args, rng):
+    # NOTE: same distribution as SEED_CALLS_QUERY
+    return str(SUBSCRIBERS_OFFSET + int(args.subscribers * rng.random() ** args.skew))
+
+
+def _current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    main()
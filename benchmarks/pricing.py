@@ -0,0 +1,64 @@
+"""
+Microbenchmark of call pricing, for calls lasting from seconds up to
+weeks, comparing the closed formula used by sparrow against walking
+the call minute by minute.
+
+No database access is needed, but Django settings are:
+
+    $ python -m benchmarks.pricing
+"""
+import argparse
+import datetime
+import os
+import timeit
+
+import django
+
+
+DURATIONS = [
+    ('10s', 10),
+    ('5m', 5 * 60),
+    ('1h', 60 * 60),
+    ('1d', 24 * 60 * 60),
+    ('1w', 7 * 24 * 60 * 60),
+    ('4w', 28 * 24 * 60 * 60),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=10000, help='Calls priced per duration')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sparrow.core.settings.development')
+    django.setup()
+
+    from sparrow.call_records.pricing import CompiledTariff
+
+    # NOTE: the tariff from the specification
+    tariff = CompiledTariff(1, 36, [
+        (datetime.time(0, 0), 0),
+        (datetime.time(6, 0), 9),
+        (datetime.time(22, 0), 0),
+    ])
+    start_seconds_of_day = 21 * 60 * 60 + 57 * 60 + 13
+
+    def minute_by_minute(duration_seconds):
+        price = tariff.standing_charge
+        for cycle in range(1, duration_seconds // 60 + 1):
+            price += tariff.call_charge_at((start_seconds_of_day + 60 * cycle) % 86400)
+        return price
+
+    print(f'{"duration":>8} {"closed formula":>16} {"minute by minute":>18}')
+    for label, duration_seconds in DURATIONS:
+        assert tariff.price(start_seconds_of_day, duration_seconds) == minute_by_minute(duration_seconds)
+
+        closed = timeit.timeit(lambda: tariff.price(start_seconds_of_day, duration_seconds), number=args.number)
+        # NOTE: the loop is way slower, so fewer iterations are enough
+        number = max(1, args.number // max(1, duration_seconds // 600))
+        loop = timeit.timeit(lambda: minute_by_minute(duration_seconds), number=number)
+        print(f'{label:>8} {closed / args.number * 1e6:>13.2f} us {loop / number * 1e6:>15.2f} us')
+
+
+if __name__ == '__main__':
+    main()
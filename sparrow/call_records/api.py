@@ -1,11 +1,17 @@
-__all__ = ['telephone_bill']
+__all__ = ['telephone_bill', 'stream_telephone_bill', 'reference_period_is_current_month',
+           'calculate_reference_period_bounds', 'format_call_records', 'format_durations', 'format_prices',
+           'TELEPHONE_BILL_QUERY']
 
+import time
+
+import numpy as np
 from dateutil.relativedelta import relativedelta
 
 from django.db import connection
 from django.utils import timezone
 
 from sparrow.call_records.exceptions import CurrentMonthForbiddenError, InvalidReferencePeriodError
+from sparrow.call_records.metrics import BILL_CALLS, BILL_QUERY_DURATION
 
 
 def telephone_bill(subscriber, *, reference_period=None):
@@ -26,33 +32,21 @@ def telephone_bill(subscriber, *, reference_period=None):
         ]
     }
     """
-    if _reference_period_is_current_month(reference_period):
+    if reference_period_is_current_month(reference_period):
         raise CurrentMonthForbiddenError(reference_period)
 
-    reference_period, start_reference_date, end_reference_date = _calculate_reference_period_bounds(reference_period)
-    # NOTE: This has to exist to cover both the following cases:
-    # - calls started and ended in the reference period
-    # - calls started in the previous month and ended in the reference period
-    start_previous_date = start_reference_date - relativedelta(months=1)
+    reference_period, start_reference_date, end_reference_date = calculate_reference_period_bounds(reference_period)
 
-    call_records = []
+    started_at = time.perf_counter()
     with connection.cursor() as cursor:
-        cursor.execute(_TELEPHONE_BILL_QUERY, {
+        cursor.execute(TELEPHONE_BILL_QUERY, {
             'subscriber': subscriber,
-            'start_previous_date': start_previous_date,
             'start_reference_date': start_reference_date,
             'end_reference_date': end_reference_date
         })
-
-        for destination, start_timestamp, end_timestamp in cursor.fetchall():
-            start_date, start_time = start_timestamp.isoformat().replace('+00:00', 'Z').split('T')
-            call_records.append({
-                'destination': destination,
-                'start_date': start_date,
-                'start_time': start_time,
-                'duration': _calculate_duration(start_timestamp, end_timestamp),
-                'price': _calculate_price(start_timestamp, end_timestamp),
-            })
+        call_records = format_call_records(cursor.fetchall())
+    BILL_QUERY_DURATION.observe(time.perf_counter() - started_at)
+    BILL_CALLS.observe(len(call_records))
 
     return {
         'subscriber': subscriber,
@@ -61,40 +55,105 @@ def telephone_bill(subscriber, *, reference_period=None):
     }
 
 
-_TELEPHONE_BILL_QUERY = """
-WITH
-    start_records AS (
-        SELECT
-            call_id,
-            destination,
-            timestamp
-        FROM
-            call_records_callrecord
-        WHERE
-            type = 'start'
-            AND source = %(subscriber)s
-            AND timestamp >= %(start_previous_date)s
-            AND timestamp < %(end_reference_date)s
-    )
+def stream_telephone_bill(subscriber, *, reference_period=None, chunk_size):
+    """
+    Same as `telephone_bill`, but `call_records` is an iterator of
+    lists of at most `chunk_size` call records, read from a server-side
+    cursor as they're consumed. That way, memory usage doesn't depend on
+    how large the bill is.
+
+    Errors in the arguments are raised right away, not when iterating.
+    """
+    if reference_period_is_current_month(reference_period):
+        raise CurrentMonthForbiddenError(reference_period)
+
+    reference_period, start_reference_date, end_reference_date = calculate_reference_period_bounds(reference_period)
+
+    return {
+        'subscriber': subscriber,
+        'reference_period': reference_period,
+        'call_records': _iter_call_records({
+            'subscriber': subscriber,
+            'start_reference_date': start_reference_date,
+            'end_reference_date': end_reference_date
+        }, chunk_size),
+    }
+
+
+def _iter_call_records(params, chunk_size):
+    # NOTE: a named cursor in PostgreSQL, unless server-side cursors
+    # are disabled in DATABASES (e.g. behind pgbouncer). Outside of a
+    # transaction it's declared WITH HOLD, so PostgreSQL keeps the
+    # result until it's consumed, instead of the worker
+    # NOTE: the query duration excludes the time spent sending chunks
+    duration = 0
+    calls = 0
+    with connection.chunked_cursor() as cursor:
+        started_at = time.perf_counter()
+        cursor.execute(TELEPHONE_BILL_QUERY, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
 
+            call_records = format_call_records(rows)
+            duration += time.perf_counter() - started_at
+            calls += len(call_records)
+            yield call_records
+            started_at = time.perf_counter()
+
+    BILL_QUERY_DURATION.observe(duration + time.perf_counter() - started_at)
+    BILL_CALLS.observe(calls)
+
+
+# NOTE: calls are paired and priced at ingestion time (see
+# sparrow.call_records.ingestion), so a bill is a range scan over the
+# (source, end_timestamp) index. A call belongs to the period it ended in.
+# Calls of archived periods (see sparrow.call_records.archive) are read
+# from the archive row of the subscriber, which is empty for others
+TELEPHONE_BILL_QUERY = """
 SELECT
-    start_records.destination AS destination,
-    start_records.timestamp   AS start,
-    end_records.timestamp     AS end
-FROM
-    call_records_callrecord end_records,
-    start_records
-WHERE
-    end_records.type = 'end'
-    AND end_records.timestamp >= %(start_reference_date)s
-    AND end_records.timestamp < %(end_reference_date)s
-    AND start_records.call_id = end_records.call_id
+    destination,
+    (extract(epoch FROM start_timestamp) * 1000000)::bigint,
+    extract(epoch FROM duration),
+    price
+FROM (
+    SELECT
+        destination,
+        start_timestamp,
+        duration,
+        price
+    FROM
+        call_records_call
+    WHERE
+        source = %(subscriber)s
+        AND end_timestamp >= %(start_reference_date)s
+        AND end_timestamp < %(end_reference_date)s
+    UNION ALL
+    SELECT
+        substr(archived.destination::text, 2),
+        archived.start_timestamp,
+        archived.end_timestamp - archived.start_timestamp,
+        archived.price
+    FROM
+        call_records_callarchive archive,
+        unnest(archive.destinations, archive.start_timestamps, archive.end_timestamps, archive.prices)
+            AS archived (destination, start_timestamp, end_timestamp, price)
+    WHERE
+        archive.subscriber = %(subscriber)s
+        AND archive.reference_period = to_char(%(start_reference_date)s::timestamptz AT TIME ZONE 'UTC', 'YYYYMM')
+) calls
 ORDER BY
-    start_records.timestamp ASC
+    start_timestamp ASC
 """
 
 
-def _reference_period_is_current_month(period):
+def reference_period_is_current_month(period):
+    """
+    Returns whether the reference period given as a string in the
+    format of YYYYMM is the current month, raising
+    InvalidReferencePeriodError if it's not a valid period.
+    """
     if not period:
         # NOTE: if no period is given we'll default to the previous
         # month elsewhere
@@ -111,7 +170,7 @@ def _reference_period_is_current_month(period):
     return today.year == period.year and today.month == period.month
 
 
-def _calculate_reference_period_bounds(period):
+def calculate_reference_period_bounds(period):
     """
     Returns a pair of datetime objects delimiting the reference period given
     as a string in the format of YYYYMM.
@@ -127,52 +186,94 @@ def _calculate_reference_period_bounds(period):
     return (period, start_month, end_month)
 
 
-def _calculate_duration(start_timestamp, end_timestamp):
+def format_call_records(rows):
     """
-    Returns duration in a pretty format, like "32m27s"
+    Formats (destination, start timestamp in epoch microseconds, duration
+    in seconds, price in cents) rows as bill entries, using vectorized
+    NumPy operations over the whole bill
+    """
+    if not rows:
+        return []
+
+    destinations, start_timestamps, durations, prices = zip(*rows)
+    start_dates, start_times = _format_start_timestamps(np.array(start_timestamps, dtype=np.int64))
+    durations = format_durations(np.array(durations, dtype=np.float64))
+    prices = format_prices(np.array(prices, dtype=np.int64))
+
+    return [
+        {'destination': destination, 'start_date': start_date, 'start_time': start_time,
+         'duration': duration, 'price': price}
+        for destination, start_date, start_time, duration, price
+        in zip(destinations, start_dates.tolist(), start_times.tolist(), durations.tolist(), prices.tolist())
+    ]
+
+
+def _format_start_timestamps(timestamps):
+    """
+    Returns arrays of dates and times, like "2018-01-31" and
+    "21:57:13Z", for timestamps given in epoch microseconds. Fractions
+    of a second are shown only when there is one, like isoformat() does
+    """
+    seconds, microseconds = np.divmod(timestamps, 1000000)
+    dates = np.datetime_as_string(seconds.astype('datetime64[s]'), unit='D')
+    times = _TIMES_OF_DAY[seconds % 86400]
+
+    fractional = microseconds != 0
+    if fractional.any():
+        times[fractional] = np.char.add(np.char.add(np.char.rstrip(times[fractional], 'Z'), '.'),
+                                        np.char.add(np.char.zfill(microseconds[fractional].astype(str), 6), 'Z'))
+
+    return dates, times
+
+
+def format_durations(durations):
+    """
+    Returns an array of durations, given in seconds, in a pretty format,
+    like "32m27s"
     """
     # NOTE: had knowledge of https://gist.github.com/thatalextaylor/7408395
     # so I reused most of it
-    seconds = (end_timestamp - start_timestamp).seconds
-    days, seconds = divmod(seconds, 86400)
-    hours, seconds = divmod(seconds, 3600)
-    minutes, seconds = divmod(seconds, 60)
-
-    duration = []
-    if days > 0:
-        duration.append(f'{days}d')
-    if hours > 0:
-        duration.append(f'{hours}h')
-    if minutes > 0:
-        duration.append(f'{minutes}m')
-    if seconds > 0:
-        duration.append(f'{seconds}s')
-
-    return ''.join(duration)
-
-
-# NOTE: it is stated that price rules can change
-# from time to time. In this case, it would be better
-# to have multiple functions, one for each price
-# rule, and have _calculate_price select the right
-# function based on the selected period. This way,
-# price calculation will not fluctuate and we'll
-# be able to change price rules whenever needed.
-#
-# Since in this exercise there was no example
-# of that, for the purposes of a POC I've decided
-# to keep this function simple
-def _calculate_price(start_timestamp, end_timestamp):
-    """
-    Calculates price for the given interval. Values are calculated
-    in cents and then converted to Brazilian Real by the end.
-    """
-    standing_charge = 36
-    call_charge = 9
-    if start_timestamp.hour >= 22 or start_timestamp.hour < 6:
-        # reduced tariff, YAY!
-        call_charge = 0
-
-    minutes = (end_timestamp - start_timestamp).seconds // 60
-    price = standing_charge + (call_charge * minutes)
-    return 'R$ {:0,.2f}'.format(price / 100).replace('.', ',')
+    seconds = np.maximum(durations, 0).astype(np.int64)
+    days, seconds = np.divmod(seconds, 86400)
+    hours, seconds = np.divmod(seconds, 3600)
+    minutes, seconds = np.divmod(seconds, 60)
+
+    # NOTE: wide enough for the days, prepended in place below
+    formatted = np.char.add(np.char.add(_HOURS[hours], _MINUTES[minutes]), _SECONDS[seconds]).astype('U32')
+    long_calls = days > 0
+    if long_calls.any():
+        formatted[long_calls] = np.char.add(np.char.add(days[long_calls].astype(str), 'd'), formatted[long_calls])
+
+    return formatted
+
+
+def format_prices(prices):
+    """
+    Returns an array of prices, given in cents, in Brazilian Real, like
+    "R$ 3,96"
+    """
+    # NOTE: thousands are separated by commas too, like "R$ 1,234,56"
+    reais, cents = np.divmod(prices, 100)
+    reais, group = np.divmod(reais, 1000)
+    formatted = np.char.add(np.where(reais > 0, _PADDED_GROUPS[group], _GROUPS[group]), _CENTS[cents]).astype('U32')
+
+    # NOTE: the less common prices over R$ 1,000,00, a group at a time
+    expensive = reais > 0
+    while expensive.any():
+        reais[expensive], group = np.divmod(reais[expensive], 1000)
+        formatted[expensive] = np.char.add(np.where(reais[expensive] > 0, _PADDED_GROUPS[group], _GROUPS[group]),
+                                           formatted[expensive])
+        expensive &= reais > 0
+
+    return np.char.add('R$ ', formatted)
+
+
+# NOTE: lookup tables, so formatting a bill is mostly indexing arrays
+_TIMES_OF_DAY = np.array([f'{seconds // 3600:02}:{seconds // 60 % 60:02}:{seconds % 60:02}Z'
+                          for seconds in range(86400)], dtype='U16')
+_HOURS = np.array([''] + [f'{hours}h' for hours in range(1, 24)])
+_MINUTES = np.array([''] + [f'{minutes}m' for minutes in range(1, 60)])
+_SECONDS = np.array([''] + [f'{seconds}s' for seconds in range(1, 60)])
+_CENTS = np.array([f',{cents:02}' for cents in range(100)])
+_GROUPS = np.array([f'{group}' for group in range(1000)])
+_PADDED_GROUPS = np.array([f',{group:03}' for group in range(1000)])
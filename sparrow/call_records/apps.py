@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class CallRecordsConfig(AppConfig):
+    name = 'sparrow.call_records'
+
+    def ready(self):
+        # NOTE: registers the system checks
+        from sparrow.call_records import checks  # noqa: F401
@@ -0,0 +1,137 @@
+"""
+Cold archival of the calls of closed reference periods.
+
+Bills only read the calls of their own period, so past periods weigh on
+the call tables and their indexes long after they're last billed.
+`archive_period` moves the calls of a closed period to CallArchive, a
+row per subscriber holding each column of their calls as an array,
+which PostgreSQL compresses, and deletes them from call_records_call
+along with their call records.
+
+Bills, billing runs and bill summaries read archived calls
+transparently, looked up by subscriber and period in the unique index
+of the archive. Calls arriving late for an archived period are stored
+as usual, and added to the archive when the period is archived again.
+Records of archived calls are gone from the call records API, but
+their call ids are kept in ArchivedCallId, so a record of an archived
+call sent again is still told duplicated.
+"""
+__all__ = ['archive_period']
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from sparrow.call_records import partitions
+from sparrow.call_records.api import calculate_reference_period_bounds
+from sparrow.call_records.exceptions import CurrentMonthForbiddenError
+
+
+def archive_period(reference_period):
+    """
+    Archives the calls ending in `reference_period`, which must be
+    closed. Returns a dict with the number of `calls` archived, their
+    `subscribers`, and the call `records` deleted.
+    """
+    reference_period, start, end = calculate_reference_period_bounds(reference_period)
+    if end > timezone.now():
+        raise CurrentMonthForbiddenError(reference_period)
+
+    month = start.date()
+    params = {'reference_period': reference_period, 'start': start, 'end': end}
+    with transaction.atomic(), connection.cursor() as cursor:
+        partitioned = month in partitions.list_partitions(cursor)
+        table = partitions.partition_name(month) if partitioned else partitions.PARTITIONED_TABLE
+        # NOTE: calls created meanwhile would be deleted without being
+        # archived, so creating them waits until it's done. Bills are
+        # still read
+        cursor.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
+
+        cursor.execute(_ARCHIVE_CALLS_QUERY.format(table=table), params)
+        subscribers, calls = cursor.fetchone()
+        cursor.execute(_ARCHIVE_CALL_IDS_QUERY.format(table=table), params)
+        cursor.execute(_DELETE_CALL_RECORDS_QUERY.format(table=table), params)
+        records = cursor.rowcount
+
+        if partitioned:
+            # NOTE: TRUNCATE refuses tables with deferred foreign key
+            # checks pending, left by calls created in this transaction
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            partitions.truncate_partition(cursor, month)
+        else:
+            cursor.execute(_DELETE_CALLS_QUERY, params)
+
+    return {'subscribers': subscribers, 'calls': calls, 'records': records}
+
+
+# NOTE: phone numbers are encoded like CallRecord's, see
+# PhoneNumberField. Calls of a period archived again are appended
+_ARCHIVE_CALLS_QUERY = """
+WITH calls AS (
+    SELECT
+        source,
+        array_agg(call_id ORDER BY start_timestamp, call_id) AS call_ids,
+        array_agg(('1' || destination)::bigint ORDER BY start_timestamp, call_id) AS destinations,
+        array_agg(start_timestamp ORDER BY start_timestamp, call_id) AS start_timestamps,
+        array_agg(end_timestamp ORDER BY start_timestamp, call_id) AS end_timestamps,
+        array_agg(price ORDER BY start_timestamp, call_id) AS prices,
+        array_agg(tariff_id ORDER BY start_timestamp, call_id) AS tariff_ids
+    FROM
+        {table}
+    WHERE
+        end_timestamp >= %(start)s
+        AND end_timestamp < %(end)s
+    GROUP BY
+        source
+),
+archived AS (
+    INSERT INTO call_records_callarchive
+        (subscriber, reference_period, call_ids, destinations, start_timestamps, end_timestamps, prices, tariff_ids)
+    SELECT
+        source, %(reference_period)s, call_ids, destinations, start_timestamps, end_timestamps, prices, tariff_ids
+    FROM
+        calls
+    ON CONFLICT (subscriber, reference_period) DO UPDATE SET
+        call_ids = call_records_callarchive.call_ids || excluded.call_ids,
+        destinations = call_records_callarchive.destinations || excluded.destinations,
+        start_timestamps = call_records_callarchive.start_timestamps || excluded.start_timestamps,
+        end_timestamps = call_records_callarchive.end_timestamps || excluded.end_timestamps,
+        prices = call_records_callarchive.prices || excluded.prices,
+        tariff_ids = call_records_callarchive.tariff_ids || excluded.tariff_ids
+)
+SELECT
+    count(*),
+    coalesce(sum(cardinality(call_ids)), 0)
+FROM
+    calls
+"""
+
+_ARCHIVE_CALL_IDS_QUERY = """
+INSERT INTO call_records_archivedcallid (call_id)
+SELECT
+    call_id
+FROM
+    {table}
+WHERE
+    end_timestamp >= %(start)s
+    AND end_timestamp < %(end)s
+ON CONFLICT DO NOTHING
+"""
+
+# NOTE: is_start is constrained so the (is_start, call_id) unique index
+# serves the call_id lookups
+_DELETE_CALL_RECORDS_QUERY = """
+DELETE FROM call_records_callrecord
+WHERE
+    is_start IN (true, false)
+    AND call_id IN (
+        SELECT call_id FROM {table}
+        WHERE end_timestamp >= %(start)s AND end_timestamp < %(end)s
+    )
+"""
+
+_DELETE_CALLS_QUERY = f"""
+DELETE FROM {partitions.PARTITIONED_TABLE}
+WHERE
+    end_timestamp >= %(start)s
+    AND end_timestamp < %(end)s
+"""
@@ -0,0 +1,408 @@
+"""
+Async versions of the busiest endpoints, served by the ASGI entry
+point (`sparrow.core.asgi`).
+
+Django 3.2 runs async views, but its ORM can't be used from them, so
+`AsyncApplication` is a small ASGI application of its own: it serves
+`POST /call_records/` and `GET /call_records/telephone_bill/` with
+asyncpg, and hands every other request to the regular Django
+application. Database waits don't hold a worker, so a single process
+keeps thousands of switch connections open with a pool of
+ASYNC_DB_POOL_MAX_SIZE database connections.
+
+Both endpoints validate and respond exactly like their sync versions,
+except that `POST /call_records/` only accepts JSON bodies. In the
+buffered ingestion mode, `POST /call_records/` is handed to the Django
+application too, since the buffer belongs to the sync code. Pricing and
+cache access are synchronous, so they run in a small thread pool.
+
+Django middleware doesn't run here: the application measures requests
+like `MetricsMiddleware` and logs slow queries like
+`SlowQueryMiddleware` on its own, and hands requests to profile (with
+an `X-Profile` header) to the Django application.
+"""
+__all__ = ['AsyncApplication']
+
+import asyncio
+import contextvars
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncpg
+from django.conf import settings
+from django.db import connections
+from django.http import QueryDict
+from django.http.request import split_domain_port, validate_host
+from rest_framework.renderers import JSONRenderer
+
+from sparrow.call_records import api, buffer, ingestion
+from sparrow.call_records.cache import LOCK_POLL_INTERVAL, WAIT, cached_bill_steps, invalidate_telephone_bills
+from sparrow.call_records.exceptions import CurrentMonthForbiddenError, InvalidCallRecordError, TelephoneBillError
+from sparrow.call_records.forms import TelephoneBillForm
+from sparrow.call_records.metrics import BILL_CALLS, BILL_QUERY_DURATION
+from sparrow.call_records.models import CallRecord, encode_phone_number
+from sparrow.call_records.pricing import price_calls
+from sparrow.call_records.serializers import CallRecordStartSerializer, CallRecordEndSerializer
+from sparrow.call_records.validation import parse_call_record, render_call_record, validate_call_record
+from sparrow.call_records.views import (
+    DUPLICATED_RECORD_DETAIL, INVALID_RECORD_STATUSES, INVALID_TYPE_ERRORS, BILL_TAIL, render_bill_head,
+    render_call_records
+)
+from sparrow.core import slow_queries
+from sparrow.core.metrics import REGISTRY
+from sparrow.core.middleware import REQUEST_DURATION, REQUESTS
+
+
+# NOTE: the request whose queries are running, for slow query logs
+_origin = contextvars.ContextVar('origin', default=None)
+
+SERIALIZER_CLASSES = {
+    CallRecord.START: CallRecordStartSerializer,
+    CallRecord.END: CallRecordEndSerializer,
+}
+
+
+class AsyncApplication:
+    def __init__(self, fallback):
+        """
+        `fallback` is the ASGI application serving every other request
+        """
+        self.fallback = fallback
+        # NOTE: view names label metrics like MetricsMiddleware does
+        self.routes = {
+            ('POST', '/call_records/'): (self.post_call_record, 'call_records:index'),
+            ('GET', '/call_records/telephone_bill/'): (self.get_telephone_bill, 'call_records:telephone_bill'),
+        }
+        self._pool = None
+        self._pool_lock = None
+        self._executor = ThreadPoolExecutor(max_workers=settings.ASYNC_SYNC_THREADS)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        route = self.routes.get((scope.get('method'), scope['path'])) if scope['type'] == 'http' else None
+        # NOTE: ProfilingMiddleware checks the token
+        if route is None or (settings.PROFILING_DIR and _header(scope, b'x-profile')):
+            return await self.fallback(scope, receive, send)
+
+        handler, view = route
+        response_status = None
+
+        async def send_measured(message):
+            nonlocal response_status
+            if message['type'] == 'http.response.start':
+                response_status = message['status']
+            await send(message)
+
+        _origin.set(f"{scope['method']} {scope['path']}")
+        started_at = time.perf_counter()
+        if not _is_allowed_host(_header(scope, b'host')):
+            await _respond(send_measured, 400, {'detail': 'Invalid HTTP_HOST header'})
+        else:
+            await handler(scope, receive, send_measured)
+            if scope['method'] == 'POST' and response_status in INVALID_RECORD_STATUSES:
+                ingestion.count_invalid_records()
+
+        # NOTE: unlike MetricsMiddleware, streamed responses are measured
+        # until they end, and queries aren't counted
+        REQUESTS.labels(scope['method'], view, str(response_status)).inc()
+        REQUEST_DURATION.labels(scope['method'], view).observe(time.perf_counter() - started_at)
+        REGISTRY.maybe_flush()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.get_pool()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def get_pool(self):
+        if self._pool is None:
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+
+            async with self._pool_lock:
+                if self._pool is None:
+                    # NOTE: psycopg2 parameters, merging OPTIONS
+                    params = connections['default'].get_connection_params()
+                    self._pool = await asyncpg.create_pool(
+                        host=params.get('host') or None,
+                        port=params.get('port') or None,
+                        user=params.get('user') or None,
+                        password=params.get('password') or None,
+                        database=params['database'],
+                        min_size=settings.ASYNC_DB_POOL_MIN_SIZE,
+                        max_size=settings.ASYNC_DB_POOL_MAX_SIZE,
+                        init=self.init_connection,
+                    )
+
+        return self._pool
+
+    async def init_connection(self, connection):
+        if settings.SLOW_QUERY_THRESHOLD:
+            connection.add_query_logger(self.log_slow_query)
+
+    async def log_slow_query(self, record):
+        """
+        asyncpg query logger, same as `sparrow.core.slow_queries.SlowQueryLogger`
+        """
+        if not slow_queries.is_slow(record.elapsed) or record.query.startswith(slow_queries.EXPLAIN_QUERY):
+            return
+
+        plan = None
+        # NOTE: the plan is captured with a connection of its own, since
+        # the query's one moved on by now
+        if self._pool is not None and not record.exception and slow_queries.should_explain(record.query):
+            try:
+                async with self._pool.acquire() as connection:
+                    plan = json.loads(await connection.fetchval(slow_queries.EXPLAIN_QUERY + record.query,
+                                                                *record.args))
+            except (asyncpg.PostgresError, asyncpg.InterfaceError):
+                slow_queries.logger.exception('Failed to explain a slow query')
+
+        slow_queries.log_slow_query(_origin.get(), record.query, record.args, record.elapsed, plan)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def run_sync(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, _close_connections_after, func, args)
+
+    async def post_call_record(self, scope, receive, send):
+        if settings.CALL_RECORDS_INGESTION_MODE == buffer.BUFFERED:
+            return await self.fallback(scope, receive, send)
+
+        content_type = _header(scope, b'content-type').split(';')[0].strip()
+        if content_type != 'application/json':
+            return await _respond(send, 415, {'detail': f'Unsupported media type "{content_type}" in request.'})
+
+        try:
+            data = parse_call_record(await _read_body(receive))
+        except ValueError as e:
+            return await _respond(send, 400, {'detail': f'JSON parse error - {e}'})
+
+        if settings.CALL_RECORDS_FAST_PATH:
+            try:
+                record = validate_call_record(data)
+            except InvalidCallRecordError as e:
+                return await _respond(send, 400, e.errors)
+        else:
+            record_type = data.get('type') if isinstance(data, dict) else None
+            if not CallRecord.is_record_type(record_type):
+                return await _respond(send, 400, INVALID_TYPE_ERRORS)
+
+            serializer = SERIALIZER_CLASSES[record_type](data=data)
+            if not serializer.is_valid():
+                return await _respond(send, 400, serializer.errors)
+            record = dict({'source': '', 'destination': ''}, type=record_type, **serializer.validated_data)
+
+        pool = await self.get_pool()
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                record['id'] = await connection.fetchval(
+                    _INSERT_CALL_RECORD_QUERY, record['type'] == CallRecord.START, record['call_id'],
+                    record['timestamp'], encode_phone_number(record['source']),
+                    encode_phone_number(record['destination']))
+                if record['id'] is not None:
+                    calls = await self.pair_call_record(connection, record['call_id'])
+
+        if record['id'] is None:
+            ingestion.count_ingested_records(duplicates=1)
+            return await _respond(send, 409, {'detail': DUPLICATED_RECORD_DETAIL})
+
+        ingestion.count_ingested_records(created=1)
+        if calls:
+            await self.run_sync(invalidate_telephone_bills, calls)
+
+        if settings.CALL_RECORDS_FAST_PATH:
+            return await _send(send, 201, render_call_record(record))
+
+        await _respond(send, 201, SERIALIZER_CLASSES[record['type']](CallRecord(**record)).data)
+
+    async def pair_call_record(self, connection, call_id):
+        """
+        Same as `sparrow.call_records.ingestion.pair_call_records`, for
+        a single call id, in the transaction of `connection`. Returns
+        the (source, end_timestamp) of the call created, if any, whose
+        bills must be invalidated
+        """
+        async with connection.transaction():
+            rows = await connection.fetch(_PAIRED_CALL_RECORDS_QUERY, [call_id])
+            if not rows:
+                return []
+
+            priced = await self.run_sync(price_calls, [row[3].timestamp() for row in rows],
+                                         [row[4].timestamp() for row in rows])
+            calls = ingestion.priceable_calls(rows, priced)
+            if not calls:
+                return []
+
+            params = [param for call in calls for param in call]
+            return [tuple(row) for row in await connection.fetch(_insert_calls_query(len(calls)), *params)]
+
+    async def get_telephone_bill(self, scope, receive, send):
+        f = TelephoneBillForm(QueryDict(scope.get('query_string', b'').decode('latin-1')))
+        if not f.is_valid():
+            return await _respond(send, 400, f.errors)
+
+        subscriber, reference_period = f.cleaned_data['subscriber'], f.cleaned_data['reference_period']
+        try:
+            if api.reference_period_is_current_month(reference_period):
+                raise CurrentMonthForbiddenError(reference_period)
+            reference_period, start_reference_date, end_reference_date = \
+                api.calculate_reference_period_bounds(reference_period)
+        except TelephoneBillError as e:
+            return await _respond(send, 400, {'detail': str(e)})
+
+        params = (subscriber, start_reference_date, end_reference_date)
+        bill = {'subscriber': subscriber, 'reference_period': reference_period}
+        if f.cleaned_data['stream']:
+            return await self.stream_telephone_bill(send, bill, params)
+
+        steps = await self.run_sync(cached_bill_steps, subscriber, reference_period)
+        computed = None
+        while True:
+            done, step = await self.run_sync(_resume, steps, computed)
+            if done:
+                return await _respond(send, 200, step)
+
+            if step == WAIT:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+                continue
+
+            try:
+                pool = await self.get_pool()
+                async with pool.acquire() as connection:
+                    started_at = time.perf_counter()
+                    rows = await connection.fetch(_TELEPHONE_BILL_QUERY, *params)
+            except BaseException:
+                await self.run_sync(steps.close)
+                raise
+
+            computed = dict(bill, call_records=api.format_call_records(rows))
+            BILL_QUERY_DURATION.observe(time.perf_counter() - started_at)
+            BILL_CALLS.observe(len(rows))
+
+    async def stream_telephone_bill(self, send, bill, params):
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': render_bill_head(bill), 'more_body': True})
+
+        pool = await self.get_pool()
+        async with pool.acquire() as connection, connection.transaction():
+            # NOTE: the query duration excludes the time spent sending chunks
+            duration = 0
+            calls = 0
+            started_at = time.perf_counter()
+            cursor = await connection.cursor(_TELEPHONE_BILL_QUERY, *params)
+            first = True
+            while True:
+                rows = await cursor.fetch(settings.BILL_STREAM_CHUNK_SIZE)
+                if not rows:
+                    break
+
+                body = render_call_records(api.format_call_records(rows), first=first)
+                duration += time.perf_counter() - started_at
+                calls += len(rows)
+                await send({'type': 'http.response.body', 'more_body': True, 'body': body})
+                first = False
+                started_at = time.perf_counter()
+
+        BILL_QUERY_DURATION.observe(duration + time.perf_counter() - started_at)
+        BILL_CALLS.observe(calls)
+
+        await send({'type': 'http.response.body', 'body': BILL_TAIL})
+
+
+def _close_connections_after(func, args):
+    # NOTE: only pricing touches the database, when refreshing tariffs,
+    # so threads don't keep connections open between calls
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+def _resume(steps, value):
+    """
+    Resumes the generator returned by `cached_bill_steps`, returning
+    whether it's done and the bill, or its next step
+    """
+    # NOTE: StopIteration can't be raised out of an executor future
+    try:
+        return False, steps.send(value)
+    except StopIteration as e:
+        return True, e.value
+
+
+def _to_asyncpg(query):
+    """
+    Converts a query with psycopg2 `%(name)s` parameters to asyncpg
+    `$n` ones, in the order they first appear
+    """
+    names = []
+
+    def replace(match):
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f'${names.index(match.group(1)) + 1}'
+
+    return re.sub(r'%\((\w+)\)s', replace, query).replace('%%', '%')
+
+
+_TELEPHONE_BILL_QUERY = _to_asyncpg(api.TELEPHONE_BILL_QUERY)
+_PAIRED_CALL_RECORDS_QUERY = _to_asyncpg(ingestion.PAIRED_CALL_RECORDS_QUERY)
+# NOTE: typed, since asyncpg takes parameters of VALUES in a subquery as text
+_INSERT_CALL_RECORD_QUERY = ingestion.INSERT_CALL_RECORDS_QUERY.format(
+    values='($1::boolean, $2::integer, $3::timestamptz, $4::bigint, $5::bigint)')
+
+
+def _insert_calls_query(count):
+    values = ', '.join('({})'.format(', '.join(f'${row * 8 + column}' for column in range(1, 9)))
+                       for row in range(count))
+    return ingestion.INSERT_CALLS_QUERY.format(values=values)
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _respond(send, status, data):
+    await _send(send, status, JSONRenderer().render(data))
+
+
+async def _send(send, status, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _is_allowed_host(host):
+    # NOTE: same as HttpRequest.get_host
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+
+    domain, _ = split_domain_port(host)
+    return bool(domain) and validate_host(domain, allowed_hosts)
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key.lower() == name:
+            return value.decode('latin-1')
+    return ''
@@ -0,0 +1,201 @@
+"""
+Monthly billing runs.
+
+A run bills every subscriber with calls in a reference period, with the
+same logic as `sparrow.call_records.api.telephone_bill`. Subscribers
+are split into shards of consecutive numbers, billed by a pool of
+worker processes.
+
+Each shard is written at once, either to the Bill table or to a NDJSON
+file, so written shards are the checkpoints of a run: running it again
+skips subscribers already billed.
+"""
+__all__ = ['run_billing', 'TableBillWriter', 'FileBillWriter']
+
+import functools
+import json
+import multiprocessing
+import os
+import time
+
+import django
+from django.db import connection, connections, transaction
+from rest_framework.renderers import JSONRenderer
+
+from sparrow.call_records.api import (
+    calculate_reference_period_bounds, reference_period_is_current_month, telephone_bill
+)
+from sparrow.call_records.exceptions import CurrentMonthForbiddenError
+from sparrow.call_records.models import Bill
+
+
+def run_billing(reference_period, writer, *, workers, shard_size, progress=None):
+    """
+    Bills every subscriber with calls ending in `reference_period` not
+    billed by `writer` yet, using `workers` processes. `progress`, if
+    given, is called with the number of bills and calls of each shard
+    written.
+
+    Returns a dict with the number of `subscribers` billed, their
+    `calls`, subscribers `skipped` for being already billed, and the
+    `elapsed` seconds.
+    """
+    if reference_period_is_current_month(reference_period):
+        raise CurrentMonthForbiddenError(reference_period)
+
+    started_at = time.monotonic()
+    subscribers = _active_subscribers(reference_period)
+    billed = writer.billed_subscribers()
+    pending = [subscriber for subscriber in subscribers if subscriber not in billed]
+    shards = [pending[offset:offset + shard_size] for offset in range(0, len(pending), shard_size)]
+
+    stats = {'subscribers': 0, 'calls': 0, 'skipped': len(subscribers) - len(pending)}
+    bill_shard = functools.partial(_bill_shard, writer, reference_period)
+    if workers > 1 and len(shards) > 1:
+        # NOTE: forked workers must not share the connection of this
+        # process, they open their own
+        connections.close_all()
+        with multiprocessing.Pool(min(workers, len(shards)), initializer=_init_worker) as pool:
+            results = list(_collect(pool.imap_unordered(bill_shard, shards), stats, progress))
+    else:
+        results = list(_collect(map(bill_shard, shards), stats, progress))
+
+    stats.update(shards=len(results), elapsed=time.monotonic() - started_at)
+    return stats
+
+
+def _collect(results, stats, progress):
+    for bills, calls in results:
+        stats['subscribers'] += bills
+        stats['calls'] += calls
+        if progress:
+            progress(bills, calls)
+        yield bills, calls
+
+
+def _init_worker():
+    # NOTE: needed when workers are spawned instead of forked
+    django.setup()
+
+
+def _active_subscribers(reference_period):
+    reference_period, start_reference_date, end_reference_date = calculate_reference_period_bounds(reference_period)
+    with connection.cursor() as cursor:
+        cursor.execute(_ACTIVE_SUBSCRIBERS_QUERY, {
+            'reference_period': reference_period,
+            'start_reference_date': start_reference_date,
+            'end_reference_date': end_reference_date
+        })
+        return [subscriber for subscriber, in cursor.fetchall()]
+
+
+# NOTE: an index-only scan over the bill index of call_records_call,
+# along with the subscribers whose calls were archived
+_ACTIVE_SUBSCRIBERS_QUERY = """
+SELECT
+    source
+FROM
+    call_records_call
+WHERE
+    end_timestamp >= %(start_reference_date)s
+    AND end_timestamp < %(end_reference_date)s
+UNION
+SELECT
+    subscriber
+FROM
+    call_records_callarchive
+WHERE
+    reference_period = %(reference_period)s
+ORDER BY
+    source
+"""
+
+
+def _bill_shard(writer, reference_period, subscribers):
+    bills = [telephone_bill(subscriber, reference_period=reference_period) for subscriber in subscribers]
+    writer.write(bills)
+    return len(bills), sum(len(bill['call_records']) for bill in bills)
+
+
+class TableBillWriter:
+    """
+    Writes bills to the Bill table, a shard per transaction
+    """
+
+    def __init__(self, reference_period):
+        self.reference_period = reference_period
+
+    def billed_subscribers(self):
+        return set(Bill.objects.filter(reference_period=self.reference_period)
+                   .values_list('subscriber', flat=True))
+
+    def write(self, bills):
+        if not bills:
+            return
+
+        params = []
+        for bill in bills:
+            params.extend([bill['subscriber'], bill['reference_period'],
+                           JSONRenderer().render(bill).decode(), len(bill['call_records'])])
+
+        values = ', '.join(['(%s, %s, %s, %s, now())'] * len(bills))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(_INSERT_BILLS_QUERY.format(values=values), params)
+
+    def clear(self):
+        Bill.objects.filter(reference_period=self.reference_period).delete()
+
+
+# NOTE: bills are only written twice by concurrent runs of the same
+# period, and then they're the same
+_INSERT_BILLS_QUERY = """
+INSERT INTO call_records_bill
+    (subscriber, reference_period, body, calls, created_at)
+VALUES
+    {values}
+ON CONFLICT (subscriber, reference_period) DO UPDATE SET
+    body = EXCLUDED.body,
+    calls = EXCLUDED.calls,
+    created_at = EXCLUDED.created_at
+"""
+
+
+class FileBillWriter:
+    """
+    Writes bills to NDJSON files in `directory`, a file per shard named
+    after its first subscriber, like "bills-201801-1122334455.ndjson".
+    Files are written under a temporary name and then renamed, so they
+    are either complete or missing.
+    """
+
+    def __init__(self, reference_period, directory):
+        self.reference_period = reference_period
+        self.directory = directory
+
+    def billed_subscribers(self):
+        subscribers = set()
+        for path in self._paths():
+            with open(path) as bills_file:
+                subscribers.update(json.loads(line)['subscriber'] for line in bills_file)
+
+        return subscribers
+
+    def write(self, bills):
+        if not bills:
+            return
+
+        path = os.path.join(self.directory, f'bills-{self.reference_period}-{bills[0]["subscriber"]}.ndjson')
+        with open(f'{path}.tmp', 'wb') as bills_file:
+            for bill in bills:
+                bills_file.write(JSONRenderer().render(bill) + b'\n')
+
+        os.replace(f'{path}.tmp', path)
+
+    def clear(self):
+        for path in self._paths():
+            os.remove(path)
+
+    def _paths(self):
+        prefix = f'bills-{self.reference_period}-'
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                if name.startswith(prefix) and name.endswith('.ndjson')]
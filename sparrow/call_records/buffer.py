@@ -0,0 +1,269 @@
+"""
+Write-behind buffer for call records.
+
+When CALL_RECORDS_INGESTION_MODE is "buffered", `POST /call_records/`
+validates records and submits them to a bounded in-process buffer
+instead of inserting them. A background thread per process flushes
+the buffer with `sparrow.call_records.ingestion.insert_call_records`
+once CALL_RECORDS_BUFFER_BATCH_SIZE records are waiting or the oldest
+one waited CALL_RECORDS_BUFFER_FLUSH_INTERVAL seconds, so many requests
+share a single commit.
+
+The outcome of each submitted record is kept in a cache under an
+ingestion id, returned by the API, so clients can still tell created
+records from duplicates.
+
+Failed writes are retried, waiting twice as long each time, up to
+CALL_RECORDS_BUFFER_MAX_ATTEMPTS times. A batch still failing is logged
+along with its records and dropped, so a batch that can never be
+written doesn't hold up the others, and its records are marked FAILED.
+Writing outcomes to the cache is retried on its own, so records aren't
+written twice.
+
+CALL_RECORDS_BUFFER_DURABILITY is either:
+- "memory": the request returns as soon as the record is buffered, and
+  flushes commit asynchronously (synchronous_commit off). Records may
+  be lost if the process or the database crash before they're
+  written, in exchange for the lowest latency
+- "commit": the request waits until its record is committed, as
+  durable as synchronous inserts but sharing commits with others
+"""
+__all__ = ['submit', 'get_status', 'BufferFullError', 'BUFFERED', 'PENDING', 'FAILED', 'MEMORY', 'COMMIT']
+
+import atexit
+import collections
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+from sparrow.call_records.ingestion import CREATED, DUPLICATE, insert_call_records
+
+
+logger = logging.getLogger(__name__)
+
+# NOTE: value of CALL_RECORDS_INGESTION_MODE enabling the buffer, the
+# default being "sync"
+BUFFERED = 'buffered'
+
+# NOTE: outcome of records not written yet
+PENDING = 'pending'
+
+# NOTE: outcome of records dropped after failing to be written
+FAILED = 'failed'
+
+# NOTE: durability modes
+MEMORY = 'memory'
+COMMIT = 'commit'
+
+
+class BufferFullError(Exception):
+    """
+    Raised when the buffer is still full after waiting for a flush.
+    """
+
+    def __init__(self):
+        super().__init__('Call records buffer is full')
+
+
+_Entry = collections.namedtuple('_Entry', ['ingestion_id', 'record', 'written'])
+
+
+class IngestionBuffer:
+    def __init__(self, *, max_size, batch_size, flush_interval, durable, max_attempts=10, background=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durable = durable
+        self.max_attempts = max_attempts
+        self.background = background
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, ingestion_id, record, *, timeout):
+        """
+        Buffers an already validated record, like the ones taken by
+        `insert_call_records`. Returns an Event set once the record is
+        written, or raises BufferFullError if there's no room for it
+        within `timeout` seconds.
+        """
+        if self.background:
+            self._start()
+
+        entry = _Entry(ingestion_id, record, threading.Event())
+        try:
+            self._queue.put(entry, timeout=timeout)
+        except queue.Full:
+            raise BufferFullError()
+
+        return entry.written
+
+    def flush(self):
+        """
+        Writes every record buffered so far, in the calling thread.
+        """
+        while True:
+            batch = self._take(block=False)
+            if not batch:
+                return
+
+            self._write(batch)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='call-records-buffer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = self._take(block=True)
+            try:
+                ids = self._retry(self._insert, batch)
+            except Exception:
+                logger.exception('Dropped %d buffered call records after %d attempts: %s', len(batch),
+                                 self.max_attempts, json.dumps([entry.record for entry in batch], default=str))
+                ids = None
+
+            try:
+                self._retry(self._set_statuses, batch, ids)
+            except Exception:
+                logger.exception('Failed to store the status of %d buffered call records', len(batch))
+
+            for entry in batch:
+                entry.written.set()
+
+    def _retry(self, func, *args):
+        """
+        Calls `func` until it succeeds, up to `max_attempts` times,
+        waiting twice as long after each failure. Raises the last error
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                return func(*args)
+            except Exception:
+                if attempt == self.max_attempts - 1:
+                    raise
+
+                # NOTE: most likely the database or the cache is
+                # unavailable, new records wait for room meanwhile
+                logger.exception('Failed to write %d buffered call records, retrying', len(args[0]))
+                connection.close()
+                time.sleep(self.flush_interval * 2 ** attempt)
+
+    def _take(self, *, block):
+        """
+        Returns the next batch: up to `batch_size` records. If `block`,
+        waits for the first one, and then up to `flush_interval`
+        seconds for the others
+        """
+        try:
+            batch = [self._queue.get(block=block)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if block and timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _write(self, batch):
+        self._set_statuses(batch, self._insert(batch))
+        for entry in batch:
+            entry.written.set()
+
+    def _insert(self, batch):
+        # NOTE: only the flusher thread has a connection of its own,
+        # flushes at exit use the one of the main thread
+        if not self.durable and threading.current_thread() is self._thread:
+            with connection.cursor() as cursor:
+                cursor.execute('SET synchronous_commit TO off')
+
+        return insert_call_records([entry.record for entry in batch], batch_size=len(batch))
+
+    def _set_statuses(self, batch, ids):
+        """
+        Stores the outcome of each record of `batch`, given the ids
+        returned by `_insert`, or None if the batch was dropped
+        """
+        caches[settings.CALL_RECORDS_STATUS_CACHE].set_many({
+            _status_key(entry.ingestion_id): {'status': FAILED} if ids is None
+            else {'status': CREATED, 'id': record_id} if record_id else {'status': DUPLICATE}
+            for entry, record_id in zip(batch, ids or [None] * len(batch))
+        }, timeout=settings.CALL_RECORDS_STATUS_TIMEOUT)
+
+
+_buffer = None
+_buffer_pid = None
+
+
+def get_buffer():
+    """
+    Returns the buffer of this process, configured from settings
+    """
+    global _buffer, _buffer_pid
+    # NOTE: gunicorn forks workers after the app is loaded, and the
+    # flusher thread doesn't survive a fork, so each process needs its own
+    if _buffer is None or _buffer_pid != os.getpid():
+        _buffer = IngestionBuffer(
+            max_size=settings.CALL_RECORDS_BUFFER_MAX_SIZE,
+            batch_size=settings.CALL_RECORDS_BUFFER_BATCH_SIZE,
+            flush_interval=settings.CALL_RECORDS_BUFFER_FLUSH_INTERVAL,
+            durable=settings.CALL_RECORDS_BUFFER_DURABILITY == COMMIT,
+            max_attempts=settings.CALL_RECORDS_BUFFER_MAX_ATTEMPTS,
+        )
+        _buffer_pid = os.getpid()
+
+    return _buffer
+
+
+def submit(ingestion_id, record):
+    """
+    Submits an already validated record to the buffer of this process,
+    under `ingestion_id` (a UUID). In the COMMIT durability mode, waits
+    for it to be written. Returns its status, see `get_status`.
+
+    Raises BufferFullError if there's no room for it.
+    """
+    cache = caches[settings.CALL_RECORDS_STATUS_CACHE]
+    cache.set(_status_key(ingestion_id), {'status': PENDING}, timeout=settings.CALL_RECORDS_STATUS_TIMEOUT)
+
+    buffer = get_buffer()
+    try:
+        written = buffer.submit(ingestion_id, record, timeout=settings.CALL_RECORDS_BUFFER_TIMEOUT)
+    except BufferFullError:
+        cache.delete(_status_key(ingestion_id))
+        raise
+
+    if buffer.durable:
+        written.wait(timeout=settings.CALL_RECORDS_BUFFER_TIMEOUT)
+
+    return get_status(ingestion_id)
+
+
+def get_status(ingestion_id):
+    """
+    Returns the status of a submitted record, a dict with `status`,
+    either PENDING, CREATED (along with the `id` of the record),
+    DUPLICATE or FAILED. Returns None for unknown, or expired, ingestion ids.
+    """
+    return caches[settings.CALL_RECORDS_STATUS_CACHE].get(_status_key(ingestion_id))
+
+
+def _status_key(ingestion_id):
+    return f'call_records:ingestion:{ingestion_id}'
@@ -0,0 +1,158 @@
+"""
+Cache for telephone bills.
+
+A bill for a closed reference period only changes when a call of that
+subscriber ending in that period arrives late, so bills are cached
+until that happens. Cache keys include a version token per subscriber
+and reference period, which is replaced whenever such a call arrives:
+that way, a bill computed concurrently with the late call can never be
+served after it. They also include a version token per reference
+period, replaced when its calls are pruned.
+"""
+__all__ = ['cached_telephone_bill', 'cached_bill_steps', 'invalidate_telephone_bills', 'invalidate_reference_periods',
+           'WAIT', 'COMPUTE', 'LOCK_POLL_INTERVAL']
+
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from sparrow.call_records.api import calculate_reference_period_bounds, telephone_bill
+
+
+# NOTE: how often, in seconds, a worker waiting for another one to
+# compute the same bill checks if it's done
+LOCK_POLL_INTERVAL = 0.05
+
+# NOTE: steps yielded by `cached_bill_steps`
+WAIT = 'wait'
+COMPUTE = 'compute'
+
+
+def cached_telephone_bill(subscriber, *, reference_period=None):
+    """
+    Same as `sparrow.call_records.api.telephone_bill`, but cached. If
+    the bill is missing, only one worker computes it while the others
+    wait for it, up to BILL_CACHE_LOCK_TIMEOUT seconds.
+    """
+    if not reference_period:
+        # NOTE: so the key is the same as when giving last month explicitly
+        reference_period, _, _ = calculate_reference_period_bounds(reference_period)
+
+    steps = cached_bill_steps(subscriber, reference_period)
+    bill = None
+    try:
+        while True:
+            step = steps.send(bill)
+            if step == WAIT:
+                time.sleep(LOCK_POLL_INTERVAL)
+            else:
+                with _closing_on_error(steps):
+                    bill = telephone_bill(subscriber, reference_period=reference_period)
+    except StopIteration as e:
+        return e.value
+
+
+def cached_bill_steps(subscriber, reference_period):
+    """
+    Looks up the cached bill of `subscriber` for `reference_period`
+    (YYYYMM), making sure only one worker computes it if it's missing.
+
+    A generator, so the sync and async callers share it and only wait
+    and compute bills their own way: it yields WAIT when the caller must
+    sleep LOCK_POLL_INTERVAL seconds before resuming it, and COMPUTE
+    when the caller must compute the bill and send it. If computing it
+    fails, the caller must close the generator. The bill is its return
+    value.
+    """
+    cache = caches[settings.BILL_CACHE]
+    key = _bill_key(cache, subscriber, reference_period)
+    bill = cache.get(key)
+    if bill is not None:
+        return bill
+
+    lock_key = f'{key}:lock'
+    locked = cache.add(lock_key, True, timeout=settings.BILL_CACHE_LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + settings.BILL_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline and cache.get(lock_key):
+            yield WAIT
+            bill = cache.get(key)
+            if bill is not None:
+                return bill
+
+        # NOTE: the worker holding the lock failed or took too long,
+        # so compute the bill anyway
+
+    try:
+        bill = yield COMPUTE
+        cache.set(key, bill, timeout=settings.BILL_CACHE_TIMEOUT)
+        return bill
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def invalidate_telephone_bills(calls):
+    """
+    Invalidates cached bills affected by the given calls, an iterable
+    of (source, end_timestamp) pairs. Must be called only after the
+    calls were committed.
+    """
+    cache = caches[settings.BILL_CACHE]
+    periods = {(source, end_timestamp.strftime('%Y%m')) for source, end_timestamp in calls}
+    if periods:
+        cache.set_many({_version_key(subscriber, reference_period): uuid.uuid4().hex
+                        for subscriber, reference_period in periods}, timeout=None)
+
+
+def invalidate_reference_periods(reference_periods):
+    """
+    Invalidates the cached bills of every subscriber for the given
+    reference periods (YYYYMM), e.g. once their calls were pruned. Must
+    be called only after that was committed.
+    """
+    cache = caches[settings.BILL_CACHE]
+    if reference_periods:
+        cache.set_many({_period_version_key(reference_period): uuid.uuid4().hex
+                        for reference_period in reference_periods}, timeout=None)
+
+
+@contextmanager
+def _closing_on_error(steps):
+    # NOTE: releases the lock right away instead of when the generator
+    # is collected
+    try:
+        yield
+    except BaseException:
+        steps.close()
+        raise
+
+
+def _bill_key(cache, subscriber, reference_period):
+    version, period_version = _get_versions(cache, [_version_key(subscriber, reference_period),
+                                                    _period_version_key(reference_period)])
+    return f'call_records:bill:{subscriber}:{reference_period}:{period_version}:{version}'
+
+
+def _version_key(subscriber, reference_period):
+    return f'call_records:bill_version:{subscriber}:{reference_period}'
+
+
+def _period_version_key(reference_period):
+    return f'call_records:bill_period_version:{reference_period}'
+
+
+def _get_versions(cache, keys):
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # NOTE: versions are random tokens instead of counters so an
+        # evicted version can never be reused by mistake
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+        versions.update(cache.get_many(missing))
+
+    return [versions.get(key) for key in keys]
@@ -0,0 +1,64 @@
+"""
+System checks of the call records settings.
+
+Gunicorn and uvicorn run several worker processes, so caches read by
+one worker and written by another must be shared between them: a local
+memory cache would serve stale bills after a late call was paired by
+another worker, and the status of a buffered record would only be
+known to the worker it was posted to.
+
+Servers don't run system checks, so the WSGI and ASGI entry points call
+`check_settings` on startup.
+"""
+__all__ = ['check_settings', 'check_bill_cache', 'check_status_cache']
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+
+
+# NOTE: cache backends only seen by the process writing them
+_LOCAL_CACHE_BACKENDS = {'django.core.cache.backends.locmem.LocMemCache'}
+_DUMMY_CACHE_BACKEND = 'django.core.cache.backends.dummy.DummyCache'
+
+
+def check_settings():
+    """
+    Raises ImproperlyConfigured if any of the checks below fails
+    """
+    errors = [error for error in check_bill_cache(None) + check_status_cache(None) if error.is_serious()]
+    if errors:
+        raise ImproperlyConfigured('; '.join(f'{error.msg} ({error.hint})' for error in errors))
+
+
+@checks.register(checks.Tags.caches)
+def check_bill_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get(settings.BILL_CACHE, {}).get('BACKEND')
+    if backend in _LOCAL_CACHE_BACKENDS:
+        return [checks.Error(
+            f'BILL_CACHE "{settings.BILL_CACHE}" uses {backend}, which is not shared between processes',
+            hint='Use a shared cache, like memcached, or DummyCache to disable caching bills',
+            id='call_records.E001',
+        )]
+
+    return []
+
+
+@checks.register(checks.Tags.caches)
+def check_status_cache(app_configs, **kwargs):
+    # NOTE: imported here since the buffer imports the models
+    from sparrow.call_records.buffer import BUFFERED
+
+    if settings.CALL_RECORDS_INGESTION_MODE != BUFFERED:
+        return []
+
+    backend = settings.CACHES.get(settings.CALL_RECORDS_STATUS_CACHE, {}).get('BACKEND')
+    if backend in _LOCAL_CACHE_BACKENDS or backend == _DUMMY_CACHE_BACKEND:
+        return [checks.Error(
+            f'CALL_RECORDS_STATUS_CACHE "{settings.CALL_RECORDS_STATUS_CACHE}" uses {backend}, which doesn\'t share '
+            f'values between processes, so the status of buffered records would be lost',
+            hint='Use a shared cache, like memcached, or the "sync" CALL_RECORDS_INGESTION_MODE',
+            id='call_records.E002',
+        )]
+
+    return []
@@ -1,4 +1,4 @@
-__all__ = ['CurrentMonthForbiddenError', 'InvalidReferencePeriodError']
+__all__ = ['CurrentMonthForbiddenError', 'InvalidReferencePeriodError', 'InvalidCallRecordError', 'PricingError']
 
 
 class TelephoneBillError(Exception):
@@ -18,3 +18,21 @@ class CurrentMonthForbiddenError(TelephoneBillError):
 class InvalidReferencePeriodError(TelephoneBillError):
     def __init__(self, invalid_period):
         super().__init__(f'Invalid reference period {invalid_period}, should be string in the format YYYYMM')
+
+
+class InvalidCallRecordError(Exception):
+    """
+    Raised when a call record fails validation outside of the REST API.
+    `errors` maps each faulty field to a list of messages.
+    """
+
+    def __init__(self, errors):
+        super().__init__(f'Invalid call record: {errors}')
+        self.errors = errors
+
+
+class PricingError(Exception):
+    """
+    Raised when a call can't be priced, e.g. there's no tariff in
+    effect when it started.
+    """
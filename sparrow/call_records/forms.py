@@ -1,9 +1,12 @@
-__all__ = ['TelephoneBillForm']
+__all__ = ['TelephoneBillForm', 'CallRecordsFilterForm']
 
 from django import forms
+from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
-from sparrow.call_records.models import phone_number_validator
+from sparrow.call_records.models import CallRecord, phone_number_validator
 
 
 class TelephoneBillForm(forms.Form):
@@ -12,7 +15,44 @@ class TelephoneBillForm(forms.Form):
     ])
     reference_period = forms.CharField(max_length=6, validators=[
         RegexValidator(
-            regex=r'^\d{6}$',
+            regex=r'^[0-9]{6}$',
             message='Reference period should be in the YYYYMM format'
         )
     ], required=False)
+    # NOTE: streamed bills are read and sent in chunks, bypassing the
+    # cache, for subscribers with huge bills
+    stream = forms.BooleanField(required=False)
+
+
+class ISODateTimeField(forms.DateTimeField):
+    """
+    A DateTimeField accepting ISO 8601 values, like the ones in call
+    records ("2018-01-02T22:10:56Z"), or dates meaning their midnight.
+    Naive values are in TIME_ZONE
+    """
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+
+        try:
+            value = value.strip()
+            date = parse_date(value)
+            value = timezone.datetime.combine(date, timezone.datetime.min.time()) if date else parse_datetime(value)
+        except ValueError:
+            value = None
+        if value is None:
+            raise ValidationError(self.error_messages['invalid'], code='invalid')
+
+        return value if timezone.is_aware(value) else timezone.make_aware(value)
+
+
+class CallRecordsFilterForm(forms.Form):
+    source = forms.CharField(max_length=11, validators=[
+        phone_number_validator
+    ], required=False)
+    call_id = forms.IntegerField(min_value=0, required=False)
+    type = forms.ChoiceField(choices=CallRecord.RECORD_TYPES, required=False)
+    # NOTE: records with timestamp_after <= timestamp < timestamp_before
+    timestamp_after = ISODateTimeField(required=False)
+    timestamp_before = ISODateTimeField(required=False)
@@ -0,0 +1,174 @@
+"""
+Synthetic call records for scale testing.
+
+`CallRecordsGenerator` yields the start and end records of millions of
+calls the way switches would send them: in the order events happen,
+with a configurable share of orphan halves, duplicates (sent again a
+little later, like retries) and shuffled arrivals. Subscribers make
+calls with a Zipf-like frequency, so a few of them get huge bills, and
+some calls are made to cross tariff band and month boundaries.
+
+Output is reproducible from `seed`, and memory stays constant however
+many calls are generated: calls are drawn in chunks, in start order,
+and only calls in progress are kept around.
+"""
+__all__ = ['CallRecordsGenerator', 'phone_number']
+
+import datetime
+import heapq
+import math
+
+import numpy as np
+
+from sparrow.call_records.models import CallRecord
+
+
+# NOTE: bands of the standard tariff, in seconds of the day (UTC)
+TARIFF_BOUNDARIES = (6 * 3600, 22 * 3600)
+
+# NOTE: number of area codes, from 11 to 99
+AREA_CODES = 89
+
+
+def phone_number(subscriber):
+    """
+    Returns the phone number of the nth subscriber, valid under
+    `phone_number_validator`: an area code followed by 8 digits, or 9
+    starting with 9 like mobile phones
+    """
+    area_code, number = 11 + subscriber % AREA_CODES, subscriber // AREA_CODES
+    return f'{area_code}9{number:08d}' if number % 2 else f'{area_code}{number:08d}'
+
+
+class CallRecordsGenerator:
+    def __init__(self, *, calls, subscribers, start, end, zipf_exponent=1.1, boundary_ratio=0.05,
+                 orphan_ratio=0.01, duplicate_ratio=0.01, shuffle_window=1000, first_call_id=1, seed=0,
+                 chunk_size=10000):
+        """
+        Generates `calls` calls between `start` and `end` (aware
+        datetimes) among `subscribers` subscribers.
+
+        `boundary_ratio`, `orphan_ratio` and `duplicate_ratio` are the
+        shares of calls crossing a tariff band (or month) boundary,
+        missing one of their records and having a record sent twice.
+        Records are shuffled within windows of `shuffle_window` records.
+        """
+        self.calls = calls
+        self.subscribers = subscribers
+        self.start = int(start.timestamp())
+        self.end = int(end.timestamp())
+        self.zipf_exponent = zipf_exponent
+        self.boundary_ratio = boundary_ratio
+        self.orphan_ratio = orphan_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.shuffle_window = shuffle_window
+        self.first_call_id = first_call_id
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.stats = {'records': 0, 'orphans': 0, 'duplicates': 0}
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed)
+        records = self._ordered_records(rng)
+        if self.shuffle_window > 1:
+            records = self._shuffled(rng, records)
+
+        for record in records:
+            self.stats['records'] += 1
+            yield record
+
+    def _ordered_records(self, rng):
+        """
+        Yields records in the order their events happen
+        """
+        weights = np.arange(1, self.subscribers + 1, dtype=np.float64) ** -self.zipf_exponent
+        cumulative_weights = np.cumsum(weights) / weights.sum()
+        seconds_per_call = (self.end - self.start) / max(self.calls, 1)
+
+        # NOTE: (timestamp, sequence, record), the sequence keeping the
+        # order of records with the same timestamp stable
+        events = []
+        sequence = 0
+        for offset in range(0, self.calls, self.chunk_size):
+            size = min(self.chunk_size, self.calls - offset)
+            # NOTE: each chunk covers its share of the period
+            chunk_start = self.start + offset * seconds_per_call
+            starts = np.sort(rng.uniform(chunk_start, chunk_start + size * seconds_per_call, size))
+            last_start = int(starts[-1])
+            # NOTE: a median of 90s, and a long tail
+            durations = np.maximum(1, rng.lognormal(math.log(90), 1, size)).astype(np.int64)
+            sources = np.minimum(np.searchsorted(cumulative_weights, rng.random(size)), self.subscribers - 1)
+            destinations = rng.integers(0, self.subscribers, size)
+            crosses_boundary = rng.random(size) < self.boundary_ratio
+            boundary_overlaps = rng.integers(1, 600, size)
+            orphans = rng.random(size) < self.orphan_ratio
+            orphan_halves = rng.integers(0, 2, size)
+            duplicates = rng.random(size) < self.duplicate_ratio
+            duplicate_halves = rng.integers(0, 2, size)
+            duplicate_delays = rng.exponential(60, size).astype(np.int64) + 1
+
+            for i in range(size):
+                start = int(starts[i])
+                duration = int(durations[i])
+                if crosses_boundary[i]:
+                    duration = self._next_boundary(start) - start + int(boundary_overlaps[i])
+
+                call_id = self.first_call_id + offset + i
+                destination = int(destinations[i])
+                if destination == sources[i]:
+                    destination = (destination + 1) % self.subscribers
+                halves = [
+                    (start, {'type': CallRecord.START, 'call_id': call_id, 'timestamp': start,
+                             'source': phone_number(int(sources[i])), 'destination': phone_number(destination)}),
+                    (start + duration, {'type': CallRecord.END, 'call_id': call_id,
+                                        'timestamp': start + duration}),
+                ]
+
+                if orphans[i]:
+                    del halves[orphan_halves[i]]
+                    self.stats['orphans'] += 1
+                elif duplicates[i]:
+                    timestamp, record = halves[duplicate_halves[i]]
+                    halves.append((timestamp + int(duplicate_delays[i]), record))
+                    self.stats['duplicates'] += 1
+
+                for timestamp, record in halves:
+                    heapq.heappush(events, (timestamp, sequence, record))
+                    sequence += 1
+
+            # NOTE: every event left happens after the last start so far
+            while events and events[0][0] <= last_start:
+                yield _with_datetime(heapq.heappop(events)[2])
+
+        while events:
+            yield _with_datetime(heapq.heappop(events)[2])
+
+    def _shuffled(self, rng, records):
+        window = []
+        for record in records:
+            window.append(record)
+            if len(window) == self.shuffle_window:
+                index = rng.integers(len(window))
+                window[index], window[-1] = window[-1], window[index]
+                yield window.pop()
+
+        rng.shuffle(window)
+        yield from window
+
+    def _next_boundary(self, timestamp):
+        """
+        Returns the next tariff band boundary after `timestamp`, or the
+        next month if it starts within a day
+        """
+        day = timestamp - timestamp % 86400
+        boundary = next((day + seconds for seconds in TARIFF_BOUNDARIES if day + seconds > timestamp),
+                        day + 86400 + TARIFF_BOUNDARIES[0])
+
+        date = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        next_month = datetime.datetime(date.year + date.month // 12, date.month % 12 + 1, 1,
+                                       tzinfo=datetime.timezone.utc).timestamp()
+        return int(next_month) if next_month - timestamp < 86400 else boundary
+
+
+def _with_datetime(record):
+    return dict(record, timestamp=datetime.datetime.fromtimestamp(record['timestamp'], datetime.timezone.utc))
@@ -0,0 +1,227 @@
+__all__ = ['insert_call_records', 'count_ingested_records', 'count_invalid_records', 'pair_call_records',
+           'priceable_calls', 'CREATED', 'DUPLICATE', 'INVALID', 'INSERT_CALL_RECORDS_QUERY',
+           'PAIRED_CALL_RECORDS_QUERY', 'INSERT_CALLS_QUERY']
+
+import logging
+
+from django.db import connection, transaction
+
+from sparrow.call_records.cache import invalidate_telephone_bills
+from sparrow.call_records.metrics import INGESTED
+from sparrow.call_records.models import CallRecord, encode_phone_number
+from sparrow.call_records.pricing import NO_TARIFF, price_calls
+
+
+logger = logging.getLogger(__name__)
+
+
+# NOTE: outcomes reported for each ingested record
+CREATED = 'created'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+
+# NOTE: invalid records are counted by the views rejecting them
+_CREATED_RECORDS = INGESTED.labels(CREATED)
+_DUPLICATE_RECORDS = INGESTED.labels(DUPLICATE)
+_INVALID_RECORDS = INGESTED.labels(INVALID)
+
+
+def insert_call_records(records, *, batch_size):
+    """
+    Inserts already validated call records using one multi-row INSERT
+    per batch of `batch_size` records. Records are dicts with the keys
+    `type`, `call_id`, `timestamp`, `source` and `destination`, the
+    last two being optional for END records.
+
+    Duplicates, either already in the database or repeated within
+    `records`, are skipped. Returns a list with the same length and
+    order as `records`, containing the id of each created record or
+    None for duplicates.
+    """
+    ids = []
+    for offset in range(0, len(records), batch_size):
+        batch = records[offset:offset + batch_size]
+        with transaction.atomic():
+            batch_ids = _insert_batch(batch)
+            pair_call_records([record['call_id'] for record, record_id in zip(batch, batch_ids) if record_id])
+
+        created = sum(1 for record_id in batch_ids if record_id)
+        count_ingested_records(created=created, duplicates=len(batch_ids) - created)
+        ids.extend(batch_ids)
+
+    return ids
+
+
+def count_ingested_records(*, created=0, duplicates=0):
+    """
+    Counts records created and duplicated, in the ingestion metrics
+    """
+    _CREATED_RECORDS.inc(created)
+    _DUPLICATE_RECORDS.inc(duplicates)
+
+
+def count_invalid_records(count=1):
+    """
+    Counts records rejected by validation, in the ingestion metrics
+    """
+    _INVALID_RECORDS.inc(count)
+
+
+def pair_call_records(call_ids):
+    """
+    Creates a Call for each of the given call ids having both start and
+    end records, calls already created are skipped. Returns the number
+    of calls created.
+
+    Every ingestion path must call this in the transaction inserting the
+    new records, so records are never left behind without their call.
+    Calls that can't be priced, starting before the first tariff, are
+    skipped and their records left unpaired, instead of failing others.
+
+    If both records of a pair are ingested concurrently, neither sees
+    the other until committed, so their call is left to the
+    `reconcile_call_records` command (see
+    `sparrow.call_records.reconciliation`). Cached bills the new calls
+    belong to are invalidated on commit.
+    """
+    call_ids = sorted(set(call_ids))
+    if not call_ids:
+        return 0
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(PAIRED_CALL_RECORDS_QUERY, {'call_ids': call_ids})
+        rows = cursor.fetchall()
+        rows = priceable_calls(rows, price_calls([row[3].timestamp() for row in rows],
+                                                 [row[4].timestamp() for row in rows]))
+        if not rows:
+            return 0
+
+        values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s)'] * len(rows))
+        cursor.execute(INSERT_CALLS_QUERY.format(values=values), [param for row in rows for param in row])
+        calls = cursor.fetchall()
+
+    transaction.on_commit(lambda: invalidate_telephone_bills(calls))
+    return len(calls)
+
+
+def priceable_calls(rows, priced):
+    """
+    Returns the parameters of INSERT_CALLS_QUERY for each row of
+    PAIRED_CALL_RECORDS_QUERY priced by `priced`, skipping calls that
+    can't be priced
+    """
+    calls = []
+    for (call_id, source, destination, start_timestamp, end_timestamp), price, tariff_id \
+            in zip(rows, priced.prices.tolist(), priced.tariff_ids.tolist()):
+        if tariff_id == NO_TARIFF:
+            logger.warning('Call %d starting at %s can\'t be priced, no tariff was in effect',
+                           call_id, start_timestamp.isoformat())
+            continue
+
+        calls.append([call_id, source, destination, start_timestamp, end_timestamp,
+                      end_timestamp - start_timestamp, price, tariff_id])
+
+    return calls
+
+
+# NOTE: call records are stored compactly, see CallRecord. Records of
+# archived calls were deleted, so they're told duplicated by their call
+# id (see ArchivedCallId). Phone numbers are cast since they're all
+# NULL in batches of END records
+INSERT_CALL_RECORDS_QUERY = """
+INSERT INTO call_records_callrecord
+    (is_start, call_id, timestamp, source, destination)
+SELECT
+    is_start, call_id, timestamp, source::bigint, destination::bigint
+FROM
+    (VALUES {values}) AS records (is_start, call_id, timestamp, source, destination)
+WHERE
+    NOT EXISTS (
+        SELECT FROM call_records_archivedcallid archived WHERE archived.call_id = records.call_id
+    )
+ON CONFLICT (is_start, call_id) DO NOTHING
+RETURNING id, is_start, call_id
+"""
+
+
+# NOTE: phone numbers are decoded (see PhoneNumberField) since calls
+# keep them as text. Calls ending in pruned months (see PruningState)
+# would land in the default partition and be billed again, so their
+# records are kept unpaired instead
+PAIRED_CALL_RECORDS_QUERY = """
+SELECT
+    start_records.call_id,
+    substr(start_records.source::text, 2),
+    substr(start_records.destination::text, 2),
+    start_records.timestamp,
+    end_records.timestamp
+FROM
+    call_records_callrecord start_records
+    JOIN call_records_callrecord end_records
+        ON NOT end_records.is_start
+        AND end_records.call_id = start_records.call_id
+WHERE
+    start_records.is_start
+    AND start_records.call_id = ANY(%(call_ids)s)
+    AND end_records.timestamp >= coalesce(
+        (SELECT pruned_before FROM call_records_pruningstate WHERE id = 1), '-infinity'
+    )
+"""
+
+# NOTE: the calls created are added to the bill summaries of their
+# subscribers in the same statement (see BillSummary). Summaries are
+# upserted in order, so concurrent ingestions don't deadlock
+INSERT_CALLS_QUERY = """
+WITH calls AS (
+    INSERT INTO call_records_call
+        (call_id, source, destination, start_timestamp, end_timestamp, duration, price, tariff_id)
+    VALUES
+        {values}
+    ON CONFLICT (call_id, end_timestamp) DO NOTHING
+    RETURNING source, end_timestamp, duration, price
+),
+summaries AS (
+    INSERT INTO call_records_billsummary (subscriber, reference_period, calls, duration, price)
+    SELECT
+        source,
+        to_char(end_timestamp AT TIME ZONE 'UTC', 'YYYYMM') AS reference_period,
+        count(*),
+        sum(duration),
+        sum(price)
+    FROM
+        calls
+    GROUP BY
+        source, reference_period
+    ORDER BY
+        source, reference_period
+    ON CONFLICT (subscriber, reference_period) DO UPDATE SET
+        calls = call_records_billsummary.calls + excluded.calls,
+        duration = call_records_billsummary.duration + excluded.duration,
+        price = call_records_billsummary.price + excluded.price
+)
+SELECT source, end_timestamp FROM calls
+"""
+
+
+def _insert_batch(records):
+    if not records:
+        return []
+
+    params = []
+    for record in records:
+        params.extend([
+            record['type'] == CallRecord.START,
+            record['call_id'],
+            record['timestamp'],
+            encode_phone_number(record.get('source')),
+            encode_phone_number(record.get('destination')),
+        ])
+
+    query = INSERT_CALL_RECORDS_QUERY.format(values=', '.join(['(%s, %s, %s, %s, %s)'] * len(records)))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(query, params)
+        created = {(is_start, call_id): record_id for record_id, is_start, call_id in cursor.fetchall()}
+
+    # NOTE: a (type, call_id) pair repeated within the batch was only
+    # inserted once, so only its first occurrence is reported as created
+    return [created.pop((record['type'] == CallRecord.START, record['call_id']), None) for record in records]
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from sparrow.call_records import partitions
+from sparrow.call_records.archive import archive_period
+
+
+class Command(BaseCommand):
+    help = ('Moves the calls of the monthly partitions older than the given reference period, along with their '
+            'call records, to the compressed archive. Bills still read them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, metavar='YYYYMM',
+                            help='Calls of months before this one are archived. At most the current month')
+
+    def handle(self, *args, **options):
+        try:
+            before = timezone.datetime.strptime(options['before'], '%Y%m').date()
+        except ValueError:
+            raise CommandError('--before should be in the YYYYMM format')
+
+        if before > timezone.now().date().replace(day=1):
+            raise CommandError('--before should be at most the current month, whose calls are not billed yet')
+
+        with connection.cursor() as cursor:
+            months = [month for month in partitions.list_partitions(cursor) if month < before]
+
+        for month in months:
+            started_at = time.monotonic()
+            stats = archive_period(f'{month:%Y%m}')
+            self.stdout.write(f'Archived {month:%Y%m} in {time.monotonic() - started_at:.2f}s: {stats["calls"]} calls '
+                              f'of {stats["subscribers"]} subscribers, {stats["records"]} call records deleted')
@@ -0,0 +1,37 @@
+from dateutil.relativedelta import relativedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from sparrow.call_records import partitions
+
+
+class Command(BaseCommand):
+    help = ('Creates the monthly partitions of call_records_call for the current and next months, '
+            'as well as for any month with calls in the default partition. Meant to be run periodically')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3,
+                            help='Number of months after the current one to create partitions for')
+
+    def handle(self, *args, **options):
+        current_month = timezone.now().date().replace(day=1)
+        months = {current_month + relativedelta(months=i) for i in range(options['ahead'] + 1)}
+
+        with connection.cursor() as cursor:
+            cursor.execute(_DEFAULT_PARTITION_MONTHS_QUERY)
+            months.update(month for month, in cursor.fetchall())
+
+            for month in sorted(months):
+                with transaction.atomic():
+                    if partitions.create_partition(cursor, month):
+                        self.stdout.write(f'Created {partitions.partition_name(month)}')
+
+
+_DEFAULT_PARTITION_MONTHS_QUERY = f"""
+SELECT DISTINCT
+    date_trunc('month', end_timestamp AT TIME ZONE 'UTC')::date
+FROM
+    {partitions.DEFAULT_PARTITION}
+"""
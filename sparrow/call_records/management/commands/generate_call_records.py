@@ -0,0 +1,105 @@
+import datetime
+import json
+import sys
+import time
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand, CommandError
+
+from sparrow.call_records.generator import CallRecordsGenerator
+from sparrow.call_records.ingestion import insert_call_records
+
+
+class Command(BaseCommand):
+    help = ('Generates synthetic call records for scale testing, as NDJSON (ready for import_call_records) '
+            'or straight into the database. The same seed always generates the same records')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=1000000, help='Number of calls')
+        parser.add_argument('--subscribers', type=int, default=100000, help='Number of subscribers')
+        parser.add_argument('--from', dest='first_period', required=True, metavar='YYYYMM',
+                            help='First month with calls')
+        parser.add_argument('--to', dest='last_period', metavar='YYYYMM',
+                            help='Last month with calls, the first one by default')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Exponent of the call frequency of subscribers, 0 for uniform')
+        parser.add_argument('--boundary-calls', type=float, default=0.05,
+                            help='Share of calls crossing a tariff band or month boundary')
+        parser.add_argument('--orphans', type=float, default=0.01,
+                            help='Share of calls missing their start or end record')
+        parser.add_argument('--duplicates', type=float, default=0.01,
+                            help='Share of calls with a record sent twice')
+        parser.add_argument('--shuffle-window', type=int, default=1000,
+                            help='Records are shuffled within windows of this many records, 0 to keep them in order')
+        parser.add_argument('--first-call-id', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='-', help='NDJSON file to write, "-" for stdout (the default)')
+        parser.add_argument('--database', action='store_true',
+                            help='Insert records into the database instead, pairing calls like the API does')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Number of records inserted at a time with --database')
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.datetime.strptime(options['first_period'], '%Y%m').replace(tzinfo=datetime.timezone.utc)
+            end = datetime.datetime.strptime(options['last_period'] or options['first_period'], '%Y%m').replace(
+                tzinfo=datetime.timezone.utc) + relativedelta(months=1)
+        except ValueError:
+            raise CommandError('--from and --to should be in the YYYYMM format')
+
+        if end <= start:
+            raise CommandError('--to should not be before --from')
+
+        generator = CallRecordsGenerator(
+            calls=options['calls'],
+            subscribers=options['subscribers'],
+            start=start,
+            end=end,
+            zipf_exponent=options['zipf'],
+            boundary_ratio=options['boundary_calls'],
+            orphan_ratio=options['orphans'],
+            duplicate_ratio=options['duplicates'],
+            shuffle_window=options['shuffle_window'],
+            first_call_id=options['first_call_id'],
+            seed=options['seed'],
+        )
+
+        started_at = time.monotonic()
+        if options['database']:
+            report = self.stdout
+            inserted = self._insert(generator, options['batch_size'])
+        else:
+            report = self.stderr if options['output'] == '-' else self.stdout
+            inserted = None
+            self._write(generator, options['output'])
+
+        elapsed = time.monotonic() - started_at
+        report.write(
+            '{records} records generated in {elapsed:.2f}s ({rate:.0f} records/s): '
+            '{orphans} orphan halves, {duplicates} duplicates'.format(
+                elapsed=elapsed, rate=generator.stats['records'] / elapsed if elapsed else 0, **generator.stats
+            ) + (f', {inserted} inserted' if inserted is not None else '')
+        )
+
+    def _write(self, generator, path):
+        output_file = sys.stdout if path == '-' else open(path, 'w')
+        try:
+            for record in generator:
+                record['timestamp'] = record['timestamp'].strftime('%Y-%m-%dT%H:%M:%SZ')
+                output_file.write(json.dumps(record))
+                output_file.write('\n')
+        finally:
+            if output_file is not sys.stdout:
+                output_file.close()
+
+    def _insert(self, generator, batch_size):
+        inserted = 0
+        batch = []
+        for record in generator:
+            batch.append(record)
+            if len(batch) == batch_size:
+                inserted += sum(1 for record_id in insert_call_records(batch, batch_size=batch_size) if record_id)
+                batch = []
+
+        inserted += sum(1 for record_id in insert_call_records(batch, batch_size=batch_size) if record_id)
+        return inserted
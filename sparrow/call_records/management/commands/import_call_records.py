@@ -0,0 +1,164 @@
+import csv
+import io
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from sparrow.call_records.exceptions import InvalidCallRecordError
+from sparrow.call_records.ingestion import pair_call_records
+from sparrow.call_records.validation import validate_call_record
+
+
+FORMATS = ('ndjson', 'csv')
+COLUMNS = ('type', 'call_id', 'timestamp', 'source', 'destination')
+
+
+class Command(BaseCommand):
+    help = ('Imports call records from a NDJSON or CSV file (or stdin) using COPY. '
+            'Records already in the database are skipped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or "-" for stdin')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Input format. Inferred from the file extension if missing')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Number of records copied and merged at a time')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        input_format = options['format'] or _infer_format(options['path'])
+        started_at = time.monotonic()
+        stats = {'lines': 0, 'imported': 0, 'duplicates': 0, 'rejected': 0}
+
+        with _open(options['path']) as input_file:
+            with connection.cursor() as cursor:
+                cursor.execute(_CREATE_STAGING_TABLE_QUERY)
+                try:
+                    for batch in _batches(self._validated_records(input_file, input_format, stats),
+                                          options['batch_size']):
+                        imported = _copy_and_merge(cursor, batch)
+                        stats['imported'] += imported
+                        stats['duplicates'] += len(batch) - imported
+                finally:
+                    cursor.execute('DROP TABLE IF EXISTS call_records_staging')
+
+        elapsed = time.monotonic() - started_at
+        self.stdout.write(
+            '{lines} lines read in {elapsed:.2f}s ({rate:.0f} lines/s): '
+            '{imported} imported, {duplicates} duplicates, {rejected} rejected'.format(
+                elapsed=elapsed, rate=stats['lines'] / elapsed if elapsed else 0, **stats
+            )
+        )
+
+    def _validated_records(self, input_file, input_format, stats):
+        reader = csv.DictReader(input_file) if input_format == 'csv' else input_file
+        for line_number, line in enumerate(reader, start=1):
+            if input_format == 'ndjson' and not line.strip():
+                continue
+
+            stats['lines'] += 1
+            try:
+                data = json.loads(line) if input_format == 'ndjson' else line
+                if not isinstance(data, dict):
+                    raise InvalidCallRecordError({'non_field_errors': ['Expected a JSON object']})
+                yield validate_call_record(data)
+            except (ValueError, InvalidCallRecordError) as e:
+                stats['rejected'] += 1
+                if self.verbosity > 1:
+                    self.stderr.write(f'Line {line_number} rejected: {getattr(e, "errors", e)}')
+
+
+_CREATE_STAGING_TABLE_QUERY = """
+CREATE TEMPORARY TABLE IF NOT EXISTS call_records_staging (
+    type        varchar(5)  NOT NULL,
+    call_id     integer     NOT NULL,
+    timestamp   timestamptz NOT NULL,
+    source      varchar(11) NOT NULL,
+    destination varchar(11) NOT NULL
+)
+"""
+
+# NOTE: END records have empty source and destination, which
+# COPY would otherwise read as NULL
+_COPY_STAGING_TABLE_QUERY = f"""
+COPY call_records_staging ({', '.join(COLUMNS)})
+FROM STDIN
+WITH (FORMAT csv, FORCE_NOT_NULL (source, destination))
+"""
+
+# NOTE: encodes records as stored by CallRecord, see PhoneNumberField.
+# Records of archived calls are duplicates, see ArchivedCallId
+_MERGE_STAGING_TABLE_QUERY = """
+INSERT INTO call_records_callrecord
+    (is_start, call_id, timestamp, source, destination)
+SELECT
+    type = 'start',
+    call_id,
+    timestamp,
+    ('1' || nullif(source, ''))::bigint,
+    ('1' || nullif(destination, ''))::bigint
+FROM
+    call_records_staging staging
+WHERE
+    NOT EXISTS (
+        SELECT FROM call_records_archivedcallid archived WHERE archived.call_id = staging.call_id
+    )
+ON CONFLICT (is_start, call_id) DO NOTHING
+RETURNING call_id
+"""
+
+
+def _copy_and_merge(cursor, records):
+    """
+    COPYs `records` into the staging table, merges them into
+    call_records_callrecord and pairs the new records into calls.
+    Returns the number of records inserted.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        writer.writerow([record[column] for column in COLUMNS])
+    buffer.seek(0)
+
+    with transaction.atomic():
+        cursor.execute('TRUNCATE call_records_staging')
+        cursor.copy_expert(_COPY_STAGING_TABLE_QUERY, buffer)
+        cursor.execute(_MERGE_STAGING_TABLE_QUERY)
+        call_ids = [call_id for call_id, in cursor.fetchall()]
+        pair_call_records(call_ids)
+
+    return len(call_ids)
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _infer_format(path):
+    for input_format in FORMATS:
+        if path.endswith(f'.{input_format}') or (input_format == 'ndjson' and path.endswith('.jsonl')):
+            return input_format
+
+    raise CommandError('Could not infer the input format, please use --format')
+
+
+def _open(path):
+    if path == '-':
+        # NOTE: stdin must not be closed when we're done with it
+        return open(sys.stdin.fileno(), encoding='utf-8', newline='', closefd=False)
+
+    try:
+        return open(path, encoding='utf-8', newline='')
+    except OSError as e:
+        raise CommandError(e)
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from sparrow.core.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = ('Prints a token profiling the requests sent with it in the X-Profile header, valid for '
+            'PROFILING_TOKEN_MAX_AGE seconds. Profiles are saved to PROFILING_DIR')
+
+    def handle(self, *args, **options):
+        if not settings.PROFILING_DIR:
+            self.stderr.write('PROFILING_DIR is not set, requests won\'t be profiled')
+        self.stdout.write(make_token())
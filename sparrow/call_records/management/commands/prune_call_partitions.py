@@ -0,0 +1,53 @@
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from sparrow.call_records import partitions
+from sparrow.call_records.cache import invalidate_reference_periods
+from sparrow.call_records.models import BillSummary, CallArchive, PruningState
+
+
+class Command(BaseCommand):
+    help = ('Detaches (or drops) the monthly partitions of call_records_call older than the given '
+            'reference period, and deletes archived calls of those months. Calls in them will no longer be part '
+            'of any bill, cached or not, or bill summary, and calls ending in them are no longer created')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, metavar='YYYYMM',
+                            help='Partitions of months before this one are detached or dropped')
+        parser.add_argument('--drop', action='store_true',
+                            help='Drop partitions along with their calls instead of detaching them')
+
+    def handle(self, *args, **options):
+        try:
+            before = timezone.datetime.strptime(options['before'], '%Y%m').date()
+        except ValueError:
+            raise CommandError('--before should be in the YYYYMM format')
+
+        with connection.cursor() as cursor:
+            for month in partitions.list_partitions(cursor):
+                if month >= before:
+                    break
+
+                with transaction.atomic():
+                    if options['drop']:
+                        partitions.drop_partition(cursor, month)
+                        self.stdout.write(f'Dropped {partitions.partition_name(month)}')
+                    else:
+                        partitions.detach_partition(cursor, month)
+                        self.stdout.write(f'Detached {partitions.partition_name(month)}')
+                    BillSummary.objects.filter(reference_period=f'{month:%Y%m}').delete()
+                    CallArchive.objects.filter(reference_period=f'{month:%Y%m}').delete()
+                    self._prune_calls_before(month + relativedelta(months=1))
+                    transaction.on_commit(lambda month=month: invalidate_reference_periods([f'{month:%Y%m}']))
+
+    def _prune_calls_before(self, month):
+        # NOTE: calls of pruned months arriving late would land in the
+        # default partition and be billed, so they're no longer paired
+        pruned_before = timezone.datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+        state, created = PruningState.objects.select_for_update().get_or_create(
+            pk=1, defaults={'pruned_before': pruned_before})
+        if not created and state.pruned_before < pruned_before:
+            state.pruned_before = pruned_before
+            state.save()
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from sparrow.call_records.summaries import rebuild_bill_summaries
+
+
+class Command(BaseCommand):
+    help = ('Computes the bill summaries of a reference period, or of every period, again from their calls. '
+            'Creating calls waits until it is done')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', metavar='YYYYMM', help='Reference period to rebuild, every one by default')
+
+    def handle(self, *args, **options):
+        if options['period']:
+            try:
+                timezone.datetime.strptime(options['period'], '%Y%m')
+            except ValueError:
+                raise CommandError('--period should be in the YYYYMM format')
+
+        started_at = time.monotonic()
+        summaries = rebuild_bill_summaries(options['period'])
+        self.stdout.write(f'{summaries} bill summaries rebuilt in {time.monotonic() - started_at:.2f}s')
@@ -0,0 +1,55 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sparrow.call_records.reconciliation import open_call_records_report, reconcile
+
+
+def age(value):
+    units = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+    try:
+        return datetime.timedelta(**{units[value[-1]]: int(value[:-1])})
+    except (KeyError, ValueError, IndexError):
+        raise ValueError(value)
+
+
+class Command(BaseCommand):
+    help = ('Tracks call records still waiting for their pair, reading only the records added since its last '
+            'run, and reports calls open for too long and orphan records. Meant to run periodically')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000,
+                            help='Number of records reconciled, and committed, at a time')
+        parser.add_argument('--lookback', type=int, default=10000,
+                            help='Number of ids behind the last one reconciled read again, to catch up with '
+                                 'records committed out of order')
+        parser.add_argument('--long-call', type=age, default='6h', metavar='AGE',
+                            help='Age of start records without an end reported as long calls, e.g. 90m, 6h or 2d')
+        parser.add_argument('--orphan-age', type=age, default='7d', metavar='AGE',
+                            help='Age of records without a pair reported as orphans')
+        parser.add_argument('--limit', type=int, default=10, help='Number of long calls and orphans listed')
+
+    def handle(self, *args, **options):
+        if options['long_call'] >= options['orphan_age']:
+            raise CommandError('--long-call should be less than --orphan-age')
+
+        self.verbosity = options['verbosity']
+        stats = reconcile(batch_size=max(1, options['batch_size']), lookback=max(0, options['lookback']),
+                          progress=self._progress)
+        self.stdout.write(
+            '{reconciled} records reconciled in {elapsed:.2f}s up to id {high_water_mark}: '
+            '{opened} opened, {closed} closed'.format(**stats)
+        )
+
+        report = open_call_records_report(long_call_age=options['long_call'], orphan_age=options['orphan_age'],
+                                          limit=options['limit'])
+        self.stdout.write('{open_starts} start and {open_ends} end records waiting for their pair'.format(**report))
+        for name, description in [('long_calls', 'long calls'), ('orphans', 'orphans')]:
+            self.stdout.write(f'{report[name]["count"]} {description}')
+            for record in report[name]['oldest']:
+                self.stdout.write('    {type} record of call {call_id} at {timestamp:%Y-%m-%dT%H:%M:%SZ} {source}'
+                                  .format(**record).rstrip())
+
+    def _progress(self, high_water_mark):
+        if self.verbosity > 1:
+            self.stdout.write(f'Reconciled up to id {high_water_mark}')
@@ -0,0 +1,61 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from sparrow.call_records.billing import FileBillWriter, TableBillWriter, run_billing
+from sparrow.call_records.exceptions import TelephoneBillError
+
+
+class Command(BaseCommand):
+    help = ('Bills every subscriber with calls in the given reference period, in parallel. Bills are '
+            'written to the call_records_bill table or to NDJSON files, and subscribers already billed '
+            'are skipped, so an interrupted run resumes where it stopped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', required=True, metavar='YYYYMM', help='Reference period to bill')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of worker processes, the number of CPUs by default')
+        parser.add_argument('--shard-size', type=int, default=500,
+                            help='Number of subscribers billed, and written, at a time by a worker')
+        parser.add_argument('--output-dir',
+                            help='Write bills as NDJSON files to this directory instead of the database')
+        parser.add_argument('--restart', action='store_true',
+                            help='Discard bills of previous runs for the period and bill everyone again')
+
+    def handle(self, *args, **options):
+        period = options['period']
+        try:
+            timezone.datetime.strptime(period, '%Y%m')
+        except ValueError:
+            raise CommandError('--period should be in the YYYYMM format')
+
+        if options['output_dir']:
+            os.makedirs(options['output_dir'], exist_ok=True)
+            writer = FileBillWriter(period, options['output_dir'])
+        else:
+            writer = TableBillWriter(period)
+
+        if options['restart']:
+            writer.clear()
+
+        self.verbosity = options['verbosity']
+        try:
+            stats = run_billing(period, writer, workers=max(1, options['workers']),
+                                shard_size=max(1, options['shard_size']), progress=self._progress)
+        except TelephoneBillError as e:
+            raise CommandError(str(e))
+
+        elapsed = stats['elapsed']
+        self.stdout.write(
+            '{subscribers} subscribers billed ({calls} calls, {shards} shards) in {elapsed:.2f}s '
+            '({rate:.0f} bills/s, {calls_rate:.0f} calls/s): {skipped} already billed'.format(
+                rate=stats['subscribers'] / elapsed if elapsed else 0,
+                calls_rate=stats['calls'] / elapsed if elapsed else 0,
+                **stats
+            )
+        )
+
+    def _progress(self, bills, calls):
+        if self.verbosity > 1:
+            self.stdout.write(f'Shard written: {bills} bills, {calls} calls')
@@ -0,0 +1,17 @@
+"""
+Metrics of ingestion, telephone bills and pricing, exposed along with
+the HTTP ones by /metrics (see `sparrow.core.metrics`).
+"""
+__all__ = ['INGESTED', 'BILL_CALLS', 'BILL_QUERY_DURATION', 'PRICING_DURATION', 'CALLS_PRICED']
+
+from sparrow.core.metrics import Counter, Histogram
+
+
+INGESTED = Counter('call_records_ingested_total', 'Call records received, by outcome: created, duplicate or invalid',
+                   ['outcome'])
+BILL_CALLS = Histogram('telephone_bill_calls', 'Calls in each telephone bill read from the database',
+                       buckets=(0, 1, 10, 100, 1000, 10000, 100000, 1000000))
+BILL_QUERY_DURATION = Histogram('telephone_bill_query_duration_seconds',
+                                'Time to read and format the calls of a telephone bill')
+PRICING_DURATION = Histogram('pricing_duration_seconds', 'Time to price a batch of calls')
+CALLS_PRICED = Counter('calls_priced_total', 'Calls priced')
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:22
+
+import django.core.validators
+from django.db import migrations, models
+
+
+# NOTE: pairs the records stored so far in a single statement, instead
+# of loading them in memory. Prices follow a frozen copy of the pricing
+# rules in effect when calls were introduced, so this migration is not
+# affected by later changes in sparrow.call_records.api: 36 cents, plus
+# 9 cents per minute for calls starting between 6h and 22h, counting the
+# minutes of the duration modulo a day, like timedelta.seconds
+PAIR_EXISTING_CALL_RECORDS_SQL = """
+INSERT INTO call_records_call
+    (call_id, source, destination, start_timestamp, end_timestamp, duration, price)
+SELECT
+    start_records.call_id,
+    start_records.source,
+    start_records.destination,
+    start_records.timestamp,
+    end_records.timestamp,
+    end_records.timestamp - start_records.timestamp,
+    36 + CASE
+        WHEN extract(hour FROM start_records.timestamp AT TIME ZONE 'UTC') BETWEEN 6 AND 21 THEN 9
+        ELSE 0
+    END * (mod(mod(floor(extract(epoch FROM end_records.timestamp - start_records.timestamp))::bigint, 86400) + 86400,
+               86400) / 60)
+FROM
+    call_records_callrecord start_records
+    JOIN call_records_callrecord end_records
+        ON end_records.type = 'end'
+        AND end_records.call_id = start_records.call_id
+WHERE
+    start_records.type = 'start'
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0002_auto_20180905_0240'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Call',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('call_id', models.PositiveIntegerField(unique=True)),
+                ('source', models.CharField(max_length=11, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^\\d{10,11}$')])),
+                ('destination', models.CharField(max_length=11, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^\\d{10,11}$')])),
+                ('start_timestamp', models.DateTimeField()),
+                ('end_timestamp', models.DateTimeField()),
+                ('duration', models.DurationField()),
+                ('price', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['source', 'end_timestamp'], name='call_record_source_3f3d56_idx'),
+        ),
+        migrations.RunSQL(PAIR_EXISTING_CALL_RECORDS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0003_call'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='call',
+            name='call_record_source_3f3d56_idx',
+        ),
+        # NOTE: requires PostgreSQL 11+
+        migrations.RunSQL(
+            sql="""
+                CREATE INDEX call_records_call_bill_idx
+                ON call_records_call (source, end_timestamp)
+                INCLUDE (start_timestamp, destination, duration, price)
+            """,
+            reverse_sql='DROP INDEX call_records_call_bill_idx',
+        ),
+    ]
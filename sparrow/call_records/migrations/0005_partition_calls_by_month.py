@@ -0,0 +1,70 @@
+from django.db import migrations, models
+
+from sparrow.call_records import partitions
+
+
+# NOTE: call_records_call becomes a table partitioned by month of
+# end_timestamp. PostgreSQL requires the partition key to be part of
+# every unique constraint, hence (id, end_timestamp) as primary key and
+# (call_id, end_timestamp) instead of call_id being unique by itself.
+CREATE_PARTITIONED_TABLE_SQL = """
+ALTER TABLE call_records_call RENAME TO call_records_call_unpartitioned;
+
+CREATE TABLE call_records_call (
+    LIKE call_records_call_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+) PARTITION BY RANGE (end_timestamp);
+
+CREATE TABLE call_records_call_default PARTITION OF call_records_call DEFAULT;
+"""
+
+MOVE_CALLS_SQL = """
+INSERT INTO call_records_call
+SELECT * FROM call_records_call_unpartitioned;
+
+ALTER SEQUENCE call_records_call_id_seq OWNED BY call_records_call.id;
+DROP TABLE call_records_call_unpartitioned;
+
+ALTER TABLE call_records_call ADD PRIMARY KEY (id, end_timestamp);
+ALTER TABLE call_records_call ADD UNIQUE (call_id, end_timestamp);
+CREATE INDEX call_records_call_bill_idx
+ON call_records_call (source, end_timestamp)
+INCLUDE (start_timestamp, destination, duration, price);
+"""
+
+
+def create_partitions_for_existing_calls(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT DISTINCT date_trunc('month', end_timestamp AT TIME ZONE 'UTC')::date
+            FROM call_records_call_unpartitioned
+        """)
+        for month, in cursor.fetchall():
+            partitions.create_partition(cursor, month)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0004_call_covering_bill_index'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_PARTITIONED_TABLE_SQL),
+                migrations.RunPython(create_partitions_for_existing_calls),
+                migrations.RunSQL(MOVE_CALLS_SQL),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='call',
+                    name='call_id',
+                    field=models.PositiveIntegerField(),
+                ),
+                migrations.AlterUniqueTogether(
+                    name='call',
+                    unique_together={('call_id', 'end_timestamp')},
+                ),
+            ],
+        ),
+    ]
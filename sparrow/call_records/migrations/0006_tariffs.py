@@ -0,0 +1,69 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:34
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_initial_tariff(apps, schema_editor):
+    """
+    Creates the tariff in effect until now, which priced all calls so far:
+    - standing charge of R$ 0,36
+    - R$ 0,09 per minute between 6h00 and 22h00 (standard time)
+    - R$ 0,00 per minute between 22h00 and 6h00 (reduced tariff time)
+    """
+    Tariff = apps.get_model('call_records', 'Tariff')
+    TariffBand = apps.get_model('call_records', 'TariffBand')
+    Call = apps.get_model('call_records', 'Call')
+
+    tariff = Tariff.objects.create(effective_from=datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc),
+                                   standing_charge=36)
+    TariffBand.objects.bulk_create([
+        TariffBand(tariff=tariff, start_time=datetime.time(0, 0), call_charge=0),
+        TariffBand(tariff=tariff, start_time=datetime.time(6, 0), call_charge=9),
+        TariffBand(tariff=tariff, start_time=datetime.time(22, 0), call_charge=0),
+    ])
+    Call.objects.update(tariff=tariff)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0005_partition_calls_by_month'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tariff',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('effective_from', models.DateTimeField(unique=True)),
+                ('standing_charge', models.PositiveIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='tariff',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='calls', to='call_records.Tariff'),
+        ),
+        migrations.CreateModel(
+            name='TariffBand',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_time', models.TimeField()),
+                ('call_charge', models.PositiveIntegerField()),
+                ('tariff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='call_records.Tariff')),
+            ],
+            options={
+                'unique_together': {('tariff', 'start_time')},
+            },
+        ),
+        migrations.RunPython(create_initial_tariff, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='call',
+            name='tariff',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='calls', to='call_records.Tariff'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0006_tariffs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='callrecord',
+            index=models.Index(fields=['timestamp', 'id'], name='callrecord_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='callrecord',
+            index=models.Index(fields=['source', 'timestamp', 'id'], name='callrecord_source_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='callrecord',
+            index=models.Index(fields=['type', 'timestamp', 'id'], name='callrecord_type_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:54
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0007_call_record_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bill',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscriber', models.CharField(max_length=11, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^\\d{10,11}$')])),
+                ('reference_period', models.CharField(max_length=6)),
+                ('body', models.TextField()),
+                ('calls', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('subscriber', 'reference_period')},
+            },
+        ),
+    ]
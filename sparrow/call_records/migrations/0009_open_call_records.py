@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0008_bill'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenCallRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('start', 'Start'), ('end', 'End')], max_length=5)),
+                ('call_id', models.PositiveIntegerField()),
+                ('timestamp', models.DateTimeField()),
+                ('source', models.CharField(blank=True, max_length=11)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReconciliationState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('high_water_mark', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='opencallrecord',
+            index=models.Index(fields=['type', 'timestamp'], name='opencallrecord_type_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='opencallrecord',
+            unique_together={('type', 'call_id')},
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:28
+
+import django.core.validators
+from django.db import migrations, models
+
+
+# NOTE: summaries of the calls created so far, see
+# sparrow.call_records.summaries
+INSERT_SUMMARIES_SQL = """
+INSERT INTO call_records_billsummary (subscriber, reference_period, calls, duration, price)
+SELECT
+    source,
+    to_char(end_timestamp AT TIME ZONE 'UTC', 'YYYYMM'),
+    count(*),
+    sum(duration),
+    sum(price)
+FROM
+    call_records_call
+GROUP BY
+    1, 2
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0009_open_call_records'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscriber', models.CharField(max_length=11, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^\\d{10,11}$')])),
+                ('reference_period', models.CharField(max_length=6)),
+                ('calls', models.PositiveIntegerField()),
+                ('duration', models.DurationField()),
+                ('price', models.BigIntegerField()),
+            ],
+            options={
+                'unique_together': {('subscriber', 'reference_period')},
+            },
+        ),
+        migrations.RunSQL(INSERT_SUMMARIES_SQL, migrations.RunSQL.noop),
+    ]
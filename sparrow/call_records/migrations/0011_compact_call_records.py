@@ -0,0 +1,93 @@
+import django.core.validators
+from django.db import migrations, models
+
+import sparrow.call_records.models
+
+
+# NOTE: call records are stored compactly: phone numbers as bigints (see
+# sparrow.call_records.models.PhoneNumberField) and the type as a
+# boolean. Columns are ordered from the widest to the narrowest, so no
+# padding is needed to align them, and the table is rewritten at once
+# instead of altering each column, which would rewrite it every time.
+# The index on type is split into partial indexes, one for each type,
+# since a leading boolean takes as much space as a timestamp.
+CREATE_COMPACT_TABLE_SQL = """
+ALTER TABLE call_records_callrecord RENAME TO call_records_callrecord_wide;
+
+CREATE TABLE call_records_callrecord (
+    timestamp timestamp with time zone NOT NULL,
+    source bigint,
+    destination bigint,
+    id integer NOT NULL DEFAULT nextval('call_records_callrecord_id_seq'),
+    call_id integer NOT NULL CHECK (call_id >= 0),
+    is_start boolean NOT NULL
+);
+"""
+
+MOVE_CALL_RECORDS_SQL = """
+INSERT INTO call_records_callrecord (timestamp, source, destination, id, call_id, is_start)
+SELECT
+    timestamp,
+    ('1' || nullif(source, ''))::bigint,
+    ('1' || nullif(destination, ''))::bigint,
+    id,
+    call_id,
+    type = 'start'
+FROM
+    call_records_callrecord_wide;
+
+ALTER SEQUENCE call_records_callrecord_id_seq OWNED BY call_records_callrecord.id;
+DROP TABLE call_records_callrecord_wide;
+
+ALTER TABLE call_records_callrecord ADD PRIMARY KEY (id);
+ALTER TABLE call_records_callrecord ADD UNIQUE (is_start, call_id);
+CREATE INDEX callrecord_timestamp_idx ON call_records_callrecord (timestamp, id);
+CREATE INDEX callrecord_source_idx ON call_records_callrecord (source, timestamp, id);
+CREATE INDEX callrecord_start_idx ON call_records_callrecord (timestamp, id) WHERE is_start;
+CREATE INDEX callrecord_end_idx ON call_records_callrecord (timestamp, id) WHERE NOT is_start;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0010_bill_summary'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_COMPACT_TABLE_SQL),
+                migrations.RunSQL(MOVE_CALL_RECORDS_SQL),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='callrecord',
+                    name='destination',
+                    field=sparrow.call_records.models.PhoneNumberField(blank=True, null=True, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^\\d{10,11}$')]),  # noqa: E501
+                ),
+                migrations.AlterField(
+                    model_name='callrecord',
+                    name='source',
+                    field=sparrow.call_records.models.PhoneNumberField(blank=True, null=True, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^\\d{10,11}$')]),  # noqa: E501
+                ),
+                migrations.AlterField(
+                    model_name='callrecord',
+                    name='type',
+                    field=sparrow.call_records.models.RecordTypeField(choices=[('start', 'Start'), ('end', 'End')], db_column='is_start'),  # noqa: E501
+                ),
+                migrations.RemoveIndex(
+                    model_name='callrecord',
+                    name='callrecord_type_idx',
+                ),
+                migrations.AddIndex(
+                    model_name='callrecord',
+                    index=models.Index(condition=models.Q(type='start'), fields=['timestamp', 'id'], name='callrecord_start_idx'),  # noqa: E501
+                ),
+                migrations.AddIndex(
+                    model_name='callrecord',
+                    index=models.Index(condition=models.Q(type='end'), fields=['timestamp', 'id'], name='callrecord_end_idx'),  # noqa: E501
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:37
+
+import django.contrib.postgres.fields
+import django.core.validators
+from django.db import migrations, models
+import sparrow.call_records.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0011_compact_call_records'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscriber', models.CharField(max_length=11, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^\\d{10,11}$')])),
+                ('reference_period', models.CharField(max_length=6)),
+                ('call_ids', django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), size=None)),
+                ('destinations', django.contrib.postgres.fields.ArrayField(base_field=sparrow.call_records.models.PhoneNumberField(), size=None)),
+                ('start_timestamps', django.contrib.postgres.fields.ArrayField(base_field=models.DateTimeField(), size=None)),
+                ('end_timestamps', django.contrib.postgres.fields.ArrayField(base_field=models.DateTimeField(), size=None)),
+                ('prices', django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), size=None)),
+                ('tariff_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+            ],
+            options={
+                'unique_together': {('subscriber', 'reference_period')},
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:07
+
+import django.core.validators
+from django.db import migrations, models
+import sparrow.call_records.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0013_pruning_state'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bill',
+            name='subscriber',
+            field=models.CharField(max_length=11, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^[0-9]{10,11}$')]),
+        ),
+        migrations.AlterField(
+            model_name='billsummary',
+            name='subscriber',
+            field=models.CharField(max_length=11, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^[0-9]{10,11}$')]),
+        ),
+        migrations.AlterField(
+            model_name='call',
+            name='destination',
+            field=models.CharField(max_length=11, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^[0-9]{10,11}$')]),
+        ),
+        migrations.AlterField(
+            model_name='call',
+            name='source',
+            field=models.CharField(max_length=11, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^[0-9]{10,11}$')]),
+        ),
+        migrations.AlterField(
+            model_name='callarchive',
+            name='subscriber',
+            field=models.CharField(max_length=11, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^[0-9]{10,11}$')]),
+        ),
+        migrations.AlterField(
+            model_name='callrecord',
+            name='destination',
+            field=sparrow.call_records.models.PhoneNumberField(blank=True, null=True, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^[0-9]{10,11}$')]),
+        ),
+        migrations.AlterField(
+            model_name='callrecord',
+            name='source',
+            field=sparrow.call_records.models.PhoneNumberField(blank=True, null=True, validators=[django.core.validators.RegexValidator(message='Invalid phone number, format should be AAXXXXXXXXX where AA is the area code and XXXXXXXXX is the phone number, composed of 8 to 9 digits', regex='^[0-9]{10,11}$')]),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:08
+
+from django.db import migrations, models
+
+
+# NOTE: call ids of the calls archived so far
+INSERT_ARCHIVED_CALL_IDS_SQL = """
+INSERT INTO call_records_archivedcallid (call_id)
+SELECT DISTINCT unnest(call_ids) FROM call_records_callarchive
+ON CONFLICT DO NOTHING
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0014_ascii_phone_numbers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedCallId',
+            fields=[
+                ('call_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+            ],
+        ),
+        migrations.RunSQL(INSERT_ARCHIVED_CALL_IDS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('call_records', '0015_archived_call_ids'),
+    ]
+
+    # NOTE: the index was created by 0004_call_covering_bill_index and
+    # 0005_partition_calls_by_month, this only adds it to the model state
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='call',
+                    index=models.Index(fields=['source', 'end_timestamp'], include=('start_timestamp', 'destination', 'duration', 'price'), name='call_records_call_bill_idx'),  # noqa: E501
+                ),
+            ],
+        ),
+    ]
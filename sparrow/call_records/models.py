@@ -1,18 +1,99 @@
-__all__ = ['CallRecord']
+__all__ = ['CallRecord', 'Call', 'Tariff', 'TariffBand', 'Bill', 'BillSummary', 'CallArchive', 'ArchivedCallId',
+           'OpenCallRecord', 'ReconciliationState', 'PruningState']
 
+from django.contrib.postgres.fields import ArrayField
 from django.core.validators import RegexValidator
 from django.db import models
+from django.utils import timezone
 
 
 invalid_phone_number_message = ('Invalid phone number, format should be AAXXXXXXXXX where AA is '
                                 'the area code and XXXXXXXXX is the phone number, composed of 8 '
                                 'to 9 digits')
 phone_number_validator = RegexValidator(
-    regex=r'^\d{10,11}$',
+    regex=r'^[0-9]{10,11}$',
     message=invalid_phone_number_message
 )
 
 
+def encode_phone_number(phone_number):
+    """
+    Returns the value stored for a phone number by PhoneNumberField: its
+    digits prefixed with a 1, so leading zeros are kept, or None if empty
+    """
+    return int('1' + phone_number) if phone_number else None
+
+
+def decode_phone_number(value):
+    """
+    Returns the phone number stored by PhoneNumberField as `value`
+    """
+    return str(value)[1:] if value is not None else ''
+
+
+class PhoneNumberField(models.Field):
+    """
+    A phone number stored as a bigint (see `encode_phone_number`), half
+    the size of its digits as text, in the table and in indexes. Empty
+    phone numbers are stored as NULL, so the field must be nullable
+    """
+    description = 'Phone number, stored as an integer'
+
+    def __init__(self, *args, **kwargs):
+        kwargs['max_length'] = 11
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        del kwargs['max_length']
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return 'BigIntegerField'
+
+    def from_db_value(self, value, expression, connection):
+        return decode_phone_number(value)
+
+    def to_python(self, value):
+        if isinstance(value, int):
+            return decode_phone_number(value)
+        return value or ''
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        try:
+            return encode_phone_number(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Field '{self.name}' expected a phone number but got {value!r}")
+
+
+class RecordTypeField(models.Field):
+    """
+    The type of a call record, START or END, stored as a boolean telling
+    whether it's a START record
+    """
+    description = 'Call record type, stored as a boolean'
+
+    def get_internal_type(self):
+        return 'BooleanField'
+
+    def from_db_value(self, value, expression, connection):
+        return self.to_python(value)
+
+    def to_python(self, value):
+        if isinstance(value, bool):
+            return CallRecord.START if value else CallRecord.END
+        return value
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None:
+            return None
+        if not CallRecord.is_record_type(value):
+            raise ValueError(f"Field '{self.name}' expected a call record type but got {value!r}")
+        return value == CallRecord.START
+
+
 class CallRecord(models.Model):
     """
     Represents a call record, either start or end.
@@ -24,14 +105,28 @@ class CallRecord(models.Model):
         (END, 'End'),
     ]
 
-    type = models.CharField(max_length=5, choices=RECORD_TYPES)
+    # NOTE: stored compactly (see PhoneNumberField and RecordTypeField),
+    # with columns ordered to waste no space on alignment, see migration
+    # 0011_compact_call_records
+    type = RecordTypeField(choices=RECORD_TYPES, db_column='is_start')
     call_id = models.PositiveIntegerField()
     timestamp = models.DateTimeField()
-    source = models.CharField(max_length=11, validators=[phone_number_validator], blank=True)
-    destination = models.CharField(max_length=11, validators=[phone_number_validator], blank=True)
+    source = PhoneNumberField(validators=[phone_number_validator], blank=True, null=True)
+    destination = PhoneNumberField(validators=[phone_number_validator], blank=True, null=True)
 
     class Meta:
         unique_together = ['type', 'call_id']
+        # NOTE: listings are paginated by (timestamp, id), see
+        # sparrow.call_records.pagination, so each filter has an index
+        # ending with both. call_id is served by the unique index above.
+        # type is a boolean, which would be padded to 8 bytes leading an
+        # index, so each type has a partial index instead
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='callrecord_timestamp_idx'),
+            models.Index(fields=['source', 'timestamp', 'id'], name='callrecord_source_idx'),
+            models.Index(fields=['timestamp', 'id'], name='callrecord_start_idx', condition=models.Q(type='start')),
+            models.Index(fields=['timestamp', 'id'], name='callrecord_end_idx', condition=models.Q(type='end')),
+        ]
 
     @classmethod
     def is_record_type(cls, value):
@@ -40,3 +135,176 @@ class CallRecord(models.Model):
     @property
     def is_start_record(self):
         return self.type == self.START
+
+
+class Call(models.Model):
+    """
+    Represents a complete call, i.e. a pair of start and end call
+    records sharing the same `call_id`. It's created as soon as the
+    second record of the pair arrives, with its price already
+    calculated, and it's what telephone bills are made of.
+    """
+    call_id = models.PositiveIntegerField()
+    source = models.CharField(max_length=11, validators=[phone_number_validator])
+    destination = models.CharField(max_length=11, validators=[phone_number_validator])
+    start_timestamp = models.DateTimeField()
+    end_timestamp = models.DateTimeField()
+    duration = models.DurationField()
+    # NOTE: in cents. Once calculated, a price never changes
+    price = models.PositiveIntegerField()
+    tariff = models.ForeignKey('Tariff', on_delete=models.PROTECT, related_name='calls')
+
+    class Meta:
+        # NOTE: the table is partitioned by month of end_timestamp (see
+        # sparrow.call_records.partitions), and PostgreSQL only allows
+        # unique constraints including the partition key. Since a call
+        # has a single end record, call_id is still unique
+        unique_together = ['call_id', 'end_timestamp']
+        # NOTE: bills are served by a covering index including every
+        # other column they read, so they're index-only scans
+        indexes = [
+            models.Index(fields=['source', 'end_timestamp'], name='call_records_call_bill_idx',
+                         include=['start_timestamp', 'destination', 'duration', 'price']),
+        ]
+
+
+class Tariff(models.Model):
+    """
+    A version of the pricing rules. It's in effect from `effective_from`
+    until the `effective_from` of the next tariff, and calls are priced
+    by the tariff in effect when they started.
+
+    Tariffs are meant to be added, not changed: calls keep a reference
+    to the tariff that priced them, and their prices never change.
+    """
+    effective_from = models.DateTimeField(unique=True)
+    # NOTE: in cents
+    standing_charge = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Tariff effective from {self.effective_from.isoformat()}'
+
+
+class TariffBand(models.Model):
+    """
+    A time of the day with its own charge per minute. It starts at
+    `start_time` and lasts until the `start_time` of the next band of
+    the same tariff, wrapping around midnight. Times are in UTC.
+    """
+    tariff = models.ForeignKey(Tariff, on_delete=models.CASCADE, related_name='bands')
+    start_time = models.TimeField()
+    # NOTE: in cents, for each complete minute
+    call_charge = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ['tariff', 'start_time']
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # NOTE: so pricing engines notice their tariff changed
+        Tariff.objects.filter(pk=self.tariff_id).update(updated_at=timezone.now())
+
+
+class Bill(models.Model):
+    """
+    A telephone bill of a closed reference period, written by the
+    `run_billing` command. `body` is the bill as returned by
+    `sparrow.call_records.api.telephone_bill`, rendered as JSON.
+    """
+    subscriber = models.CharField(max_length=11, validators=[phone_number_validator])
+    reference_period = models.CharField(max_length=6)
+    body = models.TextField()
+    calls = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['subscriber', 'reference_period']
+
+
+class BillSummary(models.Model):
+    """
+    Totals of the telephone bill of a subscriber for a reference period.
+    Calls are added to it as they're created (see
+    `sparrow.call_records.ingestion.pair_call_records`), and the
+    `rebuild_bill_summaries` command computes it again from the calls.
+    """
+    subscriber = models.CharField(max_length=11, validators=[phone_number_validator])
+    reference_period = models.CharField(max_length=6)
+    calls = models.PositiveIntegerField()
+    duration = models.DurationField()
+    # NOTE: in cents
+    price = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ['subscriber', 'reference_period']
+
+
+class CallArchive(models.Model):
+    """
+    The calls of a subscriber in a closed reference period, moved out of
+    Call and CallRecord by the `archive_calls` command (see
+    `sparrow.call_records.archive`). Each column of the calls is an
+    array, sorted by start timestamp, which PostgreSQL compresses.
+    """
+    subscriber = models.CharField(max_length=11, validators=[phone_number_validator])
+    reference_period = models.CharField(max_length=6)
+    call_ids = ArrayField(models.PositiveIntegerField())
+    destinations = ArrayField(PhoneNumberField())
+    start_timestamps = ArrayField(models.DateTimeField())
+    end_timestamps = ArrayField(models.DateTimeField())
+    # NOTE: in cents
+    prices = ArrayField(models.PositiveIntegerField())
+    tariff_ids = ArrayField(models.IntegerField())
+
+    class Meta:
+        unique_together = ['subscriber', 'reference_period']
+
+
+class ArchivedCallId(models.Model):
+    """
+    The call id of an archived call, whose records were deleted along
+    with it, so records of archived calls sent again are still told
+    duplicated. Written when archiving (see
+    `sparrow.call_records.archive`), and checked by every insert of
+    call records.
+    """
+    call_id = models.PositiveIntegerField(primary_key=True)
+
+
+class OpenCallRecord(models.Model):
+    """
+    A call record whose pair hasn't arrived yet, tracked by the
+    `reconcile_call_records` command (see
+    `sparrow.call_records.reconciliation`). It's deleted once the other
+    record of the pair arrives.
+    """
+    type = models.CharField(max_length=5, choices=CallRecord.RECORD_TYPES)
+    call_id = models.PositiveIntegerField()
+    timestamp = models.DateTimeField()
+    source = models.CharField(max_length=11, blank=True)
+
+    class Meta:
+        unique_together = ['type', 'call_id']
+        indexes = [
+            models.Index(fields=['type', 'timestamp'], name='opencallrecord_type_idx'),
+        ]
+
+
+class ReconciliationState(models.Model):
+    """
+    Progress of the reconciliation of call records, a single row:
+    records up to `high_water_mark` (an id) were reconciled.
+    """
+    high_water_mark = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class PruningState(models.Model):
+    """
+    Progress of the pruning of call partitions, a single row: months
+    before `pruned_before` were pruned by the `prune_call_partitions`
+    command, so calls ending before it are no longer created.
+    """
+    pruned_before = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,86 @@
+__all__ = ['CallRecordsPagination']
+
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CallRecordsPagination(BasePagination):
+    """
+    Keyset pagination of call records ordered by (timestamp, id).
+
+    The cursor is the (timestamp, id) of the last record of a page, and
+    the next page starts right after it. Unlike offsets, a cursor keeps
+    pointing to the same place while records are inserted: no record
+    is repeated or skipped, except new ones sorting before the cursor,
+    which belong to pages already read.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            # NOTE: a row comparison, unlike the equivalent OR of two
+            # conditions, is a single range scan on the (..., timestamp, id)
+            # indexes
+            queryset = queryset.extra(where=['(call_records_callrecord.timestamp, call_records_callrecord.id) '
+                                             '> (%s, %s)'], params=list(position))
+
+        # NOTE: one extra record tells whether there's a next page
+        records = list(queryset.order_by('timestamp', 'id')[:page_size + 1])
+        self.next_position = None
+        if len(records) > page_size:
+            records = records[:page_size]
+            self.next_position = (records[-1].timestamp, records[-1].id)
+
+        return records
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.CALL_RECORDS_PAGE_SIZE
+
+        return min(max(page_size, 1), settings.CALL_RECORDS_MAX_PAGE_SIZE)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+
+        timestamp, record_id = self.next_position
+        cursor = json.dumps([timestamp.isoformat(), record_id]).encode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   base64.urlsafe_b64encode(cursor).decode())
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+
+        try:
+            timestamp, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            timestamp = parse_datetime(timestamp)
+            if timestamp is None or not isinstance(record_id, int):
+                raise ValueError(cursor)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return timestamp, record_id
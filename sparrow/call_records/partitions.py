@@ -0,0 +1,112 @@
+"""
+Helpers for managing the monthly partitions of call_records_call.
+
+Calls are partitioned by the month of `end_timestamp`, which is the
+month they are billed in, so a bill only ever reads a single partition.
+Partitions are named after their month, like `call_records_call_201801`.
+Calls for months without a partition go to `call_records_call_default`
+and are moved out of it once their partition is created.
+"""
+__all__ = ['create_partition', 'list_partitions', 'detach_partition', 'drop_partition', 'truncate_partition']
+
+import re
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+
+
+PARTITIONED_TABLE = 'call_records_call'
+DEFAULT_PARTITION = f'{PARTITIONED_TABLE}_default'
+_PARTITION_NAME_REGEX = re.compile(rf'^{PARTITIONED_TABLE}_(\d{{6}})$')
+
+
+def partition_name(month):
+    return f'{PARTITIONED_TABLE}_{month:%Y%m}'
+
+
+def list_partitions(cursor):
+    """
+    Returns the months (first day, as a date) of the monthly partitions
+    currently attached, sorted.
+    """
+    cursor.execute(_LIST_PARTITIONS_QUERY, {'table': PARTITIONED_TABLE})
+    months = []
+    for name, in cursor.fetchall():
+        match = _PARTITION_NAME_REGEX.match(name)
+        if match:
+            year, month = divmod(int(match.group(1)), 100)
+            months.append(date(year, month, 1))
+
+    return sorted(months)
+
+
+def create_partition(cursor, month):
+    """
+    Creates and attaches the partition for the given month (any date
+    within it), moving in calls that landed in the default partition.
+    Returns False if the partition already existed.
+    """
+    month = month.replace(day=1)
+    if month in list_partitions(cursor):
+        return False
+
+    bounds = {
+        'start': f'{month:%Y-%m-%d} 00:00:00+00',
+        'end': f'{month + relativedelta(months=1):%Y-%m-%d} 00:00:00+00',
+    }
+    name = partition_name(month)
+    cursor.execute(f'CREATE TABLE {name} (LIKE {PARTITIONED_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(_MOVE_FROM_DEFAULT_PARTITION_QUERY.format(partition=name), bounds)
+    cursor.execute(f'ALTER TABLE {PARTITIONED_TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%(start)s) TO (%(end)s)',
+                   bounds)
+    return True
+
+
+def detach_partition(cursor, month):
+    """
+    Detaches the partition of the given month, which keeps existing as
+    a standalone table but is no longer read by bills.
+    """
+    cursor.execute(f'ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {partition_name(month)}')
+
+
+def drop_partition(cursor, month):
+    """
+    Drops the partition of the given month, attached or not, with all
+    of its calls.
+    """
+    cursor.execute(f'DROP TABLE {partition_name(month)}')
+
+
+def truncate_partition(cursor, month):
+    """
+    Deletes every call of the partition of the given month, which stays
+    attached for calls arriving late.
+    """
+    cursor.execute(f'TRUNCATE {partition_name(month)}')
+
+
+_LIST_PARTITIONS_QUERY = """
+SELECT
+    partitions.relname
+FROM
+    pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class partitions ON partitions.oid = pg_inherits.inhrelid
+WHERE
+    parent.relname = %(table)s
+"""
+
+_MOVE_FROM_DEFAULT_PARTITION_QUERY = f"""
+WITH
+    moved AS (
+        DELETE FROM {DEFAULT_PARTITION}
+        WHERE
+            end_timestamp >= %(start)s
+            AND end_timestamp < %(end)s
+        RETURNING *
+    )
+
+INSERT INTO {{partition}}
+SELECT * FROM moved
+"""
@@ -0,0 +1,218 @@
+"""
+Pricing engine for calls.
+
+Tariffs (see `sparrow.call_records.models.Tariff`) are loaded once per
+process and compiled into sorted lists, so pricing a call never hits
+the database and finding its tariff and band is a binary search. At
+most every TARIFF_REFRESH_INTERVAL seconds, a cheap query checks if
+tariffs changed, reloading them if so.
+
+Calls are charged for each completed 60 seconds cycle, at the charge of
+the band in effect when the cycle completes. Since a day has a whole
+number of cycles, every complete day of a call costs the same, so
+pricing is O(1) on the call duration: a closed formula per band for
+the complete days, and another for the remaining cycles. The same
+formulas work on NumPy arrays, pricing many calls at once.
+
+Tariff bands are in UTC, like every timestamp in sparrow.
+"""
+__all__ = ['price_call', 'price_calls', 'PricedCalls', 'NO_TARIFF']
+
+import bisect
+import collections
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+
+from sparrow.call_records.exceptions import PricingError
+from sparrow.call_records.metrics import CALLS_PRICED, PRICING_DURATION
+from sparrow.call_records.models import Tariff
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+CYCLES_PER_DAY = SECONDS_PER_DAY // 60
+
+PricedCalls = collections.namedtuple('PricedCalls', ['minutes', 'prices', 'tariff_ids'])
+
+# NOTE: tariff id given by `price_calls` to calls starting before the
+# first tariff, which can't be priced
+NO_TARIFF = 0
+
+
+class CompiledTariff:
+    __slots__ = ('id', 'standing_charge', 'band_starts', 'call_charges', 'intervals')
+
+    def __init__(self, tariff_id, standing_charge, bands):
+        """
+        `bands` is an iterable of (start_time, call_charge) pairs
+        """
+        bands = sorted(bands)
+        if not bands:
+            raise PricingError(f'Tariff {tariff_id} has no bands')
+
+        self.id = tariff_id
+        self.standing_charge = standing_charge
+        self.band_starts = [_seconds_of_day(start_time) for start_time, _ in bands]
+        self.call_charges = [call_charge for _, call_charge in bands]
+
+        # NOTE: (start, end, call charge) for each interval of the day,
+        # in seconds. The last band wraps around midnight up to the first
+        self.intervals = [(start, end, call_charge) for start, end, call_charge
+                          in zip(self.band_starts, self.band_starts[1:] + [SECONDS_PER_DAY], self.call_charges)]
+        if self.band_starts[0] > 0:
+            self.intervals.append((0, self.band_starts[0], self.call_charges[-1]))
+
+    @classmethod
+    def from_model(cls, tariff):
+        return cls(tariff.id, tariff.standing_charge,
+                   [(band.start_time, band.call_charge) for band in tariff.bands.all()])
+
+    def call_charge_at(self, seconds_of_day):
+        # NOTE: bands wrap around midnight, so a time before the first
+        # band gets index -1, i.e. the last band of the day
+        return self.call_charges[bisect.bisect_right(self.band_starts, seconds_of_day) - 1]
+
+    def price(self, start_seconds_of_day, duration_seconds):
+        """
+        Returns the price, in cents, of a call starting at the given
+        second of the day and lasting `duration_seconds`. Both can also
+        be NumPy arrays of integers, for pricing many calls at once.
+        """
+        cycles = np.maximum(duration_seconds, 0) // 60
+        days, remaining_cycles = np.divmod(cycles, CYCLES_PER_DAY)
+        offset = start_seconds_of_day % 60
+
+        # NOTE: shaped like `cycles`, even if no band has a call charge
+        price = self.standing_charge + 0 * cycles
+        for start, end, call_charge in self.intervals:
+            if not call_charge:
+                continue
+
+            # NOTE: in CYCLES_PER_DAY consecutive cycles, each cycle ends
+            # at a different minute of the day, all with the same offset
+            full_days_cycles = days * _count_cycles(offset, 0, CYCLES_PER_DAY - 1, start, end)
+            # NOTE: the remaining cycles end within a day from the start,
+            # so they may only wrap around midnight once
+            remaining = (_count_cycles(start_seconds_of_day, 1, remaining_cycles, start, end)
+                         + _count_cycles(start_seconds_of_day, 1, remaining_cycles,
+                                         start + SECONDS_PER_DAY, end + SECONDS_PER_DAY))
+            price += call_charge * (full_days_cycles + remaining)
+
+        return price
+
+
+def _count_cycles(origin, first, last, start, end):
+    """
+    Returns how many cycles k, with first <= k <= last, end within
+    [start, end), i.e. start <= origin + 60 * k < end.
+    """
+    first = np.maximum(first, _ceil_div(start - origin, 60))
+    last = np.minimum(last, _ceil_div(end - origin, 60) - 1)
+    return np.maximum(last - first + 1, 0)
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+class PricingEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = None
+        # NOTE: replaced at once so readers never see them out of sync:
+        # tariff start dates (sorted), the same as epoch seconds and the
+        # respective compiled tariffs
+        self._tariffs = ([], np.array([]), [])
+
+    def price(self, start_timestamp, end_timestamp):
+        """
+        Returns the price, in cents, of the call between the given
+        timestamps and the id of the tariff that priced it.
+        """
+        self._refresh()
+        effective_from, _, tariffs = self._tariffs
+
+        index = bisect.bisect_right(effective_from, start_timestamp) - 1
+        if index < 0:
+            raise PricingError(f'No tariff in effect at {start_timestamp.isoformat()}')
+
+        tariff = tariffs[index]
+        price = tariff.price(int(start_timestamp.timestamp()) % SECONDS_PER_DAY,
+                             int((end_timestamp - start_timestamp).total_seconds()))
+        return int(price), tariff.id
+
+    def price_many(self, start_epochs, end_epochs):
+        """
+        Same as `price`, but for arrays of start and end timestamps
+        given as epoch seconds. Returns PricedCalls, with arrays of
+        billable minutes, prices in cents and tariff ids. Instead of
+        raising PricingError, calls that can't be priced get a price of
+        0 and NO_TARIFF, so they don't fail the others.
+        """
+        self._refresh()
+        _, effective_from, tariffs = self._tariffs
+        start_epochs = np.asarray(start_epochs, dtype=np.float64)
+        end_epochs = np.asarray(end_epochs, dtype=np.float64)
+
+        indexes = np.searchsorted(effective_from, start_epochs, side='right') - 1
+        start_seconds_of_day = np.floor(start_epochs).astype(np.int64) % SECONDS_PER_DAY
+        durations = np.floor(end_epochs - start_epochs).astype(np.int64)
+        prices = np.zeros(len(start_epochs), dtype=np.int64)
+        tariff_ids = np.zeros(len(start_epochs), dtype=np.int64)
+        for index in np.unique(indexes[indexes >= 0]):
+            calls = indexes == index
+            prices[calls] = tariffs[index].price(start_seconds_of_day[calls], durations[calls])
+            tariff_ids[calls] = tariffs[index].id
+
+        return PricedCalls(np.maximum(durations, 0) // 60, prices, tariff_ids)
+
+    def _refresh(self):
+        checked_at = self._checked_at
+        # NOTE: the clock going backwards (which freezegun does in tests)
+        # also triggers a check
+        if checked_at is not None and 0 <= time.monotonic() - checked_at < settings.TARIFF_REFRESH_INTERVAL:
+            return
+
+        with self._lock:
+            version = Tariff.objects.aggregate(count=Count('id'), updated_at=Max('updated_at'))
+            if version != self._version:
+                tariffs = Tariff.objects.order_by('effective_from').prefetch_related('bands')
+                self._tariffs = ([tariff.effective_from for tariff in tariffs],
+                                 np.array([tariff.effective_from.timestamp() for tariff in tariffs]),
+                                 [CompiledTariff.from_model(tariff) for tariff in tariffs])
+                self._version = version
+
+            self._checked_at = time.monotonic()
+
+
+def _seconds_of_day(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+engine = PricingEngine()
+
+
+def price_call(start_timestamp, end_timestamp):
+    """
+    Returns the price, in cents, of the call between the given
+    timestamps and the id of the tariff that priced it.
+    """
+    return engine.price(start_timestamp, end_timestamp)
+
+
+def price_calls(start_epochs, end_epochs):
+    """
+    Prices many calls at once. Takes arrays of start and end timestamps
+    as epoch seconds and returns PricedCalls, with arrays of billable
+    minutes, prices in cents and the ids of the tariffs that priced them,
+    NO_TARIFF for calls that can't be priced.
+    """
+    started_at = time.perf_counter()
+    priced = engine.price_many(start_epochs, end_epochs)
+    PRICING_DURATION.observe(time.perf_counter() - started_at)
+    CALLS_PRICED.inc(len(priced.prices))
+    return priced
@@ -0,0 +1,164 @@
+"""
+Incremental reconciliation of orphan call records.
+
+Switches lose and reorder records, so some start records never get an
+end record, and the other way around. `reconcile` keeps the records
+still waiting for their pair in the small OpenCallRecord table: it
+reads the call records added since its last run, in batches of
+increasing id, adds those without a pair and removes those whose pair
+arrived. Its progress is a high-water mark, the last id reconciled, so
+it never scans the whole history again.
+
+Ids are assigned when records are inserted but become visible when
+their transaction commits, possibly after greater ids. Each run starts
+`lookback` ids behind the high-water mark to catch up with those, which
+is harmless since reconciling a record twice has no effect.
+
+Open records then tell calls that have been going on for too long,
+and orphans that will never be part of a bill.
+"""
+__all__ = ['reconcile', 'open_call_records_report']
+
+import time
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from sparrow.call_records.ingestion import pair_call_records
+from sparrow.call_records.models import CallRecord, OpenCallRecord, ReconciliationState
+
+
+def reconcile(*, batch_size, lookback=0, progress=None):
+    """
+    Reconciles the call records added since the last run, `batch_size`
+    at a time. Each batch is committed along with the high-water mark,
+    so an interrupted run resumes where it stopped. `progress`, if
+    given, is called with the high-water mark after each batch.
+
+    Returns a dict with the number of records `reconciled`, of those
+    `opened` (still waiting for their pair), of records `closed` (whose
+    pair arrived), the `high_water_mark` and the `elapsed` seconds.
+    """
+    started_at = time.monotonic()
+    stats = {'reconciled': 0, 'opened': 0, 'closed': 0}
+
+    state, _ = ReconciliationState.objects.get_or_create(pk=1)
+    last_id = max(0, state.high_water_mark - lookback)
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            # NOTE: locks the state, so that concurrent runs take turns
+            state = ReconciliationState.objects.select_for_update().get(pk=1)
+            cursor.execute(_RECONCILE_QUERY, {'last_id': last_id, 'batch_size': batch_size})
+            batch_last_id, reconciled, opened, closed, unpaired_call_ids = cursor.fetchone()
+            if not reconciled:
+                break
+
+            # NOTE: calls are paired on ingestion, this only catches
+            # those that failed to be, like pairs ingested concurrently
+            pair_call_records(unpaired_call_ids)
+
+            last_id = batch_last_id
+            if last_id > state.high_water_mark:
+                state.high_water_mark = last_id
+                state.save()
+
+        stats['reconciled'] += reconciled
+        stats['opened'] += opened
+        stats['closed'] += closed
+        if progress:
+            progress(last_id)
+
+    stats.update(high_water_mark=max(state.high_water_mark, last_id), elapsed=time.monotonic() - started_at)
+    return stats
+
+
+def open_call_records_report(*, long_call_age, orphan_age, limit=10):
+    """
+    Returns a dict with the number of `open_starts` and `open_ends`,
+    and the `long_calls`: start records without an end older than
+    `long_call_age` (a timedelta) but newer than `orphan_age`, and
+    `orphans`: open records older than `orphan_age`, whose pair is
+    unlikely to ever arrive. Both are dicts with the `count` of such
+    records and the `limit` oldest ones.
+    """
+    now = timezone.now()
+    open_records = OpenCallRecord.objects.order_by('timestamp', 'call_id')
+    long_calls = open_records.filter(type=CallRecord.START, timestamp__lt=now - long_call_age,
+                                     timestamp__gte=now - orphan_age)
+    orphans = open_records.filter(timestamp__lt=now - orphan_age)
+
+    return {
+        'open_starts': open_records.filter(type=CallRecord.START).count(),
+        'open_ends': open_records.filter(type=CallRecord.END).count(),
+        'long_calls': {'count': long_calls.count(), 'oldest': list(long_calls.values(*_REPORTED_FIELDS)[:limit])},
+        'orphans': {'count': orphans.count(), 'oldest': list(orphans.values(*_REPORTED_FIELDS)[:limit])},
+    }
+
+
+_REPORTED_FIELDS = ['type', 'call_id', 'timestamp', 'source']
+
+# NOTE: both the INSERT and the DELETE see the table as it was before
+# the query, so a pair reconciled in the same batch is never opened,
+# and records opened by this batch are never closed by it. Partners are
+# looked up with the (is_start, call_id) unique index. Call records are
+# decoded (see CallRecord) since open records keep them as text. Pairs
+# without a call are returned whether their partner is in the batch or
+# not, so pairs closed within a batch get their call too
+_RECONCILE_QUERY = """
+WITH batch AS (
+    SELECT
+        id,
+        is_start,
+        CASE WHEN is_start THEN 'start' ELSE 'end' END AS type,
+        call_id,
+        timestamp,
+        coalesce(substr(source::text, 2), '') AS source,
+        CASE WHEN is_start THEN 'end' ELSE 'start' END AS partner_type
+    FROM
+        call_records_callrecord
+    WHERE
+        id > %(last_id)s
+    ORDER BY
+        id
+    LIMIT %(batch_size)s
+),
+opened AS (
+    INSERT INTO call_records_opencallrecord (type, call_id, timestamp, source)
+    SELECT
+        type, call_id, timestamp, source
+    FROM
+        batch
+    WHERE
+        NOT EXISTS (
+            SELECT 1 FROM call_records_callrecord partner
+            WHERE partner.is_start = NOT batch.is_start AND partner.call_id = batch.call_id
+        )
+    ON CONFLICT (type, call_id) DO NOTHING
+    RETURNING 1
+),
+closed AS (
+    DELETE FROM call_records_opencallrecord open_record
+    USING batch
+    WHERE
+        open_record.type = batch.partner_type
+        AND open_record.call_id = batch.call_id
+    RETURNING 1
+)
+SELECT
+    (SELECT max(id) FROM batch),
+    (SELECT count(*) FROM batch),
+    (SELECT count(*) FROM opened),
+    (SELECT count(*) FROM closed),
+    ARRAY(
+        SELECT DISTINCT
+            call_id
+        FROM
+            batch
+        WHERE
+            EXISTS (
+                SELECT 1 FROM call_records_callrecord partner
+                WHERE partner.is_start = NOT batch.is_start AND partner.call_id = batch.call_id
+            )
+            AND NOT EXISTS (SELECT 1 FROM call_records_call call WHERE call.call_id = batch.call_id)
+    )
+"""
@@ -1,19 +1,31 @@
 __all__ = ['CallRecordStartSerializer', 'CallRecordEndSerializer']
 
+from django.db import IntegrityError
 from rest_framework import serializers
 
-from sparrow.call_records.models import CallRecord
+from sparrow.call_records.ingestion import insert_call_records
+from sparrow.call_records.models import CallRecord, phone_number_validator
+
+
+PHONE_NUMBER_MAX_LENGTH = CallRecord._meta.get_field('source').max_length
 
 
 class CallRecordSerializerMixin:
     """
     Generic class to override `self.create`. It adds a static
     CallRecord.RECORD_TYPE as a value depending on what's configured
-    in the serializer's CALL_RECORD_TYPE field
+    in the serializer's CALL_RECORD_TYPE field, and pairs the new
+    record with its counterpart if it has already arrived
     """
 
     def create(self, validated_data):
-        return CallRecord.objects.create(type=self.CALL_RECORD_TYPE, **validated_data)
+        # NOTE: inserted like every other ingestion path, which also
+        # tells records of archived calls duplicated
+        record = dict(validated_data, type=self.CALL_RECORD_TYPE)
+        record['id'], = insert_call_records([record], batch_size=1)
+        if record['id'] is None:
+            raise IntegrityError(f'Call record {record["type"]} {record["call_id"]} already exists')
+        return CallRecord(**record)
 
 
 class CallRecordStartSerializer(CallRecordSerializerMixin, serializers.ModelSerializer):
@@ -30,19 +42,15 @@ class CallRecordStartSerializer(CallRecordSerializerMixin, serializers.ModelSeri
 
     CALL_RECORD_TYPE = CallRecord.START
 
+    # NOTE: declared since the model's fields are optional, they're
+    # blank for END records, which is not what we want here
+    source = serializers.CharField(max_length=PHONE_NUMBER_MAX_LENGTH, validators=[phone_number_validator])
+    destination = serializers.CharField(max_length=PHONE_NUMBER_MAX_LENGTH, validators=[phone_number_validator])
+
     class Meta:
         model = CallRecord
         fields = ('id', 'call_id', 'timestamp', 'source', 'destination')
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # NOTE: This is to override the model's settings. Since the
-        # field has blank=True, it's considered as optional by default
-        # to the serializer, which is not what we want
-        for field in ['source', 'destination']:
-            self.fields[field].required = True
-            self.fields[field].allow_blank = False
-
     def to_representation(self, record):
         data = {
             'id': record.id,
@@ -0,0 +1,114 @@
+"""
+Bill summaries: the number of calls, total duration and price of the
+telephone bill of each subscriber, for each reference period.
+
+They're kept up to date by the query creating calls (see
+`sparrow.call_records.ingestion.INSERT_CALLS_QUERY`), so reading one
+is a primary key lookup however large the bill is. Calls created some
+other way, like seeding a database with SQL, are only accounted for
+once summaries are rebuilt. Rebuilding them accounts for archived calls
+too (see `sparrow.call_records.archive`).
+"""
+__all__ = ['telephone_bill_summary', 'rebuild_bill_summaries']
+
+from django.db import connection, transaction
+
+from sparrow.call_records.api import (
+    calculate_reference_period_bounds, format_durations, format_prices, reference_period_is_current_month
+)
+from sparrow.call_records.exceptions import CurrentMonthForbiddenError
+from sparrow.call_records.models import BillSummary
+
+
+def telephone_bill_summary(subscriber, *, reference_period=None):
+    """
+    Returns the totals of the bill `telephone_bill` would return, with
+    the same arguments and errors:
+
+    {
+        'subscriber': subscriber,
+        'reference_period': 'YYYYMM',
+        'calls': 42,
+        'duration': '3h35m42s',
+        'price': 'R$ 23,96'
+    }
+    """
+    if reference_period_is_current_month(reference_period):
+        raise CurrentMonthForbiddenError(reference_period)
+
+    reference_period, _, _ = calculate_reference_period_bounds(reference_period)
+    summary = BillSummary.objects.filter(subscriber=subscriber, reference_period=reference_period).first()
+    calls, seconds, price = (summary.calls, summary.duration.total_seconds(), summary.price) if summary else (0, 0, 0)
+
+    return {
+        'subscriber': subscriber,
+        'reference_period': reference_period,
+        'calls': calls,
+        'duration': str(format_durations([seconds])[0]),
+        'price': str(format_prices([price])[0]),
+    }
+
+
+def rebuild_bill_summaries(reference_period=None):
+    """
+    Computes the summaries of the given reference period again from its
+    calls, or those of every period if none is given. Returns the
+    number of summaries written.
+    """
+    if reference_period:
+        _, start, end = calculate_reference_period_bounds(reference_period)
+        where = 'WHERE end_timestamp >= %(start)s AND end_timestamp < %(end)s'
+        archive_where = 'WHERE reference_period = %(reference_period)s'
+        delete = _DELETE_SUMMARIES_QUERY + ' WHERE reference_period = %(reference_period)s'
+    else:
+        start, end = None, None
+        where = archive_where = ''
+        delete = _DELETE_SUMMARIES_QUERY
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # NOTE: blocks calls from being created meanwhile, since they
+        # would be added to summaries being rebuilt, but not reads
+        cursor.execute('LOCK TABLE call_records_billsummary IN EXCLUSIVE MODE')
+        cursor.execute(delete, {'reference_period': reference_period})
+        cursor.execute(_INSERT_SUMMARIES_QUERY.format(where=where, archive_where=archive_where),
+                       {'reference_period': reference_period, 'start': start, 'end': end})
+        return cursor.rowcount
+
+
+_DELETE_SUMMARIES_QUERY = 'DELETE FROM call_records_billsummary'
+
+_INSERT_SUMMARIES_QUERY = """
+INSERT INTO call_records_billsummary (subscriber, reference_period, calls, duration, price)
+SELECT
+    subscriber,
+    reference_period,
+    sum(calls),
+    sum(duration),
+    sum(price)
+FROM (
+    SELECT
+        source AS subscriber,
+        to_char(end_timestamp AT TIME ZONE 'UTC', 'YYYYMM') AS reference_period,
+        count(*) AS calls,
+        sum(duration) AS duration,
+        sum(price) AS price
+    FROM
+        call_records_call
+    {where}
+    GROUP BY
+        1, 2
+    UNION ALL
+    SELECT
+        subscriber,
+        reference_period,
+        cardinality(call_ids),
+        (SELECT sum(end_timestamp - start_timestamp) FROM unnest(start_timestamps, end_timestamps)
+            AS archived (start_timestamp, end_timestamp)),
+        (SELECT sum(price) FROM unnest(prices) AS price)
+    FROM
+        call_records_callarchive
+    {archive_where}
+) summaries
+GROUP BY
+    1, 2
+"""
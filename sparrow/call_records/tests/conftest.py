@@ -0,0 +1,15 @@
+import pytest
+
+from django.core.cache import caches
+
+
+@pytest.fixture
+def bill_cache(settings):
+    """
+    Caches bills in a local memory cache, cleared around the test
+    """
+    settings.BILL_CACHE = 'bills'
+    cache = caches['bills']
+    cache.clear()
+    yield cache
+    cache.clear()
@@ -1,17 +1,18 @@
+import numpy as np
 import pytest
 from freezegun import freeze_time
 
-from sparrow.call_records.api import telephone_bill
+from sparrow.call_records.api import _format_start_timestamps, format_durations, format_prices, telephone_bill
 from sparrow.call_records.exceptions import CurrentMonthForbiddenError, InvalidReferencePeriodError
 from sparrow.call_records.models import CallRecord
-from .utils import tzdatetime
+from .utils import create_call_records, tzdatetime
 
 
 @pytest.mark.django_db
 def test_telephone_bill_within_reference_period():
     subscriber = '1132547698'
 
-    CallRecord.objects.bulk_create([
+    create_call_records([
         # A few incomplete pairs that _should_ be ignored
         CallRecord(type=CallRecord.START, call_id=0, timestamp=tzdatetime(2018, 1, 1, 3, 0),
                    source=subscriber, destination='21987654321'),
@@ -64,7 +65,7 @@ def test_telephone_bill_call_finished_next_month_must_be_excluded():
     # in the next month MUST NOT be added
     subscriber = '1132547698'
 
-    CallRecord.objects.bulk_create([
+    create_call_records([
         # A few _complete_ pairs that _should_ be on the bill
         CallRecord(type=CallRecord.START, call_id=1, timestamp=tzdatetime(2018, 1, 30, 23, 2),
                    source=subscriber, destination='21987654321'),
@@ -87,7 +88,7 @@ def test_telephone_bill_call_finished_beginning_month_must_be_added():
     # MUST be added
     subscriber = '1132547698'
 
-    CallRecord.objects.bulk_create([
+    create_call_records([
         # A few _complete_ pairs that _should_ be on the bill
         CallRecord(type=CallRecord.START, call_id=1, timestamp=tzdatetime(2018, 1, 30, 23, 2),
                    source=subscriber, destination='21987654321'),
@@ -100,17 +101,40 @@ def test_telephone_bill_call_finished_beginning_month_must_be_added():
         'subscriber': subscriber,
         'reference_period': '201802',
         'call_records': [
+            # NOTE: it goes through the whole standard time of January 31st
             {'destination': '21987654321', 'start_date': '2018-01-30', 'start_time': '23:02:00Z',
-             'duration': '3h22m', 'price': 'R$ 0,36'},
+             'duration': '1d3h22m', 'price': 'R$ 86,76'},
         ]
     }
 
 
+@pytest.mark.django_db
+def test_telephone_bill_call_spanning_several_months_must_be_added():
+    # Calls are billed in the month they ENDED, however long ago they
+    # started, even when their start record arrived months earlier
+    subscriber = '1132547698'
+
+    create_call_records([
+        CallRecord(type=CallRecord.START, call_id=1, timestamp=tzdatetime(2017, 11, 15, 10, 0),
+                   source=subscriber, destination='21987654321'),
+    ])
+    create_call_records([
+        CallRecord(type=CallRecord.END, call_id=1, timestamp=tzdatetime(2018, 2, 1, 10, 0)),
+    ])
+
+    assert telephone_bill(subscriber, reference_period='201712')['call_records'] == []
+    assert telephone_bill(subscriber, reference_period='201802')['call_records'] == [
+        # NOTE: 78 days, each with 16 hours of standard time
+        {'destination': '21987654321', 'start_date': '2017-11-15', 'start_time': '10:00:00Z',
+         'duration': '78d', 'price': 'R$ 6,739,56'},
+    ]
+
+
 @pytest.mark.django_db
 def test_telephone_bill_standard_tariff():
     subscriber = '1132547698'
 
-    CallRecord.objects.bulk_create([
+    create_call_records([
         CallRecord(type=CallRecord.START, call_id=1, timestamp=tzdatetime(2018, 1, 1, 10, 0),
                    source=subscriber, destination='21987654321'),
         CallRecord(type=CallRecord.END, call_id=1, timestamp=tzdatetime(2018, 1, 1, 10, 2)),
@@ -132,7 +156,7 @@ def test_telephone_bill_standard_tariff():
 def test_telephone_bill_reduced_tariff():
     subscriber = '1132547698'
 
-    CallRecord.objects.bulk_create([
+    create_call_records([
         CallRecord(type=CallRecord.START, call_id=3, timestamp=tzdatetime(2018, 1, 5, 23, 2),
                    source=subscriber, destination='2133445566'),
         CallRecord(type=CallRecord.END, call_id=3, timestamp=tzdatetime(2018, 1, 5, 23, 57)),
@@ -161,7 +185,7 @@ def test_get_telephone_bill_current_month_should_fail():
 def test_get_telephone_bill_no_reference_period_uses_last_month():
     subscriber = '1132547698'
 
-    CallRecord.objects.bulk_create([
+    create_call_records([
         # Since these are too old (bill is supposed to infer 201802),
         # they SHOULD NOT be added to the bill
         CallRecord(type=CallRecord.START, call_id=11, timestamp=tzdatetime(2018, 1, 1, 10, 0),
@@ -219,3 +243,25 @@ def test_get_telephone_bill_invalid_reference_period_should_fail():
         telephone_bill('1212345678', reference_period=True)
     with pytest.raises(InvalidReferencePeriodError):
         telephone_bill('1212345678', reference_period=42)
+
+
+def test_format_prices():
+    prices = np.array([0, 7, 396, 100000, 123456789, 100000000])
+
+    assert format_prices(prices).tolist() == [
+        'R$ 0,00', 'R$ 0,07', 'R$ 3,96', 'R$ 1,000,00', 'R$ 1,234,567,89', 'R$ 1,000,000,00',
+    ]
+
+
+def test_format_durations():
+    durations = np.array([-3, 0, 59.9, 3600, 90061, 2 * 86400 + 5])
+
+    assert format_durations(durations).tolist() == ['', '', '59s', '1h', '1d1h1m1s', '2d5s']
+
+
+def test_format_start_timestamps():
+    # NOTE: 2018-01-01T10:00:00Z, with and without microseconds
+    start_dates, start_times = _format_start_timestamps(np.array([1514800800000000, 1514800800000250]))
+
+    assert start_dates.tolist() == ['2018-01-01', '2018-01-01']
+    assert start_times.tolist() == ['10:00:00Z', '10:00:00.000250Z']
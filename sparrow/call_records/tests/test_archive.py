@@ -0,0 +1,149 @@
+import json
+import pytest
+from datetime import date
+from freezegun import freeze_time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.urls import reverse
+from rest_framework import status
+
+from sparrow.call_records import partitions
+from sparrow.call_records.api import stream_telephone_bill, telephone_bill
+from sparrow.call_records.archive import archive_period
+from sparrow.call_records.billing import TableBillWriter, run_billing
+from sparrow.call_records.ingestion import insert_call_records
+from sparrow.call_records.exceptions import CurrentMonthForbiddenError
+from sparrow.call_records.models import ArchivedCallId, Bill, BillSummary, Call, CallArchive, CallRecord
+from sparrow.call_records.summaries import rebuild_bill_summaries
+from .utils import create_calls, tzdatetime
+
+
+def create_january_calls():
+    create_calls([
+        (1, '2199998888', tzdatetime(2018, 1, 10, 10), tzdatetime(2018, 1, 10, 10, 5), '0299997777'),
+        (2, '2199998888', tzdatetime(2017, 12, 31, 23, 50), tzdatetime(2018, 1, 1, 0, 10)),
+        (3, '2199990000', tzdatetime(2018, 1, 5, 10), tzdatetime(2018, 1, 5, 10, 0, 30)),
+        (4, '2199998888', tzdatetime(2018, 2, 1, 10), tzdatetime(2018, 2, 1, 10, 1)),
+    ])
+    # NOTE: an orphan, which isn't part of any call
+    CallRecord.objects.create(type=CallRecord.START, call_id=5, timestamp=tzdatetime(2018, 1, 20, 10),
+                              source='2199998888', destination='2199997777')
+
+
+def bills():
+    return [telephone_bill(subscriber, reference_period=period)
+            for subscriber in ['2199998888', '2199990000'] for period in ['201801', '201802']]
+
+
+@pytest.mark.django_db
+def test_archive_period():
+    with connection.cursor() as cursor:
+        partitions.create_partition(cursor, date(2018, 1, 1))
+    create_january_calls()
+    expected_bills = bills()
+    expected_summaries = sorted(BillSummary.objects.values_list('subscriber', 'reference_period', 'calls', 'price'))
+
+    assert archive_period('201801') == {'subscribers': 2, 'calls': 3, 'records': 6}
+
+    assert list(Call.objects.values_list('call_id', flat=True)) == [4]
+    assert sorted(CallRecord.objects.values_list('type', 'call_id')) == [('end', 4), ('start', 4), ('start', 5)]
+    archive = CallArchive.objects.get(subscriber='2199998888')
+    assert (archive.reference_period, archive.call_ids, archive.destinations) == \
+        ('201801', [2, 1], ['2199997777', '0299997777'])
+
+    # NOTE: bills read archived calls transparently
+    assert bills() == expected_bills
+    streamed = stream_telephone_bill('2199998888', reference_period='201801', chunk_size=1)
+    assert [record for chunk in streamed['call_records'] for record in chunk] == expected_bills[0]['call_records']
+    run_billing('201801', TableBillWriter('201801'), workers=1, shard_size=10)
+    assert sorted(Bill.objects.values_list('subscriber', flat=True)) == ['2199990000', '2199998888']
+
+    rebuild_bill_summaries()
+    assert sorted(BillSummary.objects.values_list('subscriber', 'reference_period', 'calls', 'price')) == \
+        expected_summaries
+
+
+@pytest.mark.django_db
+def test_archive_period_without_partition():
+    create_january_calls()
+    expected_bills = bills()
+
+    assert archive_period('201801')['calls'] == 3
+    assert list(Call.objects.values_list('call_id', flat=True)) == [4]
+    assert bills() == expected_bills
+
+
+@pytest.mark.django_db
+def test_archived_call_records_are_duplicates(client, tmp_path):
+    create_january_calls()
+    archive_period('201801')
+    assert sorted(ArchivedCallId.objects.values_list('call_id', flat=True)) == [1, 2, 3]
+    expected_bills = bills()
+
+    # NOTE: the records of archived calls were deleted, but records sent
+    # again are still duplicates, whichever way they're ingested
+    record = {'type': CallRecord.END, 'call_id': 1, 'timestamp': tzdatetime(2018, 1, 10, 10, 5)}
+    assert insert_call_records([record, dict(record, call_id=6)], batch_size=10)[0] is None
+    response = client.post(reverse('call_records:index'), data=dict(record, call_id=2))
+    assert response.status_code == status.HTTP_409_CONFLICT
+    path = tmp_path / 'records.ndjson'
+    path.write_text(json.dumps(dict(record, call_id=3, timestamp='2018-01-05T10:00:30Z')))
+    call_command('import_call_records', str(path), stdout=StringIO())
+
+    assert sorted(CallRecord.objects.values_list('type', 'call_id')) == \
+        [('end', 4), ('end', 6), ('start', 4), ('start', 5)]
+    assert bills() == expected_bills
+
+
+@pytest.mark.django_db
+def test_archive_period_again():
+    create_january_calls()
+    archive_period('201801')
+
+    # NOTE: a call arriving late for the archived period
+    create_calls([(6, '2199998888', tzdatetime(2018, 1, 2, 10), tzdatetime(2018, 1, 2, 10, 1))])
+    expected_bills = bills()
+    assert [record['start_date'] for record in expected_bills[0]['call_records']] == \
+        ['2017-12-31', '2018-01-02', '2018-01-10']
+
+    assert archive_period('201801') == {'subscribers': 1, 'calls': 1, 'records': 2}
+    assert CallArchive.objects.get(subscriber='2199998888').call_ids == [2, 1, 6]
+    assert bills() == expected_bills
+
+
+@freeze_time('2018-01-21')
+@pytest.mark.parametrize('reference_period', ['201801', '201802'])
+def test_archive_period_not_closed(reference_period):
+    with pytest.raises(CurrentMonthForbiddenError):
+        archive_period(reference_period)
+
+
+@freeze_time('2018-03-10')
+@pytest.mark.django_db
+def test_archive_calls_command():
+    with connection.cursor() as cursor:
+        for month in [date(2018, 1, 1), date(2018, 2, 1), date(2018, 3, 1)]:
+            partitions.create_partition(cursor, month)
+    create_january_calls()
+
+    stdout = StringIO()
+    call_command('archive_calls', '--before', '201803', stdout=stdout)
+    lines = stdout.getvalue().splitlines()
+    assert [line.split(' in ')[0] for line in lines] == ['Archived 201801', 'Archived 201802']
+    assert lines[0].endswith(': 3 calls of 2 subscribers, 6 call records deleted')
+    assert lines[1].endswith(': 1 calls of 1 subscribers, 2 call records deleted')
+    assert not Call.objects.exists()
+
+    # NOTE: pruning months deletes their archived calls too
+    call_command('prune_call_partitions', '--before', '201802', stdout=StringIO())
+    assert list(CallArchive.objects.values_list('reference_period', flat=True)) == ['201802']
+
+
+@freeze_time('2018-03-10')
+@pytest.mark.parametrize('before', ['2018-01', '201804'])
+def test_archive_calls_command_invalid_period(before):
+    with pytest.raises(CommandError):
+        call_command('archive_calls', '--before', before)
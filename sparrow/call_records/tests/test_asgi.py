@@ -0,0 +1,167 @@
+import json
+import pytest
+from unittest import mock
+
+from django.urls import reverse
+
+from sparrow.call_records.api import telephone_bill
+from sparrow.call_records.cache import _bill_key
+from sparrow.call_records.models import Call, CallRecord
+from .utils import asgi_request
+
+
+def post_call_record(data):
+    status, body = asgi_request('POST', '/call_records/', body=json.dumps(data).encode())
+    return status, json.loads(body)
+
+
+# NOTE: asyncpg has its own connections, so test data must be committed.
+# serialized_rollback restores the initial tariff afterwards
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_post_call_records():
+    status, start = post_call_record({'type': 'start', 'call_id': 12, 'timestamp': '2018-01-01T10:00:00Z',
+                                      'source': '2199998888', 'destination': '2199997777'})
+    assert status == 201
+    assert start == {'id': CallRecord.objects.get(type='start').id, 'type': 'start', 'call_id': 12,
+                     'timestamp': '2018-01-01T10:00:00Z', 'source': '2199998888', 'destination': '2199997777'}
+
+    status, end = post_call_record({'type': 'end', 'call_id': 12, 'timestamp': '2018-01-01T10:02:00Z'})
+    assert status == 201
+    assert end == {'id': CallRecord.objects.get(type='end').id, 'type': 'end', 'call_id': 12,
+                   'timestamp': '2018-01-01T10:02:00Z'}
+
+    call = Call.objects.get()
+    assert (call.source, call.price) == ('2199998888', 54)
+
+    assert post_call_record({'type': 'end', 'call_id': 12, 'timestamp': '2018-01-01T10:02:00Z'}) == (
+        409, {'detail': 'Call record already exists'}
+    )
+
+    status, body = asgi_request('GET', '/call_records/telephone_bill/',
+                                query_string=b'subscriber=2199998888&reference_period=201801')
+    assert status == 200
+    assert json.loads(body) == telephone_bill('2199998888', reference_period='201801')
+
+    status, streamed_body = asgi_request('GET', '/call_records/telephone_bill/',
+                                         query_string=b'subscriber=2199998888&reference_period=201801&stream=1')
+    assert (status, streamed_body) == (200, body)
+
+
+@pytest.mark.parametrize('data', [
+    {'type': 'middle', 'call_id': 12},
+    {'type': 'end', 'call_id': 12},
+    {'type': 'start', 'call_id': 12, 'timestamp': '2018-01-01T10:00:00Z', 'source': 'a'},
+])
+def test_post_call_records_invalid(client, data):
+    response = client.post(reverse('call_records:index'), data=json.dumps(data), content_type='application/json')
+
+    assert post_call_record(data) == (response.status_code, response.json())
+
+
+def test_post_call_records_unsupported_media_type():
+    status, body = asgi_request('POST', '/call_records/', body=b'type=end', content_type=b'text/plain')
+
+    assert status == 415
+
+
+@pytest.mark.parametrize('query_string', [
+    b'reference_period=201801',
+    b'subscriber=2199998888&reference_period=2018',
+])
+def test_get_telephone_bill_invalid(client, query_string):
+    response = client.get(f'{reverse("call_records:telephone_bill")}?{query_string.decode()}')
+
+    status, body = asgi_request('GET', '/call_records/telephone_bill/', query_string=query_string)
+
+    assert (status, json.loads(body)) == (response.status_code, response.json())
+
+
+def test_disallowed_host():
+    status, body = asgi_request('GET', '/call_records/telephone_bill/', host=b'example.com',
+                                query_string=b'subscriber=2199998888&reference_period=201801')
+
+    assert (status, json.loads(body)) == (400, {'detail': 'Invalid HTTP_HOST header'})
+
+
+def test_other_requests_are_served_by_fallback():
+    scopes = []
+
+    async def fallback(scope, receive, send):
+        scopes.append(scope)
+        await send({'type': 'http.response.start', 'status': 204, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    assert asgi_request('GET', '/call_records/', fallback=fallback) == (204, b'')
+    assert [scope['path'] for scope in scopes] == ['/call_records/']
+
+
+def test_buffered_call_records_are_served_by_fallback(settings):
+    settings.CALL_RECORDS_INGESTION_MODE = 'buffered'
+    scopes = []
+
+    async def fallback(scope, receive, send):
+        scopes.append(scope)
+        await send({'type': 'http.response.start', 'status': 202, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    assert asgi_request('POST', '/call_records/', body=b'{}', fallback=fallback) == (202, b'')
+    assert [scope['path'] for scope in scopes] == ['/call_records/']
+
+
+def test_profiled_requests_are_served_by_fallback(settings, tmp_path):
+    settings.PROFILING_DIR = str(tmp_path)
+    scopes = []
+
+    async def fallback(scope, receive, send):
+        scopes.append(scope)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    assert asgi_request('GET', '/call_records/telephone_bill/', headers=[(b'x-profile', b'token')],
+                        fallback=fallback) == (200, b'')
+    assert [scope['path'] for scope in scopes] == ['/call_records/telephone_bill/']
+
+
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_slow_queries(caplog, settings):
+    settings.SLOW_QUERY_THRESHOLD = 1e-9
+    settings.SLOW_QUERY_SAMPLE_RATE = 1
+
+    asgi_request('GET', '/call_records/telephone_bill/', query_string=b'subscriber=2199998888&reference_period=201801')
+
+    logged_queries = [json.loads(record.getMessage()) for record in caplog.records
+                      if record.name == 'sparrow.core.slow_queries' and record.levelname == 'WARNING']
+    bill_query, = [query for query in logged_queries if 'call_records_call' in query['sql']]
+    assert bill_query['origin'] == 'GET /call_records/telephone_bill/'
+    assert bill_query['duration_ms'] > 0
+    assert bill_query['params'][0] == '2199998888'
+    plan, = bill_query['plan']
+    assert 'Shared Hit Blocks' in plan['Plan']
+
+
+def test_get_telephone_bill_waits_for_other_worker(bill_cache):
+    key = _bill_key(bill_cache, '2199998888', '201801')
+    bill_cache.add(f'{key}:lock', True)
+
+    async def other_worker_finishes(seconds):
+        bill_cache.set(key, {'computed': 'elsewhere'})
+
+    # NOTE: no database access, since the application has no pool yet
+    with mock.patch('sparrow.call_records.asgi.asyncio.sleep', side_effect=other_worker_finishes):
+        status, body = asgi_request('GET', '/call_records/telephone_bill/',
+                                    query_string=b'subscriber=2199998888&reference_period=201801')
+    assert (status, json.loads(body)) == (200, {'computed': 'elsewhere'})
+
+
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_get_telephone_bill_other_worker_timed_out(bill_cache, settings):
+    settings.BILL_CACHE_LOCK_TIMEOUT = 0
+    key = _bill_key(bill_cache, '2199998888', '201801')
+    bill_cache.add(f'{key}:lock', True)
+
+    status, body = asgi_request('GET', '/call_records/telephone_bill/',
+                                query_string=b'subscriber=2199998888&reference_period=201801')
+    assert (status, json.loads(body)['call_records']) == (200, [])
+    assert bill_cache.get(key)['call_records'] == []
+    # NOTE: the lock belongs to the other worker, so it must be kept
+    assert bill_cache.get(f'{key}:lock')
@@ -0,0 +1,209 @@
+import os
+import pytest
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import reverse
+from rest_framework import status
+
+from sparrow.call_records import buffer
+from sparrow.call_records.buffer import BufferFullError, IngestionBuffer
+from sparrow.call_records.checks import check_settings, check_status_cache
+from sparrow.call_records.models import Call, CallRecord
+from .utils import tzdatetime
+
+
+def fake_writes(ingestion_buffer, failures=0, status_failures=0):
+    """
+    Replaces the writes of `ingestion_buffer` by appending each batch,
+    and the ids of its records, to the returned lists, after raising
+    `failures` and `status_failures` times respectively
+    """
+    batches = []
+    statuses = []
+
+    def insert(batch):
+        if len(batches) < failures:
+            batches.append(None)
+            raise RuntimeError('database unavailable')
+
+        batches.append([entry.record for entry in batch])
+        return list(range(1, len(batch) + 1))
+
+    def set_statuses(batch, ids):
+        if len(statuses) < status_failures:
+            statuses.append(None)
+            raise RuntimeError('cache unavailable')
+
+        statuses.append(ids)
+
+    ingestion_buffer._insert = insert
+    ingestion_buffer._set_statuses = set_statuses
+    return batches, statuses
+
+
+def test_buffer_flushes_full_batches():
+    ingestion_buffer = IngestionBuffer(max_size=10, batch_size=3, flush_interval=60, durable=True)
+    batches, _ = fake_writes(ingestion_buffer)
+
+    events = [ingestion_buffer.submit(i, {'call_id': i}, timeout=1) for i in range(4)]
+
+    assert events[2].wait(timeout=5)
+    assert not events[3].is_set()
+    assert batches == [[{'call_id': 0}, {'call_id': 1}, {'call_id': 2}]]
+
+
+def test_buffer_flushes_after_interval():
+    ingestion_buffer = IngestionBuffer(max_size=10, batch_size=100, flush_interval=0.05, durable=True)
+    batches, _ = fake_writes(ingestion_buffer)
+
+    assert ingestion_buffer.submit(1, {'call_id': 1}, timeout=1).wait(timeout=5)
+    assert batches == [[{'call_id': 1}]]
+
+
+def test_buffer_retries_failed_writes():
+    ingestion_buffer = IngestionBuffer(max_size=10, batch_size=1, flush_interval=0.01, durable=True)
+    batches, _ = fake_writes(ingestion_buffer, failures=2)
+
+    assert ingestion_buffer.submit(1, {'call_id': 1}, timeout=1).wait(timeout=5)
+    assert batches == [None, None, [{'call_id': 1}]]
+
+
+def test_buffer_drops_batches_failing_too_often(caplog):
+    ingestion_buffer = IngestionBuffer(max_size=10, batch_size=1, flush_interval=0.01, durable=True,
+                                       max_attempts=2)
+    batches, statuses = fake_writes(ingestion_buffer, failures=2)
+
+    assert ingestion_buffer.submit(1, {'call_id': 1}, timeout=1).wait(timeout=5)
+    assert ingestion_buffer.submit(2, {'call_id': 2}, timeout=1).wait(timeout=5)
+    assert batches == [None, None, [{'call_id': 2}]]
+    assert statuses == [None, [1]]
+    assert '[{"call_id": 1}]' in caplog.text
+
+
+def test_buffer_retries_failed_status_writes_alone():
+    ingestion_buffer = IngestionBuffer(max_size=10, batch_size=1, flush_interval=0.01, durable=True)
+    batches, statuses = fake_writes(ingestion_buffer, status_failures=2)
+
+    assert ingestion_buffer.submit(1, {'call_id': 1}, timeout=1).wait(timeout=5)
+    assert batches == [[{'call_id': 1}]]
+    assert statuses == [None, None, [1]]
+
+
+def test_buffer_full():
+    ingestion_buffer = IngestionBuffer(max_size=1, batch_size=1, flush_interval=0.01, durable=True,
+                                       background=False)
+
+    ingestion_buffer.submit(1, {'call_id': 1}, timeout=0)
+    with pytest.raises(BufferFullError):
+        ingestion_buffer.submit(2, {'call_id': 2}, timeout=0)
+
+
+@pytest.fixture
+def ingestion_buffer(settings, monkeypatch):
+    """
+    Enables the buffered ingestion mode, with a buffer flushed by the
+    tests themselves: a background thread would use another
+    connection, outside of the test transaction
+    """
+    settings.CALL_RECORDS_INGESTION_MODE = buffer.BUFFERED
+    settings.CALL_RECORDS_STATUS_CACHE = 'bills'
+    settings.CALL_RECORDS_BUFFER_TIMEOUT = 0
+    caches['bills'].clear()
+
+    ingestion_buffer = IngestionBuffer(max_size=2, batch_size=10, flush_interval=0, durable=False, background=False)
+    monkeypatch.setattr(buffer, '_buffer', ingestion_buffer)
+    monkeypatch.setattr(buffer, '_buffer_pid', os.getpid())
+    yield ingestion_buffer
+    caches['bills'].clear()
+
+
+def post_end_record(client, call_id):
+    return client.post(reverse('call_records:index'), data={
+        'type': CallRecord.END,
+        'call_id': call_id,
+        'timestamp': tzdatetime(2018, 1, 1, 10, 2),
+    })
+
+
+@pytest.mark.django_db
+def test_post_buffered(client, ingestion_buffer):
+    CallRecord.objects.create(type=CallRecord.START, call_id=11, timestamp=tzdatetime(2018, 1, 1, 10),
+                              source='2199998888', destination='2199997777')
+
+    responses = [post_end_record(client, 11), post_end_record(client, 11)]
+
+    assert [response.status_code for response in responses] == [status.HTTP_202_ACCEPTED] * 2
+    assert responses[0].json()['status'] == buffer.PENDING
+    assert not CallRecord.objects.filter(type=CallRecord.END).exists()
+    status_url = responses[0].json()['url']
+    assert client.get(status_url).status_code == status.HTTP_202_ACCEPTED
+
+    ingestion_buffer.flush()
+
+    record = CallRecord.objects.get(type=CallRecord.END)
+    assert Call.objects.filter(call_id=11).exists()
+    response = client.get(status_url)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {'status': 'created', 'id': record.id}
+
+    response = client.get(responses[1].json()['url'])
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json() == {'status': 'duplicate', 'detail': 'Call record already exists'}
+
+
+@pytest.mark.django_db
+def test_post_buffered_invalid(client, ingestion_buffer):
+    response = client.post(reverse('call_records:index'), data={'type': CallRecord.END, 'call_id': 11})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == {'timestamp': ['This field is required.']}
+    assert ingestion_buffer._queue.empty()
+
+
+@pytest.mark.django_db
+def test_post_buffered_full(client, ingestion_buffer):
+    responses = [post_end_record(client, call_id) for call_id in range(3)]
+
+    assert [response.status_code for response in responses] == [
+        status.HTTP_202_ACCEPTED, status.HTTP_202_ACCEPTED, status.HTTP_503_SERVICE_UNAVAILABLE
+    ]
+
+
+@pytest.mark.django_db
+def test_post_buffered_failed(client, ingestion_buffer):
+    response = post_end_record(client, 11)
+    ingestion_buffer._set_statuses(list(ingestion_buffer._queue.queue), None)
+
+    response = client.get(response.json()['url'])
+    assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+    assert response.json() == {'status': 'failed', 'detail': 'Call record could not be written, post it again'}
+
+
+def test_get_ingestion_status_unknown(client, settings):
+    settings.CALL_RECORDS_STATUS_CACHE = 'bills'
+
+    response = client.get(reverse('call_records:ingestion_status',
+                                  kwargs={'ingestion_id': '0b7e7d3c-43e2-4f4b-a8a1-08d4bc6a5b5e'}))
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_check_status_cache(settings):
+    settings.CALL_RECORDS_STATUS_CACHE = 'default'
+    assert check_status_cache(None) == []
+
+    # NOTE: statuses would only be known to the worker they were posted to
+    settings.CALL_RECORDS_INGESTION_MODE = buffer.BUFFERED
+    assert [error.id for error in check_status_cache(None)] == ['call_records.E002']
+    with pytest.raises(ImproperlyConfigured):
+        check_settings()
+
+    settings.CALL_RECORDS_STATUS_CACHE = 'bills'
+    assert [error.id for error in check_status_cache(None)] == ['call_records.E002']
+
+    settings.CACHES = {**settings.CACHES, 'shared': {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache', 'LOCATION': '127.0.0.1:11211',
+    }}
+    settings.CALL_RECORDS_STATUS_CACHE = 'shared'
+    assert check_status_cache(None) == []
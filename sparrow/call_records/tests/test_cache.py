@@ -0,0 +1,119 @@
+import pytest
+from datetime import date
+from freezegun import freeze_time
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+
+from sparrow.call_records import partitions
+
+from sparrow.call_records.cache import cached_telephone_bill, _bill_key
+from sparrow.call_records.checks import check_bill_cache
+from sparrow.call_records.models import CallRecord
+from .utils import create_call_records, create_calls, tzdatetime
+
+
+SUBSCRIBER = '1132547698'
+
+
+@pytest.mark.django_db
+def test_cached_telephone_bill(bill_cache, django_assert_num_queries):
+    create_calls([(1, SUBSCRIBER, tzdatetime(2018, 1, 1, 10, 0), tzdatetime(2018, 1, 1, 10, 2))])
+
+    bill = cached_telephone_bill(SUBSCRIBER, reference_period='201801')
+    assert len(bill['call_records']) == 1
+
+    with django_assert_num_queries(0):
+        assert cached_telephone_bill(SUBSCRIBER, reference_period='201801') == bill
+
+
+@freeze_time('2018-02-04')
+@pytest.mark.django_db
+def test_cached_telephone_bill_no_reference_period_uses_last_month(bill_cache, django_assert_num_queries):
+    bill = cached_telephone_bill(SUBSCRIBER, reference_period='201801')
+
+    with django_assert_num_queries(0):
+        assert cached_telephone_bill(SUBSCRIBER) == bill
+
+
+# NOTE: bills are invalidated on commit, which never happens within tests
+@mock.patch('sparrow.call_records.ingestion.transaction.on_commit', side_effect=lambda callback: callback())
+@pytest.mark.django_db
+def test_cached_telephone_bill_invalidated_by_late_call(on_commit, bill_cache):
+    create_calls([(1, SUBSCRIBER, tzdatetime(2018, 1, 1, 10, 0), tzdatetime(2018, 1, 1, 10, 2))])
+    assert len(cached_telephone_bill(SUBSCRIBER, reference_period='201801')['call_records']) == 1
+
+    # NOTE: none of these belong to the cached bill
+    create_calls([
+        (2, '2133445566', tzdatetime(2018, 1, 2, 10, 0), tzdatetime(2018, 1, 2, 10, 2)),
+        (3, SUBSCRIBER, tzdatetime(2018, 1, 31, 23, 50), tzdatetime(2018, 2, 1, 0, 10)),
+    ])
+    key = _bill_key(bill_cache, SUBSCRIBER, '201801')
+
+    # NOTE: this one is late, it ended in January
+    create_call_records([
+        CallRecord(type=CallRecord.END, call_id=4, timestamp=tzdatetime(2018, 1, 3, 10, 2)),
+    ])
+    assert _bill_key(bill_cache, SUBSCRIBER, '201801') == key
+    create_call_records([
+        CallRecord(type=CallRecord.START, call_id=4, timestamp=tzdatetime(2018, 1, 3, 10, 0),
+                   source=SUBSCRIBER, destination='21987654321'),
+    ])
+
+    assert _bill_key(bill_cache, SUBSCRIBER, '201801') != key
+    assert len(cached_telephone_bill(SUBSCRIBER, reference_period='201801')['call_records']) == 2
+
+
+@pytest.mark.django_db
+def test_cached_telephone_bill_waits_for_other_worker(bill_cache, django_assert_num_queries):
+    key = _bill_key(bill_cache, SUBSCRIBER, '201801')
+    bill_cache.add(f'{key}:lock', True)
+
+    def other_worker_finishes(seconds):
+        bill_cache.set(key, {'computed': 'elsewhere'})
+
+    with mock.patch('sparrow.call_records.cache.time.sleep', side_effect=other_worker_finishes):
+        with django_assert_num_queries(0):
+            assert cached_telephone_bill(SUBSCRIBER, reference_period='201801') == {'computed': 'elsewhere'}
+
+
+@pytest.mark.django_db
+def test_cached_telephone_bill_other_worker_timed_out(bill_cache, settings):
+    settings.BILL_CACHE_LOCK_TIMEOUT = 0
+    key = _bill_key(bill_cache, SUBSCRIBER, '201801')
+    bill_cache.add(f'{key}:lock', True)
+
+    assert cached_telephone_bill(SUBSCRIBER, reference_period='201801')['call_records'] == []
+    # NOTE: the lock belongs to the other worker, so it must be kept
+    assert bill_cache.get(f'{key}:lock')
+
+
+# NOTE: bills are invalidated on commit, which never happens within tests
+@mock.patch('sparrow.call_records.management.commands.prune_call_partitions.transaction.on_commit',
+            side_effect=lambda callback: callback())
+@pytest.mark.django_db
+def test_cached_telephone_bill_invalidated_by_pruning(on_commit, bill_cache):
+    with connection.cursor() as cursor:
+        for month in [date(2017, 12, 1), date(2018, 1, 1)]:
+            partitions.create_partition(cursor, month)
+    create_calls([
+        (1, SUBSCRIBER, tzdatetime(2017, 12, 1, 10, 0), tzdatetime(2017, 12, 1, 10, 2)),
+        (2, SUBSCRIBER, tzdatetime(2018, 1, 1, 10, 0), tzdatetime(2018, 1, 1, 10, 2)),
+    ])
+    assert len(cached_telephone_bill(SUBSCRIBER, reference_period='201712')['call_records']) == 1
+    january_key = _bill_key(bill_cache, SUBSCRIBER, '201801')
+
+    call_command('prune_call_partitions', before='201801', stdout=StringIO())
+
+    assert cached_telephone_bill(SUBSCRIBER, reference_period='201712')['call_records'] == []
+    assert _bill_key(bill_cache, SUBSCRIBER, '201801') == january_key
+
+
+def test_check_bill_cache(settings):
+    assert check_bill_cache(None) == []
+
+    # NOTE: a local memory cache isn't shared between workers
+    settings.BILL_CACHE = 'bills'
+    assert [error.id for error in check_bill_cache(None)] == ['call_records.E001']
@@ -0,0 +1,321 @@
+import json
+import pytest
+from collections import Counter
+from datetime import date, timedelta
+from freezegun import freeze_time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+
+from sparrow.call_records import partitions
+from sparrow.call_records.api import telephone_bill
+from sparrow.call_records.models import Bill, BillSummary, Call, CallRecord, PruningState
+from sparrow.call_records.validation import validate_call_record
+from .utils import create_call_records, tzdatetime
+
+
+def import_call_records(path, **options):
+    stdout = StringIO()
+    call_command('import_call_records', str(path), stdout=stdout, **options)
+    return stdout.getvalue()
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 10000])
+@pytest.mark.django_db
+def test_import_call_records_ndjson(tmp_path, batch_size):
+    CallRecord.objects.create(type=CallRecord.END, call_id=11, timestamp=tzdatetime(2018, 1, 1))
+    path = tmp_path / 'records.ndjson'
+    path.write_text('\n'.join([
+        json.dumps({'type': CallRecord.START, 'call_id': 11, 'timestamp': '2018-01-01T10:00:00Z',
+                    'source': '2199998888', 'destination': '2199997777'}),
+        json.dumps({'type': CallRecord.END, 'call_id': 11, 'timestamp': '2018-01-01T10:05:00Z'}),
+        '',
+        json.dumps({'type': CallRecord.START, 'call_id': 12, 'timestamp': '2018-01-01T10:00:00Z',
+                    'source': 'a', 'destination': '2199997777'}),
+        json.dumps({'type': 'whatever', 'call_id': 12}),
+        '{"type": ',
+        json.dumps({'type': CallRecord.END, 'call_id': 12, 'timestamp': '2018-01-01T10:05:00'}),
+        json.dumps({'type': CallRecord.END, 'call_id': 12, 'timestamp': '2018-01-01T10:06:00Z'}),
+    ]))
+
+    output = import_call_records(path, batch_size=batch_size)
+
+    assert '7 lines read' in output
+    assert '2 imported, 2 duplicates, 3 rejected' in output
+    assert CallRecord.objects.filter(type=CallRecord.START, call_id=11, source='2199998888').exists()
+    assert CallRecord.objects.get(type=CallRecord.END, call_id=12).timestamp == tzdatetime(2018, 1, 1, 10, 5)
+
+
+@pytest.mark.django_db
+def test_import_call_records_csv(tmp_path):
+    path = tmp_path / 'records.csv'
+    path.write_text('\n'.join([
+        'type,call_id,timestamp,source,destination',
+        'start,11,2018-01-01T10:00:00Z,2199998888,2199997777',
+        'end,11,2018-01-01T10:05:00Z,,',
+        'start,12,2018-01-01T10:00:00Z,,2199997777',
+        'end,-1,2018-01-01T10:05:00Z,,',
+    ]))
+
+    output = import_call_records(path)
+
+    assert '2 imported, 0 duplicates, 2 rejected' in output
+    assert CallRecord.objects.count() == 2
+    assert list(Call.objects.values_list('call_id', flat=True)) == [11]
+
+
+def test_import_call_records_unknown_format(tmp_path):
+    with pytest.raises(CommandError):
+        import_call_records(tmp_path / 'records.txt')
+
+
+def list_call_partitions():
+    with connection.cursor() as cursor:
+        return [partitions.partition_name(month) for month in partitions.list_partitions(cursor)]
+
+
+@freeze_time('2018-01-21')
+@pytest.mark.django_db
+def test_create_call_partitions():
+    create_call_records([
+        CallRecord(type=CallRecord.START, call_id=1, timestamp=tzdatetime(2017, 10, 31, 23, 50),
+                   source='2199998888', destination='2199997777'),
+        CallRecord(type=CallRecord.END, call_id=1, timestamp=tzdatetime(2017, 11, 1, 0, 10)),
+    ])
+
+    stdout = StringIO()
+    call_command('create_call_partitions', ahead=1, stdout=stdout)
+
+    assert stdout.getvalue().split('\n')[:-1] == [
+        'Created call_records_call_201711',
+        'Created call_records_call_201801',
+        'Created call_records_call_201802',
+    ]
+    assert list_call_partitions() == [
+        'call_records_call_201711',
+        'call_records_call_201801',
+        'call_records_call_201802',
+    ]
+    assert Call.objects.extra(where=["tableoid = 'call_records_call_201711'::regclass"]).count() == 1
+
+    # NOTE: running it again must be harmless
+    call_command('create_call_partitions', ahead=1, stdout=StringIO())
+    assert len(list_call_partitions()) == 3
+
+
+@pytest.mark.parametrize('drop', [False, True])
+@pytest.mark.django_db
+def test_prune_call_partitions(drop):
+    with connection.cursor() as cursor:
+        for month in [date(2017, 11, 1), date(2017, 12, 1), date(2018, 1, 1)]:
+            partitions.create_partition(cursor, month)
+    BillSummary.objects.bulk_create([
+        BillSummary(subscriber='2199998888', reference_period=period, calls=1, duration=timedelta(minutes=1), price=45)
+        for period in ['201711', '201801']
+    ])
+
+    call_command('prune_call_partitions', before='201801', drop=drop, stdout=StringIO())
+
+    assert list_call_partitions() == ['call_records_call_201801']
+    assert list(BillSummary.objects.values_list('reference_period', flat=True)) == ['201801']
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('call_records_call_201711') IS NOT NULL")
+        assert cursor.fetchone() == (not drop,)
+
+    # NOTE: calls of pruned months arriving late are not created, so
+    # they're not billed from the default partition
+    create_call_records([
+        CallRecord(type=CallRecord.START, call_id=1, timestamp=tzdatetime(2017, 12, 31, 23, 50),
+                   source='2199998888', destination='2199997777'),
+        CallRecord(type=CallRecord.END, call_id=1, timestamp=tzdatetime(2017, 12, 31, 23, 55)),
+        CallRecord(type=CallRecord.START, call_id=2, timestamp=tzdatetime(2017, 12, 31, 23, 55),
+                   source='2199998888', destination='2199997777'),
+        CallRecord(type=CallRecord.END, call_id=2, timestamp=tzdatetime(2018, 1, 1, 0, 5)),
+    ])
+    assert list(Call.objects.values_list('call_id', flat=True)) == [2]
+    assert CallRecord.objects.filter(call_id=1).count() == 2
+
+    # NOTE: pruning older months again doesn't bring them back
+    call_command('prune_call_partitions', before='201712', drop=drop, stdout=StringIO())
+    assert PruningState.objects.get().pruned_before == tzdatetime(2018, 1, 1)
+
+
+def test_prune_call_partitions_invalid_period():
+    with pytest.raises(CommandError):
+        call_command('prune_call_partitions', before='2018-01')
+
+
+def create_billing_calls(subscribers):
+    records = []
+    for call_id, subscriber in enumerate(subscribers):
+        records.extend([
+            CallRecord(type=CallRecord.START, call_id=call_id, timestamp=tzdatetime(2018, 1, 1 + call_id, 10),
+                       source=subscriber, destination='2199997777'),
+            CallRecord(type=CallRecord.END, call_id=call_id, timestamp=tzdatetime(2018, 1, 1 + call_id, 11)),
+        ])
+    # NOTE: a call of another period, whose subscriber must not be billed
+    records.extend([
+        CallRecord(type=CallRecord.START, call_id=100, timestamp=tzdatetime(2018, 2, 1, 10),
+                   source='2100000000', destination='2199997777'),
+        CallRecord(type=CallRecord.END, call_id=100, timestamp=tzdatetime(2018, 2, 1, 11)),
+    ])
+    create_call_records(records)
+
+
+def run_billing(**options):
+    stdout = StringIO()
+    call_command('run_billing', period='201801', stdout=stdout, **options)
+    return stdout.getvalue()
+
+
+@freeze_time('2018-03-01')
+@pytest.mark.django_db
+def test_run_billing():
+    subscribers = ['2199998888', '2133334444', '2133334444', '1198761234']
+    create_billing_calls(subscribers)
+
+    output = run_billing(workers=1, shard_size=2)
+
+    assert output.startswith('3 subscribers billed (4 calls, 2 shards) in ')
+    assert output.endswith(': 0 already billed\n')
+    bills = Bill.objects.filter(reference_period='201801').order_by('subscriber')
+    assert [bill.subscriber for bill in bills] == sorted(set(subscribers))
+    assert [json.loads(bill.body) for bill in bills] == [
+        telephone_bill(subscriber, reference_period='201801') for subscriber in sorted(set(subscribers))
+    ]
+    assert [bill.calls for bill in bills] == [1, 2, 1]
+
+
+@freeze_time('2018-03-01')
+@pytest.mark.django_db
+def test_run_billing_resumes():
+    create_billing_calls(['2199998888', '2133334444', '1198761234'])
+    Bill.objects.create(subscriber='2133334444', reference_period='201801', body='{}', calls=0)
+
+    output = run_billing(workers=1)
+
+    assert output.startswith('2 subscribers billed (2 calls, 1 shards) in ')
+    assert output.endswith(': 1 already billed\n')
+    assert Bill.objects.get(subscriber='2133334444').body == '{}'
+
+    run_billing(workers=1, restart=True)
+    assert json.loads(Bill.objects.get(subscriber='2133334444').body)['call_records']
+
+
+@freeze_time('2018-03-01')
+@pytest.mark.django_db
+def test_run_billing_files(tmp_path):
+    create_billing_calls(['2199998888', '2133334444', '1198761234'])
+
+    run_billing(workers=1, shard_size=2, output_dir=str(tmp_path))
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'bills-201801-1198761234.ndjson',
+        'bills-201801-2199998888.ndjson',
+    ]
+    bills = [json.loads(line) for path in sorted(tmp_path.iterdir()) for line in path.read_text().splitlines()]
+    assert bills == [telephone_bill(subscriber, reference_period='201801')
+                     for subscriber in ['1198761234', '2133334444', '2199998888']]
+    assert not Bill.objects.exists()
+
+    output = run_billing(workers=1, output_dir=str(tmp_path))
+    assert output.startswith('0 subscribers billed (0 calls, 0 shards) in ')
+
+
+# NOTE: worker processes have their own connections, so test data must
+# be committed. serialized_rollback restores the initial tariff afterwards
+@freeze_time('2018-03-01')
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_run_billing_parallel():
+    subscribers = [f'21{number:08}' for number in range(20)]
+    create_billing_calls(subscribers)
+
+    output = run_billing(workers=3, shard_size=4)
+
+    assert output.startswith('20 subscribers billed (20 calls, 5 shards) in ')
+    assert sorted(Bill.objects.values_list('subscriber', flat=True)) == subscribers
+
+
+@pytest.mark.parametrize('period', ['2018-01', '201802'])
+@freeze_time('2018-02-10')
+def test_run_billing_invalid_period(period):
+    with pytest.raises(CommandError):
+        call_command('run_billing', period=period)
+
+
+def generate_call_records(*args, **options):
+    stdout = StringIO()
+    call_command('generate_call_records', *args, stdout=stdout, **options)
+    return stdout.getvalue()
+
+
+def read_ndjson(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_generate_call_records(tmp_path):
+    path = tmp_path / 'records.ndjson'
+    output = generate_call_records('--from', '201801', '--to', '201802', calls=2000, subscribers=100, orphans=0.05,
+                                   duplicates=0.05, boundary_calls=0.2, output=str(path))
+
+    records = read_ndjson(path)
+    assert output.startswith(f'{len(records)} records generated in ')
+    assert all(validate_call_record(record) for record in records)
+
+    starts = Counter(record['call_id'] for record in records if record['type'] == CallRecord.START)
+    ends = Counter(record['call_id'] for record in records if record['type'] == CallRecord.END)
+    calls = starts.keys() | ends.keys()
+    assert calls == set(range(1, 2001))
+    orphans = len(calls) * 2 - len(starts) - len(ends)
+    duplicates = sum(starts.values()) + sum(ends.values()) - len(starts) - len(ends)
+    assert 0 < orphans < 200 and 0 < duplicates < 200
+    assert f'{orphans} orphan halves, {duplicates} duplicates' in output
+
+    # NOTE: calls start in the given months, and some cross boundaries
+    start_timestamps = {record['call_id']: record['timestamp'] for record in records if record['type'] == 'start'}
+    end_timestamps = {record['call_id']: record['timestamp'] for record in records if record['type'] == 'end'}
+    assert min(start_timestamps.values()) >= '2018-01-01' and max(start_timestamps.values()) < '2018-03-01'
+    assert any(timestamp[:7] != end_timestamps[call_id][:7]
+               for call_id, timestamp in start_timestamps.items() if call_id in end_timestamps)
+    assert any(timestamp[11:13] < '22' <= end_timestamps[call_id][11:13]
+               for call_id, timestamp in start_timestamps.items() if call_id in end_timestamps)
+
+    # NOTE: the first subscribers make most calls
+    sources = Counter(record['source'] for record in records if record['type'] == CallRecord.START)
+    assert sources.most_common(1)[0][1] > 5 * len(starts) / 100
+
+
+def test_generate_call_records_is_reproducible(tmp_path):
+    def generate(seed, shuffle_window):
+        path = tmp_path / f'records-{seed}-{shuffle_window}.ndjson'
+        generate_call_records('--from', '201801', calls=500, subscribers=50, seed=seed,
+                              shuffle_window=shuffle_window, output=str(path))
+        return read_ndjson(path)
+
+    records = generate(1, 0)
+    assert records == generate(1, 0)
+    assert records != generate(2, 0)
+    assert [record['timestamp'] for record in records] == sorted(record['timestamp'] for record in records)
+
+    shuffled_records = generate(1, 100)
+    assert shuffled_records != records
+    assert sorted(map(json.dumps, shuffled_records)) == sorted(map(json.dumps, records))
+
+
+@pytest.mark.django_db
+def test_generate_call_records_database():
+    output = generate_call_records('--from', '201801', '--database', calls=300, subscribers=20, orphans=0.1,
+                                   duplicates=0.1, batch_size=100)
+
+    assert CallRecord.objects.count() == int(output.split(', ')[-1].split()[0])
+    assert Call.objects.count() == CallRecord.objects.filter(type=CallRecord.START).filter(
+        call_id__in=CallRecord.objects.filter(type=CallRecord.END).values('call_id')
+    ).count() > 250
+
+
+@pytest.mark.parametrize('periods', [['--from', '2018-01'], ['--from', '201802', '--to', '201801']])
+def test_generate_call_records_invalid_periods(periods):
+    with pytest.raises(CommandError):
+        generate_call_records(*periods)
@@ -0,0 +1,208 @@
+import json
+import os
+import pytest
+import subprocess
+
+from django.urls import reverse
+
+from sparrow.core.metrics import EXITED_SNAPSHOT, REGISTRY, Counter, Histogram, Registry, render
+from .utils import asgi_request
+
+
+def sample(name, *labels):
+    """
+    Returns the current value of a metric of REGISTRY
+    """
+    samples = {tuple(values): value for values, value in REGISTRY.snapshot()[name]['samples']}
+    return samples.get(labels, 0 if REGISTRY.metrics[name].TYPE == 'counter' else {'counts': [], 'sum': 0})
+
+
+def histogram_count(name, *labels):
+    return sum(sample(name, *labels)['counts'])
+
+
+@pytest.fixture
+def metrics_token(settings):
+    settings.METRICS_TOKEN = 'secret'
+
+
+def test_render():
+    registry = Registry()
+    requests = Counter('requests_total', 'Requests', ['view'], registry=registry)
+    duration = Histogram('duration_seconds', 'Duration', buckets=[0.5, 0.1], registry=registry)
+    requests.labels('index').inc()
+    requests.labels('index').inc(2)
+    requests.labels('say "hi"\n').inc()
+    duration.observe(0.05)
+    duration.observe(0.1)
+    duration.observe(3)
+
+    assert render(registry.snapshot()) == '\n'.join([
+        '# HELP duration_seconds Duration',
+        '# TYPE duration_seconds histogram',
+        'duration_seconds_bucket{le="0.1"} 2',
+        'duration_seconds_bucket{le="0.5"} 2',
+        'duration_seconds_bucket{le="+Inf"} 3',
+        'duration_seconds_sum 3.15',
+        'duration_seconds_count 3',
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{view="index"} 3',
+        'requests_total{view="say \\"hi\\"\\n"} 1',
+    ]) + '\n'
+
+
+def test_labels():
+    registry = Registry()
+    requests = Counter('requests_total', 'Requests', ['method', 'view'], registry=registry)
+    assert requests.labels('GET', 'index') is requests.labels('GET', 'index')
+
+    with pytest.raises(ValueError):
+        requests.labels('GET')
+
+    with pytest.raises(ValueError):
+        Counter('requests_total', 'Requests again', registry=registry)
+
+
+def test_collect_metrics_dir(settings, tmp_path):
+    settings.METRICS_DIR = str(tmp_path)
+    registry = Registry()
+    requests = Counter('requests_total', 'Requests', ['view'], registry=registry)
+    duration = Histogram('duration_seconds', 'Duration', buckets=[1], registry=registry)
+    requests.labels('index').inc(2)
+    duration.observe(0.5)
+
+    # NOTE: as written by another process
+    (tmp_path / '1.json').write_text(json.dumps({
+        'requests_total': {'type': 'counter', 'documentation': 'Requests', 'labelnames': ['view'],
+                           'samples': [[['index'], 3], [['bill'], 1]]},
+        'duration_seconds': {'type': 'histogram', 'documentation': 'Duration', 'labelnames': [], 'buckets': [1],
+                             'samples': [[[], {'counts': [0, 1], 'sum': 2}]]},
+    }))
+    (tmp_path / '2.json.tmp').write_text('{"incomplete')
+
+    snapshot = registry.collect()
+    assert sorted(snapshot['requests_total']['samples']) == [[['bill'], 1], [['index'], 5]]
+    assert snapshot['duration_seconds']['samples'] == [[[], {'counts': [1, 1], 'sum': 2.5}]]
+
+
+def test_maybe_flush(settings, tmp_path):
+    settings.METRICS_DIR = str(tmp_path)
+    settings.METRICS_FLUSH_INTERVAL = 60
+    registry = Registry()
+    requests = Counter('requests_total', 'Requests', registry=registry)
+
+    requests.inc()
+    registry.maybe_flush()
+    requests.inc()
+    registry.maybe_flush()
+
+    snapshots = [json.loads(path.read_text()) for path in tmp_path.iterdir()]
+    assert [snapshot['requests_total']['samples'] for snapshot in snapshots] == [[[[], 1]]]
+
+
+def test_collect_reaps_exited_processes(settings, tmp_path):
+    settings.METRICS_DIR = str(tmp_path)
+    registry = Registry()
+    requests = Counter('requests_total', 'Requests', registry=registry)
+    requests.inc()
+
+    # NOTE: as written by a process killed before it could retire
+    process = subprocess.Popen(['true'])
+    process.wait()
+    (tmp_path / f'{process.pid}.json').write_text(json.dumps({
+        'requests_total': {'type': 'counter', 'documentation': 'Requests', 'labelnames': [], 'samples': [[[], 3]]},
+    }))
+
+    for _ in range(2):
+        assert registry.collect()['requests_total']['samples'] == [[[], 4]]
+        assert {path.name for path in tmp_path.glob('*.json')} == {EXITED_SNAPSHOT, f'{os.getpid()}.json'}
+
+    # NOTE: metrics of this process are kept once it exits too
+    requests.inc()
+    registry.retire()
+    assert [path.name for path in tmp_path.glob('*.json')] == [EXITED_SNAPSHOT]
+    assert Registry().collect()['requests_total']['samples'] == [[[], 5]]
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint(client, metrics_token):
+    created = sample('call_records_ingested_total', 'created')
+    duplicates = sample('call_records_ingested_total', 'duplicate')
+    invalid = sample('call_records_ingested_total', 'invalid')
+    posts = sample('http_requests_total', 'POST', 'call_records:index', '201')
+    bills = histogram_count('telephone_bill_calls')
+    priced = sample('calls_priced_total')
+
+    record = {'type': 'end', 'call_id': 1, 'timestamp': '2018-01-01T10:00:00Z'}
+    client.post(reverse('call_records:index'), record, content_type='application/json')
+    client.post(reverse('call_records:index'), record, content_type='application/json')
+    client.post(reverse('call_records:index'), dict(record, call_id='x'), content_type='application/json')
+    client.post(reverse('call_records:index'), {'type': 'start', 'call_id': 1, 'timestamp': '2018-01-01T09:00:00Z',
+                                                'source': '2199998888', 'destination': '2199997777'},
+                content_type='application/json')
+    client.get(reverse('call_records:telephone_bill'), {'subscriber': '2199998888', 'reference_period': '201801'})
+
+    response = client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    assert 'http_requests_total{method="POST",view="call_records:index",status="201"}' in response.content.decode()
+
+    assert sample('call_records_ingested_total', 'created') == created + 2
+    assert sample('call_records_ingested_total', 'duplicate') == duplicates + 1
+    assert sample('call_records_ingested_total', 'invalid') == invalid + 1
+    assert sample('http_requests_total', 'POST', 'call_records:index', '201') == posts + 2
+    assert histogram_count('telephone_bill_calls') == bills + 1
+    assert sample('calls_priced_total') == priced + 1
+
+
+@pytest.mark.django_db
+def test_request_queries(client):
+    queries = histogram_count('http_request_db_queries', 'call_records:telephone_bill')
+    total = sample('http_request_db_queries', 'call_records:telephone_bill')['sum']
+
+    client.get(reverse('call_records:telephone_bill'), {'subscriber': '2199998888', 'reference_period': '201801'})
+
+    assert histogram_count('http_request_db_queries', 'call_records:telephone_bill') == queries + 1
+    assert sample('http_request_db_queries', 'call_records:telephone_bill')['sum'] > total
+
+
+def test_unresolved_requests(client):
+    requests = sample('http_requests_total', 'GET', 'unresolved', '404')
+    client.get('/nowhere/')
+    assert sample('http_requests_total', 'GET', 'unresolved', '404') == requests + 1
+
+
+def test_metrics_method_not_allowed(client, metrics_token):
+    assert client.post(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code == 405
+
+
+@pytest.mark.parametrize('authorization', ['', 'Bearer wrong', 'secret'])
+def test_metrics_unauthorized(client, metrics_token, authorization):
+    response = client.get(reverse('metrics'), HTTP_AUTHORIZATION=authorization)
+    assert response.status_code == 401
+    assert response['WWW-Authenticate'] == 'Bearer'
+
+
+def test_metrics_disabled(client, settings):
+    settings.METRICS_TOKEN = ''
+    assert client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ').status_code == 404
+
+
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_asgi_metrics():
+    created = sample('call_records_ingested_total', 'created')
+    invalid = sample('call_records_ingested_total', 'invalid')
+    posts = sample('http_requests_total', 'POST', 'call_records:index', '201')
+    bills = histogram_count('telephone_bill_calls')
+
+    record = {'type': 'end', 'call_id': 1, 'timestamp': '2018-01-01T10:00:00Z'}
+    asgi_request('POST', '/call_records/', body=json.dumps(record).encode())
+    asgi_request('POST', '/call_records/', body=b'[]')
+    asgi_request('POST', '/call_records/', body=json.dumps(record).encode(), host=b'evil.com')
+    asgi_request('GET', '/call_records/telephone_bill/', query_string=b'subscriber=2199998888&reference_period=201801')
+
+    assert sample('call_records_ingested_total', 'created') == created + 1
+    assert sample('call_records_ingested_total', 'invalid') == invalid + 1
+    assert sample('http_requests_total', 'POST', 'call_records:index', '201') == posts + 1
+    assert histogram_count('telephone_bill_calls') == bills + 1
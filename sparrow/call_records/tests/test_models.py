@@ -1,11 +1,12 @@
 import pytest
 
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.db.utils import IntegrityError
 from django.utils import timezone
 from model_mommy import mommy
 
-from sparrow.call_records.models import CallRecord
+from sparrow.call_records.models import CallRecord, decode_phone_number, encode_phone_number
 
 
 @pytest.mark.django_db
@@ -51,3 +52,28 @@ def test_call_record_phone_number_invalid_inputs(field, value):
 
     with pytest.raises(ValidationError):
         record.clean_fields()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('source, destination', [
+    ('0912345678', '00123456789'),
+    ('2199998888', '2199997777'),
+    ('', ''),
+])
+def test_call_record_compact_storage(source, destination):
+    record = CallRecord.objects.create(type=CallRecord.START, call_id=42, timestamp=timezone.now(),
+                                       source=source, destination=destination)
+    record.refresh_from_db()
+    assert (record.type, record.source, record.destination) == (CallRecord.START, source, destination)
+    assert CallRecord.objects.filter(source=source, type=CallRecord.START).exists()
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT is_start, source, destination FROM call_records_callrecord WHERE id = %s', [record.id])
+        assert cursor.fetchone() == (True, encode_phone_number(source), encode_phone_number(destination))
+
+
+def test_phone_number_encoding():
+    assert encode_phone_number('0012345678') == 10012345678
+    assert decode_phone_number(10012345678) == '0012345678'
+    assert encode_phone_number('') is None
+    assert decode_phone_number(None) == ''
@@ -0,0 +1,159 @@
+import datetime
+import numpy as np
+import pytest
+from hypothesis import given, strategies as st
+
+from sparrow.call_records.exceptions import PricingError
+from sparrow.call_records.models import Tariff, TariffBand
+from sparrow.call_records.pricing import NO_TARIFF, CompiledTariff, price_call, price_calls
+from .utils import tzdatetime
+
+
+def brute_force_price(tariff, start_seconds_of_day, duration_seconds):
+    """
+    Reference implementation: walks the call cycle by cycle, charging
+    each one by the band in effect when it completes
+    """
+    price = tariff.standing_charge
+    for cycle in range(1, max(0, duration_seconds) // 60 + 1):
+        price += tariff.call_charge_at((start_seconds_of_day + 60 * cycle) % 86400)
+    return price
+
+
+def create_tariff(effective_from, standing_charge, bands):
+    tariff = Tariff.objects.create(effective_from=effective_from, standing_charge=standing_charge)
+    for start_time, call_charge in bands:
+        TariffBand.objects.create(tariff=tariff, start_time=start_time, call_charge=call_charge)
+    return tariff
+
+
+@pytest.mark.parametrize('start_timestamp, end_timestamp, expected_price', [
+    (tzdatetime(2018, 1, 1, 10, 0), tzdatetime(2018, 1, 1, 10, 2), 54),
+    (tzdatetime(2018, 1, 1, 10, 0), tzdatetime(2018, 1, 1, 10, 2, 59), 54),
+    # NOTE: the example in the specification
+    (tzdatetime(2018, 1, 1, 21, 57, 13), tzdatetime(2018, 1, 1, 22, 10, 56), 54),
+    (tzdatetime(2018, 1, 1, 22, 0), tzdatetime(2018, 1, 1, 22, 30), 36),
+    (tzdatetime(2018, 1, 1, 5, 30), tzdatetime(2018, 1, 1, 6, 30), 315),
+    (tzdatetime(2018, 1, 1, 5, 59, 30), tzdatetime(2018, 1, 1, 6, 0, 40), 45),
+    (tzdatetime(2018, 1, 1, 21, 59, 30), tzdatetime(2018, 1, 1, 22, 0, 40), 36),
+    # NOTE: call 75 of the sample data, 24h13m43s long
+    (tzdatetime(2017, 12, 12, 21, 57, 13), tzdatetime(2017, 12, 13, 22, 10, 56), 36 + 9 * (960 + 2)),
+    (tzdatetime(2018, 1, 1, 10, 0), tzdatetime(2018, 1, 8, 10, 0), 36 + 9 * 960 * 7),
+    # NOTE: inconsistent records, ended before they started
+    (tzdatetime(2018, 1, 1, 10, 0), tzdatetime(2018, 1, 1, 9, 0), 36),
+])
+@pytest.mark.django_db
+def test_price_call_initial_tariff(start_timestamp, end_timestamp, expected_price):
+    price, tariff_id = price_call(start_timestamp, end_timestamp)
+
+    assert price == expected_price
+    assert tariff_id == Tariff.objects.get().id
+
+
+@pytest.mark.django_db
+def test_price_call_uses_tariff_in_effect_when_call_started():
+    initial_tariff = Tariff.objects.get()
+    new_tariff = create_tariff(tzdatetime(2018, 2, 1), 50, [
+        (datetime.time(8, 0), 10),
+        (datetime.time(20, 0), 1),
+    ])
+
+    assert price_call(tzdatetime(2018, 1, 31, 23, 50), tzdatetime(2018, 2, 1, 0, 10)) == (36, initial_tariff.id)
+    assert price_call(tzdatetime(2018, 2, 1, 10, 0), tzdatetime(2018, 2, 1, 10, 2)) == (70, new_tariff.id)
+    assert price_call(tzdatetime(2018, 2, 1, 21, 0), tzdatetime(2018, 2, 1, 21, 2)) == (52, new_tariff.id)
+    # NOTE: before the first band of the day, the last one applies
+    assert price_call(tzdatetime(2018, 2, 2, 3, 0), tzdatetime(2018, 2, 2, 3, 2)) == (52, new_tariff.id)
+
+
+@pytest.mark.django_db
+def test_price_call_picks_up_changed_bands():
+    band = TariffBand.objects.get(start_time=datetime.time(6, 0))
+    assert price_call(tzdatetime(2018, 1, 1, 10, 0), tzdatetime(2018, 1, 1, 10, 2))[0] == 54
+
+    band.call_charge = 10
+    band.save()
+
+    assert price_call(tzdatetime(2018, 1, 1, 10, 0), tzdatetime(2018, 1, 1, 10, 2))[0] == 56
+
+
+@pytest.mark.django_db
+def test_price_calls_matches_price_call():
+    create_tariff(tzdatetime(2018, 2, 1), 50, [
+        (datetime.time(8, 0), 10),
+        (datetime.time(20, 0), 1),
+    ])
+    calls = [
+        (tzdatetime(2018, 1, 1, 21, 57, 13), tzdatetime(2018, 1, 1, 22, 10, 56)),
+        (tzdatetime(2018, 1, 31, 23, 50), tzdatetime(2018, 2, 1, 0, 10)),
+        (tzdatetime(2018, 2, 1, 10, 0, 0, 500000), tzdatetime(2018, 2, 1, 10, 2)),
+        (tzdatetime(2018, 2, 2, 3, 0), tzdatetime(2018, 2, 5, 3, 2)),
+        (tzdatetime(2018, 2, 2, 3, 0), tzdatetime(2018, 2, 2, 2, 0)),
+    ]
+
+    priced = price_calls([start.timestamp() for start, _ in calls], [end.timestamp() for _, end in calls])
+
+    assert list(zip(priced.prices.tolist(), priced.tariff_ids.tolist())) == [price_call(*call) for call in calls]
+    assert priced.minutes.tolist() == [13, 20, 1, 3 * 1440 + 2, 0]
+
+
+@pytest.mark.django_db
+def test_price_calls_no_tariff_in_effect():
+    calls = [(tzdatetime(1969, 12, 31, 10, 0), tzdatetime(1969, 12, 31, 10, 2)),
+             (tzdatetime(2018, 1, 1, 10, 0), tzdatetime(2018, 1, 1, 10, 2))]
+    priced = price_calls([start.timestamp() for start, _ in calls], [end.timestamp() for _, end in calls])
+
+    # NOTE: a call that can't be priced doesn't fail the others
+    assert list(zip(priced.prices.tolist(), priced.tariff_ids.tolist())) == [(0, NO_TARIFF), price_call(*calls[1])]
+
+
+@pytest.mark.django_db
+def test_price_call_no_tariff_in_effect():
+    with pytest.raises(PricingError):
+        price_call(tzdatetime(1969, 12, 31, 10, 0), tzdatetime(1969, 12, 31, 10, 2))
+
+
+bands = st.lists(
+    st.tuples(st.times().map(lambda value: value.replace(microsecond=0)), st.integers(min_value=0, max_value=100)),
+    min_size=1, max_size=6, unique_by=lambda band: band[0]
+)
+
+
+@given(
+    standing_charge=st.integers(min_value=0, max_value=100),
+    bands=bands,
+    start_seconds_of_day=st.integers(min_value=0, max_value=86399),
+    duration_seconds=st.integers(min_value=-60, max_value=3 * 86400),
+)
+def test_compiled_tariff_price_matches_brute_force(standing_charge, bands, start_seconds_of_day, duration_seconds):
+    tariff = CompiledTariff(1, standing_charge, bands)
+
+    assert (tariff.price(start_seconds_of_day, duration_seconds)
+            == brute_force_price(tariff, start_seconds_of_day, duration_seconds))
+
+
+@given(
+    bands=bands,
+    start_seconds_of_day=st.integers(min_value=0, max_value=86399),
+    duration_seconds=st.integers(min_value=0, max_value=86400),
+    days=st.integers(min_value=1, max_value=10000),
+)
+def test_compiled_tariff_price_full_days_cost_the_same(bands, start_seconds_of_day, duration_seconds, days):
+    tariff = CompiledTariff(1, 0, bands)
+    full_day_price = tariff.price(start_seconds_of_day, 86400)
+
+    assert (tariff.price(start_seconds_of_day, days * 86400 + duration_seconds)
+            == days * full_day_price + tariff.price(start_seconds_of_day, duration_seconds))
+
+
+@given(
+    standing_charge=st.integers(min_value=0, max_value=100),
+    bands=bands,
+    calls=st.lists(st.tuples(st.integers(min_value=0, max_value=86399),
+                             st.integers(min_value=-60, max_value=3 * 86400)), min_size=1, max_size=50),
+)
+def test_compiled_tariff_price_arrays_match_brute_force(standing_charge, bands, calls):
+    tariff = CompiledTariff(1, standing_charge, bands)
+    start_seconds_of_day, duration_seconds = (np.array(values) for values in zip(*calls))
+
+    assert (tariff.price(start_seconds_of_day, duration_seconds).tolist()
+            == [brute_force_price(tariff, start, duration) for start, duration in calls])
@@ -0,0 +1,99 @@
+import json
+import pstats
+import pytest
+from freezegun import freeze_time
+from io import StringIO
+
+from django.core.management import call_command
+from django.urls import reverse
+
+from sparrow.call_records.models import CallRecord
+from sparrow.core.profiling import make_token
+from .utils import create_call_records, tzdatetime
+
+
+@pytest.fixture
+def profiling_dir(settings, tmp_path):
+    settings.PROFILING_DIR = str(tmp_path)
+    return tmp_path
+
+
+def get_bill(client, **extra):
+    return client.get(reverse('call_records:telephone_bill'),
+                      {'subscriber': '2199998888', 'reference_period': '201801', 'stream': 'true'}, **extra)
+
+
+@pytest.mark.django_db
+def test_profile_request(client, profiling_dir):
+    create_call_records([
+        CallRecord(type=CallRecord.START, call_id=1, timestamp=tzdatetime(2018, 1, 1, 10),
+                   source='2199998888', destination='2199997777'),
+        CallRecord(type=CallRecord.END, call_id=1, timestamp=tzdatetime(2018, 1, 1, 10, 5)),
+    ])
+
+    response = get_bill(client, HTTP_X_PROFILE=make_token())
+    assert response.status_code == 200
+    assert len(json.loads(response.content)['call_records']) == 1
+
+    profile_id = response['X-Profile-Id']
+    stats = pstats.Stats(str(profiling_dir / f'{profile_id}.prof'))
+    assert any(function == 'format_call_records' for _, _, function in stats.stats)
+
+    timeline = json.loads((profiling_dir / f'{profile_id}.json').read_text())
+    assert timeline['request'].startswith('GET /call_records/telephone_bill/?')
+    assert timeline['status'] == 200
+    assert any('call_records_call' in query['sql'] for query in timeline['queries'])
+    assert timeline['queries_duration_ms'] <= timeline['duration_ms']
+
+
+@pytest.mark.django_db
+def test_old_profiles_deleted(client, profiling_dir, settings):
+    settings.PROFILING_MAX_PROFILES = 2
+    (profiling_dir / '20180101T100000000000-00000000.prof').write_text('')
+    (profiling_dir / '20180101T100000000000-00000000.json').write_text('')
+
+    profile_ids = [get_bill(client, HTTP_X_PROFILE=make_token())['X-Profile-Id'] for _ in range(3)]
+
+    assert sorted(path.name for path in profiling_dir.iterdir()) == sorted(
+        f'{profile_id}.{extension}' for profile_id in profile_ids[1:] for extension in ['prof', 'json']
+    )
+
+
+@pytest.mark.django_db
+def test_no_token(client, profiling_dir):
+    response = get_bill(client)
+    assert 'X-Profile-Id' not in response
+    assert list(profiling_dir.iterdir()) == []
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('token', ['profile', 'profile:1fKjbD:invalid'])
+def test_invalid_token(client, profiling_dir, token):
+    response = get_bill(client, HTTP_X_PROFILE=token)
+    assert 'X-Profile-Id' not in response
+    assert list(profiling_dir.iterdir()) == []
+
+
+@pytest.mark.django_db
+def test_expired_token(client, profiling_dir, settings):
+    settings.PROFILING_TOKEN_MAX_AGE = 60
+    with freeze_time('2018-01-01 10:00:00'):
+        token = make_token()
+
+    with freeze_time('2018-01-01 10:02:00'):
+        response = get_bill(client, HTTP_X_PROFILE=token)
+
+    assert 'X-Profile-Id' not in response
+
+
+@pytest.mark.django_db
+def test_profiling_disabled(client, settings):
+    settings.PROFILING_DIR = ''
+    assert 'X-Profile-Id' not in get_bill(client, HTTP_X_PROFILE=make_token())
+
+
+def test_profiling_token_command(settings, tmp_path):
+    settings.PROFILING_DIR = str(tmp_path)
+    stdout = StringIO()
+    call_command('profiling_token', stdout=stdout)
+    assert stdout.getvalue().startswith('profile:')
@@ -0,0 +1,147 @@
+import datetime
+import pytest
+from freezegun import freeze_time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from sparrow.call_records.models import Call, CallRecord, OpenCallRecord, ReconciliationState
+from sparrow.call_records.reconciliation import open_call_records_report, reconcile
+from .utils import tzdatetime
+
+
+def start_record(call_id, timestamp, source='2199998888'):
+    return CallRecord(type=CallRecord.START, call_id=call_id, timestamp=timestamp, source=source,
+                      destination='2199997777')
+
+
+def end_record(call_id, timestamp):
+    return CallRecord(type=CallRecord.END, call_id=call_id, timestamp=timestamp)
+
+
+def open_records():
+    return sorted(OpenCallRecord.objects.values_list('type', 'call_id'))
+
+
+@pytest.mark.django_db
+def test_reconcile():
+    CallRecord.objects.bulk_create([
+        start_record(1, tzdatetime(2018, 1, 1, 10)),
+        end_record(1, tzdatetime(2018, 1, 1, 10, 5)),
+        start_record(2, tzdatetime(2018, 1, 1, 11)),
+        end_record(3, tzdatetime(2018, 1, 1, 12)),
+    ])
+
+    stats = reconcile(batch_size=3)
+    assert {key: stats[key] for key in ['reconciled', 'opened', 'closed']} == {
+        'reconciled': 4, 'opened': 2, 'closed': 0,
+    }
+    assert stats['high_water_mark'] == ReconciliationState.objects.get().high_water_mark == \
+        CallRecord.objects.latest('id').id
+    assert open_records() == [('end', 3), ('start', 2)]
+
+    # NOTE: records not reconciled yet, added without pairing them
+    records = CallRecord.objects.bulk_create([
+        end_record(2, tzdatetime(2018, 1, 1, 11, 30)),
+        start_record(4, tzdatetime(2018, 1, 1, 13)),
+    ])
+    stats = reconcile(batch_size=3)
+    assert {key: stats[key] for key in ['reconciled', 'opened', 'closed']} == {
+        'reconciled': 2, 'opened': 1, 'closed': 1,
+    }
+    assert stats['high_water_mark'] == records[-1].id
+    assert open_records() == [('end', 3), ('start', 4)]
+
+    # NOTE: pairs the call whose end record arrived, and the one whose
+    # records were both in the first batch
+    assert sorted(Call.objects.values_list('call_id', flat=True)) == [1, 2]
+
+    assert reconcile(batch_size=3)['reconciled'] == 0
+
+
+@pytest.mark.django_db
+def test_reconcile_pairs_within_a_batch():
+    # NOTE: as if both records were ingested concurrently, so neither
+    # transaction saw the other one and pairing them on commit failed
+    CallRecord.objects.bulk_create([
+        start_record(1, tzdatetime(2018, 1, 1, 10)),
+        end_record(1, tzdatetime(2018, 1, 1, 10, 5)),
+        start_record(2, tzdatetime(2018, 1, 1, 11)),
+    ])
+
+    stats = reconcile(batch_size=10)
+    assert (stats['opened'], stats['closed']) == (1, 0)
+    call = Call.objects.get()
+    assert (call.call_id, call.source, call.price) == (1, '2199998888', 81)
+    assert open_records() == [('start', 2)]
+
+
+@pytest.mark.django_db
+def test_reconcile_lookback():
+    records = CallRecord.objects.bulk_create([start_record(call_id, tzdatetime(2018, 1, 1, 10))
+                                              for call_id in range(1, 4)])
+    missing_id = records[1].id
+    records[1].delete()
+    reconcile(batch_size=10)
+
+    # NOTE: as if committed after the reconciliation, with a smaller id
+    CallRecord.objects.bulk_create([CallRecord(id=missing_id, type=CallRecord.END, call_id=1,
+                                               timestamp=tzdatetime(2018, 1, 1, 10, 5))])
+    assert reconcile(batch_size=10)['reconciled'] == 0
+
+    # NOTE: reading the start record of call 3 again is harmless
+    stats = reconcile(batch_size=10, lookback=2)
+    assert (stats['reconciled'], stats['closed'], stats['high_water_mark']) == (2, 1, records[2].id)
+    assert open_records() == [('start', 3)]
+
+
+@pytest.mark.django_db
+@freeze_time('2018-01-10 12:00:00')
+def test_open_call_records_report():
+    CallRecord.objects.bulk_create([
+        start_record(1, tzdatetime(2018, 1, 10, 11), source='2199990001'),
+        start_record(2, tzdatetime(2018, 1, 10, 2), source='2199990002'),
+        start_record(3, tzdatetime(2018, 1, 9, 2), source='2199990003'),
+        start_record(4, tzdatetime(2018, 1, 1, 2), source='2199990004'),
+        end_record(5, tzdatetime(2018, 1, 2, 2)),
+    ])
+    reconcile(batch_size=10)
+
+    report = open_call_records_report(long_call_age=datetime.timedelta(hours=6),
+                                      orphan_age=datetime.timedelta(days=7), limit=1)
+    assert report['open_starts'] == 4
+    assert report['open_ends'] == 1
+    assert report['long_calls'] == {'count': 2, 'oldest': [
+        {'type': 'start', 'call_id': 3, 'timestamp': tzdatetime(2018, 1, 9, 2), 'source': '2199990003'},
+    ]}
+    assert report['orphans'] == {'count': 2, 'oldest': [
+        {'type': 'start', 'call_id': 4, 'timestamp': tzdatetime(2018, 1, 1, 2), 'source': '2199990004'},
+    ]}
+
+
+@pytest.mark.django_db
+@freeze_time('2018-01-10 12:00:00')
+def test_reconcile_call_records_command():
+    CallRecord.objects.bulk_create([
+        start_record(1, tzdatetime(2018, 1, 10, 2)),
+        end_record(2, tzdatetime(2018, 1, 1, 2)),
+    ])
+
+    stdout = StringIO()
+    call_command('reconcile_call_records', '--long-call', '6h', '--orphan-age', '7d', stdout=stdout)
+    lines = stdout.getvalue().splitlines()
+    assert lines[0].startswith('2 records reconciled in')
+    assert lines[0].endswith(': 2 opened, 0 closed')
+    assert lines[1:] == [
+        '1 start and 1 end records waiting for their pair',
+        '1 long calls',
+        '    start record of call 1 at 2018-01-10T02:00:00Z 2199998888',
+        '1 orphans',
+        '    end record of call 2 at 2018-01-01T02:00:00Z',
+    ]
+
+
+def test_reconcile_call_records_command_ages():
+    with pytest.raises(CommandError):
+        call_command('reconcile_call_records', '--long-call', '8d', '--orphan-age', '7d')
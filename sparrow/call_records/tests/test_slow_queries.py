@@ -0,0 +1,76 @@
+import json
+import pytest
+
+from django.db import connection
+from django.urls import reverse
+
+from sparrow.call_records.models import CallRecord
+from sparrow.core import slow_queries
+from .utils import tzdatetime
+
+
+@pytest.fixture
+def slow_queries_settings(settings):
+    # NOTE: every query is slow
+    settings.SLOW_QUERY_THRESHOLD = 1e-9
+    settings.SLOW_QUERY_SAMPLE_RATE = 1
+    return settings
+
+
+def logged_queries(caplog):
+    return [json.loads(record.getMessage()) for record in caplog.records
+            if record.name == 'sparrow.core.slow_queries' and record.levelname == 'WARNING']
+
+
+@pytest.mark.django_db
+def test_slow_bill_query(client, caplog, slow_queries_settings):
+    client.get(reverse('call_records:telephone_bill'), {'subscriber': '2199998888', 'reference_period': '201801'})
+
+    bill_query, = [query for query in logged_queries(caplog) if 'call_records_call' in query['sql']]
+    assert bill_query['origin'] == 'GET /call_records/telephone_bill/'
+    assert bill_query['duration_ms'] > 0
+    assert bill_query['params']['subscriber'] == '2199998888'
+    plan, = bill_query['plan']
+    assert 'Shared Hit Blocks' in plan['Plan']
+    assert plan['Execution Time'] >= 0
+
+
+@pytest.mark.django_db
+def test_slow_write_query_not_explained(client, caplog, slow_queries_settings):
+    client.post(reverse('call_records:index'), {'type': 'end', 'call_id': 1, 'timestamp': '2018-01-01T10:00:00Z'},
+                content_type='application/json')
+
+    insert_query, = [query for query in logged_queries(caplog) if query['sql'].lstrip().startswith('INSERT')]
+    assert insert_query['plan'] is None
+    assert CallRecord.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_failed_explain(caplog, slow_queries_settings, monkeypatch):
+    monkeypatch.setattr(slow_queries, 'EXPLAIN_QUERY', 'EXPLAIN (NONSENSE) ')
+    with connection.execute_wrapper(slow_queries.SlowQueryLogger('test')):
+        assert CallRecord.objects.count() == 0
+
+    query, = logged_queries(caplog)
+    assert query['plan'] is None
+
+    # NOTE: the transaction of the test is still usable
+    CallRecord.objects.create(type=CallRecord.END, call_id=1, timestamp=tzdatetime(2018, 1, 1))
+
+
+@pytest.mark.django_db
+def test_sampling(client, caplog, slow_queries_settings):
+    slow_queries_settings.SLOW_QUERY_SAMPLE_RATE = 0
+    client.get(reverse('call_records:telephone_bill'), {'subscriber': '2199998888', 'reference_period': '201801'})
+
+    # NOTE: only capturing plans is sampled, every slow query is logged
+    bill_query, = [query for query in logged_queries(caplog) if 'call_records_call' in query['sql']]
+    assert bill_query['duration_ms'] > 0
+    assert bill_query['plan'] is None
+
+
+@pytest.mark.django_db
+def test_disabled(client, caplog, settings):
+    settings.SLOW_QUERY_THRESHOLD = 0
+    client.get(reverse('call_records:telephone_bill'), {'subscriber': '2199998888', 'reference_period': '201801'})
+    assert logged_queries(caplog) == []
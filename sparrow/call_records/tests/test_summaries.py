@@ -0,0 +1,121 @@
+import json
+import pytest
+from datetime import timedelta
+from freezegun import freeze_time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+
+from sparrow.call_records.ingestion import pair_call_records
+from sparrow.call_records.models import BillSummary, Call
+from sparrow.call_records.summaries import rebuild_bill_summaries, telephone_bill_summary
+from .utils import asgi_request, create_calls, tzdatetime
+
+
+def summaries():
+    return sorted(BillSummary.objects.values_list('subscriber', 'reference_period', 'calls', 'duration', 'price'))
+
+
+@pytest.mark.django_db
+def test_summaries_follow_calls():
+    create_calls([
+        (1, '2199998888', tzdatetime(2018, 1, 1, 10), tzdatetime(2018, 1, 1, 10, 2)),
+        (2, '2199998888', tzdatetime(2018, 1, 31, 23, 50), tzdatetime(2018, 2, 1, 0, 10)),
+        (3, '2199990000', tzdatetime(2018, 1, 5, 10), tzdatetime(2018, 1, 5, 10, 0, 30)),
+    ])
+    create_calls([(4, '2199998888', tzdatetime(2018, 1, 2, 10), tzdatetime(2018, 1, 2, 10, 27))])
+
+    assert summaries() == [
+        ('2199990000', '201801', 1, timedelta(seconds=30), 36),
+        ('2199998888', '201801', 2, timedelta(minutes=29), 54 + 279),
+        # NOTE: at night, only the standing charge
+        ('2199998888', '201802', 1, timedelta(minutes=20), 36),
+    ]
+
+    # NOTE: pairing calls again doesn't count them twice
+    expected = summaries()
+    pair_call_records([1, 2, 3, 4])
+    assert summaries() == expected
+
+    rebuild_bill_summaries()
+    assert summaries() == expected
+
+
+@pytest.mark.django_db
+@freeze_time('2018-03-10')
+def test_telephone_bill_summary():
+    create_calls([
+        (1, '2199998888', tzdatetime(2018, 2, 1, 10), tzdatetime(2018, 2, 1, 10, 2)),
+        (2, '2199998888', tzdatetime(2018, 2, 2, 10), tzdatetime(2018, 2, 2, 10, 27)),
+    ])
+
+    assert telephone_bill_summary('2199998888') == {
+        'subscriber': '2199998888', 'reference_period': '201802', 'calls': 2, 'duration': '29m', 'price': 'R$ 3,33',
+    }
+    assert telephone_bill_summary('2199998888', reference_period='201801') == {
+        'subscriber': '2199998888', 'reference_period': '201801', 'calls': 0, 'duration': '', 'price': 'R$ 0,00',
+    }
+
+
+@pytest.mark.django_db
+@freeze_time('2018-03-10')
+def test_get_telephone_bill_summary(client):
+    create_calls([(1, '2199998888', tzdatetime(2018, 2, 1, 10), tzdatetime(2018, 2, 1, 10, 2))])
+
+    response = client.get(reverse('call_records:telephone_bill_summary'),
+                          {'subscriber': '2199998888', 'reference_period': '201802'})
+    assert response.status_code == 200
+    assert response.json() == {
+        'subscriber': '2199998888', 'reference_period': '201802', 'calls': 1, 'duration': '2m', 'price': 'R$ 0,54',
+    }
+
+
+@pytest.mark.django_db
+@freeze_time('2018-03-10')
+@pytest.mark.parametrize('params, errors', [
+    ({'subscriber': '123'}, {'subscriber'}),
+    ({'subscriber': '2199998888', 'reference_period': '2018-02'}, {'reference_period'}),
+    ({'subscriber': '2199998888', 'reference_period': '201803'}, {'detail'}),
+])
+def test_get_telephone_bill_summary_invalid(client, params, errors):
+    response = client.get(reverse('call_records:telephone_bill_summary'), params)
+    assert response.status_code == 400
+    assert set(response.json()) == errors
+
+
+@pytest.mark.django_db
+def test_rebuild_bill_summaries():
+    create_calls([
+        (1, '2199998888', tzdatetime(2018, 1, 1, 10), tzdatetime(2018, 1, 1, 10, 2)),
+        (2, '2199998888', tzdatetime(2018, 2, 1, 10), tzdatetime(2018, 2, 1, 10, 2)),
+    ])
+    expected = summaries()
+    BillSummary.objects.update(calls=10)
+    BillSummary.objects.create(subscriber='2199990000', reference_period='201801', calls=1,
+                               duration=timedelta(minutes=1), price=45)
+
+    assert rebuild_bill_summaries('201801') == 1
+    assert summaries() == [expected[0], ('2199998888', '201802', 10, timedelta(minutes=2), 54)]
+
+    stdout = StringIO()
+    call_command('rebuild_bill_summaries', stdout=stdout)
+    assert stdout.getvalue().startswith('2 bill summaries rebuilt in')
+    assert summaries() == expected
+
+
+def test_rebuild_bill_summaries_invalid_period():
+    with pytest.raises(CommandError):
+        call_command('rebuild_bill_summaries', period='2018-01')
+
+
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_asgi_summaries():
+    for record in [{'type': 'start', 'call_id': 1, 'timestamp': '2018-01-01T10:00:00Z', 'source': '2199998888',
+                    'destination': '2199997777'},
+                   {'type': 'end', 'call_id': 1, 'timestamp': '2018-01-01T10:02:00Z'}]:
+        asgi_request('POST', '/call_records/', body=json.dumps(record).encode())
+
+    assert Call.objects.count() == 1
+    assert summaries() == [('2199998888', '201801', 1, timedelta(minutes=2), 54)]
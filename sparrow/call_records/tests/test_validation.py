@@ -0,0 +1,161 @@
+import datetime
+import json
+import pytest
+from hypothesis import given, strategies as st
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+
+from sparrow.call_records.exceptions import InvalidCallRecordError
+from sparrow.call_records.models import CallRecord
+from sparrow.call_records.serializers import CallRecordStartSerializer, CallRecordEndSerializer
+from sparrow.call_records.validation import parse_call_record, render_call_record, validate_call_record
+from sparrow.call_records.views import INVALID_TYPE_ERRORS
+
+
+SERIALIZER_CLASSES = {
+    CallRecord.START: CallRecordStartSerializer,
+    CallRecord.END: CallRecordEndSerializer,
+}
+
+
+def validate_with_serializer(data):
+    """
+    Reference implementation: validates like the API does with DRF
+    """
+    record_type = data.get('type') if isinstance(data, dict) else None
+    if not CallRecord.is_record_type(record_type):
+        return None, INVALID_TYPE_ERRORS
+
+    serializer = SERIALIZER_CLASSES[record_type](data=data)
+    if not serializer.is_valid():
+        return None, json.loads(json.dumps(serializer.errors))
+
+    return dict({'source': '', 'destination': ''}, type=record_type, **serializer.validated_data), None
+
+
+def validate_without_serializer(data):
+    try:
+        return validate_call_record(data), None
+    except InvalidCallRecordError as e:
+        return None, e.errors
+
+
+def assert_same_validation(data):
+    record, errors = validate_without_serializer(data)
+    expected_record, expected_errors = validate_with_serializer(data)
+
+    assert errors == expected_errors
+    assert list(errors or []) == list(expected_errors or [])
+    assert record == expected_record
+    if record is not None:
+        assert record['timestamp'].utcoffset() == expected_record['timestamp'].utcoffset()
+
+
+json_values = st.one_of(
+    st.none(), st.booleans(), st.integers(), st.floats(allow_nan=False, allow_infinity=False), st.text(),
+    st.lists(st.integers(), max_size=2), st.dictionaries(st.text(max_size=2), st.integers(), max_size=2),
+)
+padding = st.sampled_from(['', ' ', '\n'])
+call_ids = st.one_of(json_values, st.builds('{}{}{}{}'.format, padding, st.integers(-10, 2 ** 32),
+                                            st.sampled_from(['', '.', '.00', '.5']), padding))
+timestamps = st.one_of(
+    json_values,
+    st.datetimes().map(datetime.datetime.isoformat),
+    st.builds(lambda timestamp, offset: timestamp.isoformat() + offset, st.datetimes(),
+              st.sampled_from(['Z', '+00:00', '-03:00', '+14:00'])),
+)
+phone_numbers = st.one_of(json_values, st.integers(0, 10 ** 12),
+                          st.builds('{}{}{}'.format, padding, st.integers(10 ** 7, 10 ** 13), padding))
+
+
+@given(st.fixed_dictionaries({'type': st.sampled_from([CallRecord.START, CallRecord.END])}, optional={
+    'call_id': call_ids,
+    'timestamp': timestamps,
+    'source': phone_numbers,
+    'destination': phone_numbers,
+}))
+def test_validate_call_record_matches_serializers(data):
+    assert_same_validation(data)
+
+
+@pytest.mark.parametrize('data', [
+    [],
+    'start',
+    {},
+    {'type': 'middle'},
+    {'type': 'start', 'call_id': '12', 'timestamp': '2018-01-01T10:00:00Z', 'source': 2199998888,
+     'destination': ' 2199997777\n'},
+    {'type': 'start', 'call_id': 12, 'timestamp': '2018-01-01', 'source': '', 'destination': ' '},
+    {'type': 'start', 'call_id': '1' * 1001, 'timestamp': '0001-01-01T00:00:00+01:00', 'source': '2199998888\x00',
+     'destination': '21999\ud83d77777777'},
+    {'type': 'end', 'call_id': '12.000 ', 'timestamp': '2018-01-01T10:00:00.123456-03:00', 'source': 'a'},
+    {'type': 'start', 'call_id': 12, 'timestamp': '2018-01-01T10:00:00Z', 'source': '2199998888',
+     'destination': '\u0662\u0661\u0669\u0669\u0669\u0669\u0668\u0668\u0668\u0668'},
+    {'type': 'end', 'call_id': -1, 'timestamp': '2018-13-01T10:00:00Z'},
+    {'type': 'end', 'call_id': 2147483648, 'timestamp': 1514800800},
+    {'type': 'end', 'call_id': True, 'timestamp': '2018-01-01T10:00'},
+    {'type': 'end', 'call_id': 1.5, 'timestamp': None},
+])
+def test_validate_call_record_edge_cases(data):
+    assert_same_validation(data)
+
+
+@given(
+    st.integers(1, 2 ** 31 - 1),
+    st.sampled_from([CallRecord.START, CallRecord.END]),
+    st.integers(0, 2 ** 31 - 1),
+    st.datetimes(min_value=datetime.datetime(1970, 1, 1), timezones=st.just(datetime.timezone.utc)),
+    st.integers(10 ** 9, 10 ** 11 - 1).map(str),
+)
+def test_render_call_record_matches_serializers(record_id, record_type, call_id, timestamp, phone_number):
+    record = {'id': record_id, 'type': record_type, 'call_id': call_id, 'timestamp': timestamp,
+              'source': phone_number, 'destination': phone_number}
+
+    serializer = CallRecordStartSerializer(CallRecord(**record))
+    assert render_call_record(record) == JSONRenderer().render(serializer.data)
+
+
+@pytest.mark.parametrize('body', [b'{"type": "end"}', '{"type": "end"}', b'[1, 2.5, "a"]'])
+def test_parse_call_record(body):
+    assert parse_call_record(body) == json.loads(body)
+
+
+@pytest.mark.parametrize('body', [b'', b'{"type": ', b'{"call_id": NaN}', b'{"call_id": -Infinity}', b'\xff'])
+def test_parse_call_record_invalid(body):
+    with pytest.raises(ValueError):
+        parse_call_record(body)
+
+
+def post_call_record(client, body):
+    response = client.post(reverse('call_records:index'), data=body, content_type='application/json')
+    return response.status_code, json.loads(response.content)
+
+
+@pytest.mark.parametrize('records', [
+    [{'type': 'start', 'call_id': 12, 'timestamp': '2018-01-01T10:00:00.123456-03:00', 'source': '2199998888',
+      'destination': 2199997777},
+     {'type': 'end', 'call_id': 12, 'timestamp': '2018-01-01T10:02:00', 'source': 'ignored'},
+     {'type': 'end', 'call_id': '12.0', 'timestamp': '2018-01-01T10:03:00Z'}],
+    [{'type': 'start', 'call_id': -1, 'timestamp': '2018-01-01', 'source': '2199', 'destination': ''},
+     {'type': 'end'},
+     {'type': 'middle'}],
+    ['{"type": "end", "call_id": NaN, "timestamp": "2018-01-01T10:00:00Z"}',
+     '{"type": "end", ',
+     '[]'],
+])
+@pytest.mark.django_db
+def test_post_call_record_fast_path_matches_serializers(client, settings, records):
+    def post_all():
+        CallRecord.objects.all().delete()
+        return [post_call_record(client, record if isinstance(record, str) else json.dumps(record))
+                for record in records]
+
+    fast_responses = post_all()
+    settings.CALL_RECORDS_FAST_PATH = False
+    serializer_responses = post_all()
+
+    # NOTE: records are created again, with new ids
+    for response in fast_responses + serializer_responses:
+        response[1].pop('id', None)
+
+    assert fast_responses == serializer_responses
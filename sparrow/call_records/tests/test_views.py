@@ -6,8 +6,9 @@ from operator import itemgetter
 from django.urls import reverse
 from rest_framework import status
 
-from sparrow.call_records.models import CallRecord, invalid_phone_number_message
-from .utils import tzdatetime
+from sparrow.call_records.models import Call, CallRecord, Tariff, invalid_phone_number_message
+from sparrow.call_records.reconciliation import reconcile
+from .utils import create_call_records, tzdatetime
 
 
 def record_to_json(record):
@@ -49,8 +50,108 @@ def test_get_call_records(client):
 
     response = client.get(reverse('call_records:index'))
 
-    assert (sorted(json.loads(response.content), key=itemgetter('timestamp'))
-            == sorted(records_to_json(records), key=itemgetter('timestamp')))
+    assert response.json() == {
+        'next': None,
+        'results': sorted(records_to_json(records), key=itemgetter('timestamp')),
+    }
+
+
+def get_all_pages(client, url, params):
+    records = []
+    while url:
+        response = client.get(url, params)
+        assert response.status_code == status.HTTP_200_OK
+        records.extend(response.json()['results'])
+        url, params = response.json()['next'], None
+
+    return records
+
+
+@pytest.mark.django_db
+def test_get_call_records_paginated(client):
+    # NOTE: records sharing timestamps are ordered by id
+    records = CallRecord.objects.bulk_create([
+        CallRecord(type=CallRecord.START, call_id=call_id, timestamp=tzdatetime(2018, 1, 1 + call_id // 3),
+                   source='2199998888', destination='2199997777')
+        for call_id in range(10)
+    ])
+
+    response = client.get(reverse('call_records:index'), {'page_size': 4})
+    assert [record['id'] for record in response.json()['results']] == [record.id for record in records[:4]]
+
+    # NOTE: records inserted meanwhile don't shift the next pages
+    CallRecord.objects.create(type=CallRecord.END, call_id=0, timestamp=tzdatetime(2018, 1, 1))
+    new_record = CallRecord.objects.create(type=CallRecord.END, call_id=1, timestamp=tzdatetime(2018, 1, 5))
+
+    response = client.get(response.json()['next'])
+    assert [record['id'] for record in response.json()['results']] == [record.id for record in records[4:8]]
+
+    response = client.get(response.json()['next'])
+    assert [record['id'] for record in response.json()['results']] == [record.id for record in records[8:]] + [
+        new_record.id
+    ]
+    assert response.json()['next'] is None
+
+
+@pytest.mark.django_db
+def test_get_call_records_page_size_is_bounded(client, settings):
+    settings.CALL_RECORDS_MAX_PAGE_SIZE = 2
+    CallRecord.objects.bulk_create([
+        CallRecord(type=CallRecord.END, call_id=call_id, timestamp=tzdatetime(2018, 1, 1))
+        for call_id in range(3)
+    ])
+
+    response = client.get(reverse('call_records:index'), {'page_size': 1000})
+
+    assert len(response.json()['results']) == 2
+    assert response.json()['next'] is not None
+
+
+@pytest.mark.parametrize('params, expected_call_ids', [
+    ({'source': '2199998888'}, [1, 3]),
+    ({'type': 'end'}, [1, 2]),
+    ({'call_id': 1}, [1, 1]),
+    ({'timestamp_after': '2018-01-02T00:00:00Z'}, [2, 1, 3, 2]),
+    ({'timestamp_before': '2018-01-03T00:00:00Z'}, [1, 2]),
+    ({'source': '2199998888', 'timestamp_after': '2018-01-03', 'timestamp_before': '2018-01-04'}, [3]),
+])
+@pytest.mark.django_db
+def test_get_call_records_filtered(client, params, expected_call_ids):
+    CallRecord.objects.bulk_create([
+        CallRecord(type=CallRecord.START, call_id=1, timestamp=tzdatetime(2018, 1, 1),
+                   source='2199998888', destination='2199997777'),
+        CallRecord(type=CallRecord.START, call_id=2, timestamp=tzdatetime(2018, 1, 2),
+                   source='2133334444', destination='2199997777'),
+        CallRecord(type=CallRecord.END, call_id=1, timestamp=tzdatetime(2018, 1, 3)),
+        CallRecord(type=CallRecord.START, call_id=3, timestamp=tzdatetime(2018, 1, 3, 12),
+                   source='2199998888', destination='2133334444'),
+        CallRecord(type=CallRecord.END, call_id=2, timestamp=tzdatetime(2018, 1, 4)),
+    ])
+
+    records = get_all_pages(client, reverse('call_records:index'), dict(params, page_size=1))
+
+    assert [record['call_id'] for record in records] == expected_call_ids
+
+
+@pytest.mark.parametrize('params, expected_errors', [
+    ({'source': '123'}, {'source': [invalid_phone_number_message]}),
+    ({'type': 'middle'}, {'type': ['Select a valid choice. middle is not one of the available choices.']}),
+    ({'call_id': '-1'}, {'call_id': ['Ensure this value is greater than or equal to 0.']}),
+    ({'timestamp_after': 'yesterday'}, {'timestamp_after': ['Enter a valid date/time.']}),
+])
+@pytest.mark.django_db
+def test_get_call_records_invalid_filters(client, params, expected_errors):
+    response = client.get(reverse('call_records:index'), params)
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == expected_errors
+
+
+@pytest.mark.django_db
+def test_get_call_records_invalid_cursor(client):
+    response = client.get(reverse('call_records:index'), {'cursor': 'not-a-cursor'})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
 
 
 @pytest.mark.django_db
@@ -81,6 +182,66 @@ def test_post_end_call_record(client):
     assert json.loads(response.content) == record_to_json(created_record)
 
 
+@pytest.mark.django_db
+def test_post_call_records_pairs_call(client):
+    client.post(reverse('call_records:index'), data={
+        'type': CallRecord.END,
+        'call_id': 21,
+        'timestamp': tzdatetime(2018, 5, 17, 10, 2, 30),
+    })
+    assert not Call.objects.exists()
+
+    client.post(reverse('call_records:index'), data={
+        'type': CallRecord.START,
+        'call_id': 21,
+        'timestamp': tzdatetime(2018, 5, 17, 10),
+        'source': '2199887766',
+        'destination': '21887766551'
+    })
+
+    call = Call.objects.get(call_id=21)
+    assert call.source == '2199887766'
+    assert call.destination == '21887766551'
+    assert call.start_timestamp == tzdatetime(2018, 5, 17, 10)
+    assert call.end_timestamp == tzdatetime(2018, 5, 17, 10, 2, 30)
+    assert call.duration.total_seconds() == 150
+    assert call.price == 54
+    assert call.tariff == Tariff.objects.get()
+
+
+@pytest.mark.django_db
+def test_post_call_records_call_committed_concurrently(client):
+    client.post(reverse('call_records:index'), data={
+        'type': CallRecord.START,
+        'call_id': 21,
+        'timestamp': tzdatetime(2018, 5, 17, 10),
+        'source': '2199887766',
+        'destination': '21887766551'
+    })
+
+    # NOTE: as if the end record was committed after the start record
+    # was paired, but before it was committed
+    CallRecord.objects.create(type=CallRecord.END, call_id=21, timestamp=tzdatetime(2018, 5, 17, 10, 2, 30))
+    assert not Call.objects.exists()
+
+    # NOTE: the call is created by the next reconciliation instead
+    reconcile(batch_size=10)
+    assert Call.objects.get().price == 54
+
+
+@pytest.mark.django_db
+def test_post_call_records_unpriceable_call(client):
+    for data in [{'type': CallRecord.END, 'call_id': 21, 'timestamp': tzdatetime(1969, 12, 31, 10, 2)},
+                 {'type': CallRecord.START, 'call_id': 21, 'timestamp': tzdatetime(1969, 12, 31, 10),
+                  'source': '2199887766', 'destination': '21887766551'}]:
+        response = client.post(reverse('call_records:index'), data=data)
+        assert response.status_code == status.HTTP_201_CREATED
+
+    # NOTE: there's no tariff before 1970, so the records are kept unpaired
+    assert not Call.objects.exists()
+    assert CallRecord.objects.filter(call_id=21).count() == 2
+
+
 def test_post_invalid_type(client):
     response = client.post(reverse('call_records:index'), data={
         'type': 'whatever',
@@ -165,6 +326,8 @@ def test_post_start_record_blank_phone_number(client, field):
     ('destination', '~'),
     ('destination', '23'),
     ('destination', '0012345678123'),
+    # NOTE: Arabic-Indic digits, which \d would match
+    ('destination', '\u0662\u0661\u0669\u0669\u0669\u0669\u0668\u0668\u0668\u0668'),
 ])
 def test_post_start_record_invalid_phone_number(client, field, invalid_value):
     data = {
@@ -194,7 +357,7 @@ def test_post_start_record_invalid_phone_number(client, field, invalid_value):
 @pytest.mark.django_db
 def test_get_telephone_bill(client, reference_period):
     subscriber = '1198761234'
-    CallRecord.objects.bulk_create([
+    create_call_records([
         CallRecord(type=CallRecord.START, call_id=12, timestamp=tzdatetime(2018, 1, 1, 10),
                    source=subscriber, destination='2199997777'),
         CallRecord(type=CallRecord.END, call_id=12, timestamp=tzdatetime(2018, 1, 1, 11)),
@@ -237,6 +400,44 @@ def test_get_telephone_bill(client, reference_period):
     }
 
 
+@freeze_time('2018-02-04')
+@pytest.mark.parametrize('chunk_size', [1, 2, 1000])
+@pytest.mark.parametrize('calls', [0, 5])
+@pytest.mark.django_db
+def test_get_telephone_bill_stream(client, settings, chunk_size, calls):
+    settings.BILL_STREAM_CHUNK_SIZE = chunk_size
+    subscriber = '1198761234'
+    records = []
+    for call_id in range(calls):
+        records.extend([
+            CallRecord(type=CallRecord.START, call_id=call_id, timestamp=tzdatetime(2018, 1, 1 + call_id, 10),
+                       source=subscriber, destination='2199997777'),
+            CallRecord(type=CallRecord.END, call_id=call_id, timestamp=tzdatetime(2018, 1, 1 + call_id, 11)),
+        ])
+    create_call_records(records)
+
+    url = reverse('call_records:telephone_bill')
+    response = client.get(url, data={'subscriber': subscriber, 'reference_period': '201801', 'stream': 'true'})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.streaming
+    assert response['Content-Type'] == 'application/json'
+    assert (b''.join(response.streaming_content)
+            == client.get(url, data={'subscriber': subscriber, 'reference_period': '201801'}).content)
+
+
+@freeze_time('2018-02-04')
+def test_get_telephone_bill_stream_current_month_should_fail(client):
+    response = client.get(reverse('call_records:telephone_bill'), data={
+        'subscriber': '1122334455',
+        'reference_period': '201802',
+        'stream': 'true'
+    })
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert json.loads(response.content) == {'detail': 'Reference period 201802 is not closed yet'}
+
+
 @freeze_time('2018-02-04')
 def test_get_telephone_bill_current_month_should_fail(client):
     response = client.get(reverse('call_records:telephone_bill'), data={
@@ -262,6 +463,7 @@ def test_get_telephone_bill_missing_subscriber(client):
     ('a', [invalid_phone_number_message]),
     ('~', [invalid_phone_number_message]),
     ('123456', [invalid_phone_number_message]),  # too short
+    ('\u0662\u0661\u0669\u0669\u0669\u0669\u0668\u0668\u0668\u0668', [invalid_phone_number_message]),
     ('11234523452345',  [invalid_phone_number_message,  # too long
                          'Ensure this value has at most 11 characters (it has 14).']),
 ])
@@ -281,6 +483,7 @@ standard_regex_period_error = 'Reference period should be in the YYYYMM format'
 @pytest.mark.parametrize('reference_period, expected_errors', [
     ('a', [standard_regex_period_error]),
     ('12345', [standard_regex_period_error]),  # too short
+    ('\u0662\u0660\u0661\u0668\u0660\u0661', [standard_regex_period_error]),
     ('2233445', [standard_regex_period_error, 'Ensure this value has at most 6 characters (it has 7).']),  # too long
     (12, [standard_regex_period_error]),
     (True, [standard_regex_period_error]),
@@ -294,3 +497,66 @@ def test_get_telephone_bill_invalid_reference_period(client, reference_period, e
 
     assert response.status_code == status.HTTP_400_BAD_REQUEST
     assert json.loads(response.content) == {'reference_period': expected_errors}
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 1000])
+@pytest.mark.django_db
+def test_post_call_records_bulk(client, settings, batch_size):
+    settings.CALL_RECORDS_BULK_BATCH_SIZE = batch_size
+    CallRecord.objects.create(type=CallRecord.END, call_id=11, timestamp=tzdatetime(2018, 1, 1))
+
+    response = client.post(reverse('call_records:bulk'), content_type='application/json', data=json.dumps([
+        {'type': CallRecord.START, 'call_id': 11, 'timestamp': '2018-01-01T10:00:00Z',
+         'source': '2199998888', 'destination': '2199997777'},
+        {'type': CallRecord.END, 'call_id': 11, 'timestamp': '2018-01-01T10:05:00Z'},
+        {'type': 'whatever', 'call_id': 12},
+        {'type': CallRecord.START, 'call_id': 12, 'timestamp': '2018-01-01T10:00:00Z',
+         'source': 'a', 'destination': '2199997777'},
+        {'type': CallRecord.END, 'call_id': 12, 'timestamp': '2018-01-01T10:05:00Z'},
+        {'type': CallRecord.END, 'call_id': 12, 'timestamp': '2018-01-01T10:06:00Z'},
+    ]))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert list(Call.objects.values_list('call_id', flat=True)) == [11]
+    start_record = CallRecord.objects.get(type=CallRecord.START, call_id=11)
+    end_record = CallRecord.objects.get(type=CallRecord.END, call_id=12)
+    assert end_record.timestamp == tzdatetime(2018, 1, 1, 10, 5)
+    assert json.loads(response.content) == {
+        'created': 2,
+        'duplicates': 2,
+        'invalid': 2,
+        'results': [
+            {'index': 0, 'status': 'created', 'id': start_record.id},
+            {'index': 1, 'status': 'duplicate', 'detail': 'Call record already exists'},
+            {'index': 2, 'status': 'invalid', 'errors': {'type': ['Only "start" or "end" are allowed']}},
+            {'index': 3, 'status': 'invalid', 'errors': {'source': [invalid_phone_number_message]}},
+            {'index': 4, 'status': 'created', 'id': end_record.id},
+            {'index': 5, 'status': 'duplicate', 'detail': 'Call record already exists'},
+        ]
+    }
+
+
+@pytest.mark.django_db
+def test_post_call_records_bulk_ndjson(client):
+    body = '\n'.join([
+        json.dumps({'type': CallRecord.START, 'call_id': 11, 'timestamp': '2018-01-01T10:00:00Z',
+                    'source': '2199998888', 'destination': '2199997777'}),
+        '',
+        json.dumps({'type': CallRecord.END, 'call_id': 11, 'timestamp': '2018-01-01T10:05:00Z'}),
+    ])
+
+    response = client.post(reverse('call_records:bulk'), content_type='application/x-ndjson', data=body)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert json.loads(response.content)['created'] == 2
+    assert CallRecord.objects.count() == 2
+
+
+@pytest.mark.parametrize('content_type, body', [
+    ('application/json', json.dumps({'type': CallRecord.END, 'call_id': 11})),
+    ('application/x-ndjson', '{"type": "end"}\n{"type": '),
+])
+def test_post_call_records_bulk_malformed_body(client, content_type, body):
+    response = client.post(reverse('call_records:bulk'), content_type=content_type, data=body)
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
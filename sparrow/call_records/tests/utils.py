@@ -1,5 +1,64 @@
+import asyncio
+
 from django.utils import timezone
 
+from sparrow.call_records.asgi import AsyncApplication
+from sparrow.call_records.ingestion import pair_call_records
+from sparrow.call_records.models import CallRecord
+
 
 def tzdatetime(*args):
     return timezone.make_aware(timezone.datetime(*args))
+
+
+def create_call_records(records):
+    """
+    Same as CallRecord.objects.bulk_create, but also pairs the records
+    into calls like every ingestion path does
+    """
+    records = CallRecord.objects.bulk_create(records)
+    pair_call_records([record.call_id for record in records])
+    return records
+
+
+def create_calls(calls):
+    """
+    Creates calls from (call_id, source, start, end) tuples, optionally
+    followed by the destination
+    """
+    create_call_records([record for call in calls for record in _call_records(*call)])
+
+
+def _call_records(call_id, source, start_timestamp, end_timestamp, destination='2199997777'):
+    return [
+        CallRecord(type=CallRecord.START, call_id=call_id, timestamp=start_timestamp, source=source,
+                   destination=destination),
+        CallRecord(type=CallRecord.END, call_id=call_id, timestamp=end_timestamp),
+    ]
+
+
+def asgi_request(method, path, *, body=b'', query_string=b'', content_type=b'application/json', host=b'testserver',
+                 headers=(), fallback=None):
+    """
+    Sends a request to a new AsyncApplication, returning the status
+    and the body of the response
+    """
+    application = AsyncApplication(fallback)
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+                 'headers': [(b'host', host), (b'content-type', content_type), *headers]}
+        try:
+            await application(scope, receive, send)
+        finally:
+            await application.close()
+
+    asyncio.run(run())
+    return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
@@ -1,10 +1,15 @@
 from django.urls import path
 
-from sparrow.call_records.views import CallRecordsView, get_telephone_bill
+from sparrow.call_records.views import (
+    CallRecordsView, CallRecordsBulkView, get_ingestion_status, get_telephone_bill, get_telephone_bill_summary
+)
 
 
 app_name = 'call_records'
 urlpatterns = [
     path('', CallRecordsView.as_view(), name='index'),
+    path('bulk/', CallRecordsBulkView.as_view(), name='bulk'),
+    path('ingestions/<uuid:ingestion_id>/', get_ingestion_status, name='ingestion_status'),
     path('telephone_bill/', get_telephone_bill, name='telephone_bill'),
+    path('telephone_bill/summary/', get_telephone_bill_summary, name='telephone_bill_summary'),
 ]
@@ -0,0 +1,202 @@
+"""
+Serializer-free validation and rendering of call records.
+
+DRF serializers rebuild their fields on every instantiation, which
+dominates the CPU time of ingestion. The functions below apply exactly
+the same rules as `CallRecordStartSerializer` and
+`CallRecordEndSerializer`, with the same error messages, and render
+records the same way JSONRenderer does. When CALL_RECORDS_FAST_PATH is
+disabled, the API falls back to the serializers.
+"""
+__all__ = ['parse_call_record', 'validate_call_record', 'render_call_record']
+
+import json
+import re
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from pytz.exceptions import InvalidTimeError
+from rest_framework.utils.encoders import JSONEncoder
+
+from sparrow.call_records.exceptions import InvalidCallRecordError
+from sparrow.call_records.models import CallRecord, phone_number_validator
+
+
+# NOTE: call_id is stored in a PositiveIntegerField, i.e. a signed integer
+MAX_CALL_ID = 2147483647
+
+PHONE_NUMBER_MAX_LENGTH = CallRecord._meta.get_field('source').max_length
+
+# NOTE: messages of the DRF fields built by the serializers
+REQUIRED_MESSAGE = 'This field is required.'
+NULL_MESSAGE = 'This field may not be null.'
+BLANK_MESSAGE = 'This field may not be blank.'
+INVALID_STRING_MESSAGE = 'Not a valid string.'
+MAX_LENGTH_MESSAGE = f'Ensure this field has no more than {PHONE_NUMBER_MAX_LENGTH} characters.'
+NULL_CHARACTERS_MESSAGE = 'Null characters are not allowed.'
+SURROGATE_CHARACTERS_MESSAGE = 'Surrogate characters are not allowed: U+{:X}.'
+INVALID_INTEGER_MESSAGE = 'A valid integer is required.'
+INTEGER_TOO_LONG_MESSAGE = 'String value too large.'
+MAX_VALUE_MESSAGE = f'Ensure this value is less than or equal to {MAX_CALL_ID}.'
+MIN_VALUE_MESSAGE = 'Ensure this value is greater than or equal to 0.'
+INVALID_DATETIME_MESSAGE = ('Datetime has wrong format. Use one of these formats instead: '
+                            'YYYY-MM-DDThh:mm[:ss[.uuuuuu]][+HH:MM|-HH:MM|Z].')
+DATETIME_OVERFLOW_MESSAGE = 'Datetime value out of range.'
+INVALID_TIMEZONE_MESSAGE = 'Invalid datetime for the timezone "{}".'
+
+# NOTE: same as IntegerField, which takes e.g. "1.0" as 1 but not "1.2"
+_DECIMAL_RE = re.compile(r'\.0*\s*$')
+_INTEGER_MAX_STRING_LENGTH = 1000
+
+_SURROGATE_RE = re.compile('[\ud800-\udfff]')
+
+_MISSING = object()
+
+_encoder = JSONEncoder()
+
+
+class _FieldError(Exception):
+    def __init__(self, *messages):
+        self.messages = list(messages)
+
+
+def parse_call_record(body):
+    """
+    Parses a JSON request body the way DRF's JSONParser does, rejecting
+    NaN and infinities. Raises ValueError if it's not valid JSON.
+    """
+    return json.loads(body.decode('utf-8') if isinstance(body, bytes) else body, parse_constant=_reject_constant)
+
+
+def validate_call_record(data):
+    """
+    Validates a call record given as a mapping of strings (or JSON
+    values), with the same rules and messages as the serializers.
+
+    Returns a dict with `type`, `call_id`, `timestamp`, `source` and
+    `destination` ready to be stored. Raises InvalidCallRecordError
+    otherwise.
+    """
+    record_type = data.get('type') if isinstance(data, dict) else None
+    if not CallRecord.is_record_type(record_type):
+        raise InvalidCallRecordError({'type': ['Only "start" or "end" are allowed']})
+
+    errors = {}
+    record = {'type': record_type, 'source': '', 'destination': ''}
+    for field, validate in _FIELDS[record_type]:
+        value = data.get(field, _MISSING)
+        try:
+            if value is _MISSING:
+                raise _FieldError(REQUIRED_MESSAGE)
+            if value is None:
+                raise _FieldError(NULL_MESSAGE)
+            record[field] = validate(value)
+        except _FieldError as e:
+            errors[field] = e.messages
+
+    if errors:
+        raise InvalidCallRecordError(errors)
+
+    return record
+
+
+def render_call_record(record):
+    """
+    Renders a created record, a dict like the ones returned by
+    `validate_call_record` along with its `id`, as JSONRenderer renders
+    it from the serializers
+    """
+    data = {
+        'id': record['id'],
+        'type': record['type'],
+        'call_id': record['call_id'],
+        'timestamp': _encoder.default(record['timestamp']),
+    }
+    if record['type'] == CallRecord.START:
+        data['source'] = record['source']
+        data['destination'] = record['destination']
+
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _validate_call_id(value):
+    if isinstance(value, str) and len(value) > _INTEGER_MAX_STRING_LENGTH:
+        raise _FieldError(INTEGER_TOO_LONG_MESSAGE)
+
+    try:
+        call_id = int(_DECIMAL_RE.sub('', str(value)))
+    except (TypeError, ValueError):
+        raise _FieldError(INVALID_INTEGER_MESSAGE)
+
+    if call_id > MAX_CALL_ID:
+        raise _FieldError(MAX_VALUE_MESSAGE)
+    if call_id < 0:
+        raise _FieldError(MIN_VALUE_MESSAGE)
+
+    return call_id
+
+
+def _validate_timestamp(value):
+    try:
+        timestamp = parse_datetime(value)
+    except (TypeError, ValueError):
+        timestamp = None
+
+    if timestamp is None:
+        raise _FieldError(INVALID_DATETIME_MESSAGE)
+
+    current_timezone = timezone.get_current_timezone()
+    if timezone.is_aware(timestamp):
+        try:
+            return timestamp.astimezone(current_timezone)
+        except OverflowError:
+            raise _FieldError(DATETIME_OVERFLOW_MESSAGE)
+
+    try:
+        return timezone.make_aware(timestamp, current_timezone)
+    except InvalidTimeError:
+        raise _FieldError(INVALID_TIMEZONE_MESSAGE.format(current_timezone))
+
+
+def _validate_phone_number(value):
+    if value == '' or str(value).strip() == '':
+        raise _FieldError(BLANK_MESSAGE)
+    # NOTE: numbers are taken as strings, like CharField does
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise _FieldError(INVALID_STRING_MESSAGE)
+
+    value = str(value).strip()
+    # NOTE: like DRF, every failing rule is reported, in the same order
+    errors = _FieldError()
+    if not phone_number_validator.regex.search(value):
+        errors.messages.append(phone_number_validator.message)
+    if len(value) > PHONE_NUMBER_MAX_LENGTH:
+        errors.messages.append(MAX_LENGTH_MESSAGE)
+    if '\x00' in value:
+        errors.messages.append(NULL_CHARACTERS_MESSAGE)
+    surrogate = _SURROGATE_RE.search(value)
+    if surrogate:
+        errors.messages.append(SURROGATE_CHARACTERS_MESSAGE.format(ord(surrogate.group())))
+
+    if errors.messages:
+        raise errors
+
+    return value
+
+
+def _reject_constant(constant):
+    raise ValueError(f'Out of range float values are not JSON compliant: {constant!r}')
+
+
+_FIELDS = {
+    CallRecord.START: [
+        ('call_id', _validate_call_id),
+        ('timestamp', _validate_timestamp),
+        ('source', _validate_phone_number),
+        ('destination', _validate_phone_number),
+    ],
+    CallRecord.END: [
+        ('call_id', _validate_call_id),
+        ('timestamp', _validate_timestamp),
+    ],
+}
@@ -1,20 +1,75 @@
-__all__ = ['CallRecordsView', 'get_telephone_bill']
+__all__ = ['CallRecordsView', 'CallRecordsBulkView', 'get_telephone_bill', 'get_telephone_bill_summary',
+           'get_ingestion_status', 'render_bill_head', 'render_call_records', 'BILL_TAIL']
 
+import json
+import uuid
+
+from django.conf import settings
 from django.db import IntegrityError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
 from rest_framework import generics
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 
-from sparrow.call_records.api import telephone_bill
-from sparrow.call_records.exceptions import TelephoneBillError
-from sparrow.call_records.forms import TelephoneBillForm
+from sparrow.call_records import buffer, ingestion
+from sparrow.call_records.api import stream_telephone_bill
+from sparrow.call_records.cache import cached_telephone_bill
+from sparrow.call_records.exceptions import InvalidCallRecordError, TelephoneBillError
+from sparrow.call_records.forms import CallRecordsFilterForm, TelephoneBillForm
 from sparrow.call_records.models import CallRecord
+from sparrow.call_records.pagination import CallRecordsPagination
+from sparrow.call_records.parsers import NDJSONParser
 from sparrow.call_records.serializers import CallRecordStartSerializer, CallRecordEndSerializer
+from sparrow.call_records.summaries import telephone_bill_summary
+from sparrow.call_records.validation import parse_call_record, render_call_record, validate_call_record
+
+
+INVALID_TYPE_ERRORS = {'type': ['Only "start" or "end" are allowed']}
+DUPLICATED_RECORD_DETAIL = 'Call record already exists'
+
+# NOTE: statuses of the responses rejecting a posted record
+INVALID_RECORD_STATUSES = (status.HTTP_400_BAD_REQUEST, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 
 
 class CallRecordsView(generics.ListCreateAPIView):
     queryset = CallRecord.objects.all()
+    pagination_class = CallRecordsPagination
+
+    def filter_queryset(self, queryset):
+        """
+        Filters records by the `source`, `call_id`, `type`,
+        `timestamp_after` and `timestamp_before` query parameters
+        """
+        f = CallRecordsFilterForm(self.request.query_params)
+        if not f.is_valid():
+            raise ValidationError(f.errors)
+
+        filters = f.cleaned_data
+        if filters['source']:
+            queryset = queryset.filter(source=filters['source'])
+        if filters['type']:
+            queryset = queryset.filter(type=filters['type'])
+        if filters['call_id'] is not None:
+            # NOTE: the (type, call_id) unique index serves call_id
+            # lookups as long as type is constrained too
+            queryset = queryset.filter(call_id=filters['call_id'],
+                                       type__in=[record_type for record_type, _ in CallRecord.RECORD_TYPES])
+        if filters['timestamp_after']:
+            queryset = queryset.filter(timestamp__gte=filters['timestamp_after'])
+        if filters['timestamp_before']:
+            queryset = queryset.filter(timestamp__lt=filters['timestamp_before'])
+
+        return queryset
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # NOTE: records created or duplicated are counted on insertion
+        if request.method == 'POST' and response.status_code in INVALID_RECORD_STATUSES:
+            ingestion.count_invalid_records()
+        return super().finalize_response(request, response, *args, **kwargs)
 
     def get_serializer_class(self):
         """
@@ -27,25 +82,143 @@ class CallRecordsView(generics.ListCreateAPIView):
             return CallRecordEndSerializer
 
     def post(self, request, *args, **kwargs):
-        if not CallRecord.is_record_type(request.data.get('type')):
-            return Response({
-                'type': ['Only "start" or "end" are allowed']
-            }, status=status.HTTP_400_BAD_REQUEST)
+        if settings.CALL_RECORDS_FAST_PATH and request.content_type.split(';')[0].strip() == 'application/json':
+            return self.post_fast(request)
+
+        if not isinstance(request.data, dict) or not CallRecord.is_record_type(request.data.get('type')):
+            return Response(INVALID_TYPE_ERRORS, status=status.HTTP_400_BAD_REQUEST)
+
+        if settings.CALL_RECORDS_INGESTION_MODE == buffer.BUFFERED:
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            return self.post_buffered(request, dict(serializer.validated_data, type=request.data['type']))
 
         try:
             return super().post(request, *args, **kwargs)
         except IntegrityError:
             return Response({
-                'detail': 'Call record already exists'
+                'detail': DUPLICATED_RECORD_DETAIL
             }, status=status.HTTP_409_CONFLICT)
 
+    def post_fast(self, request):
+        """
+        Same as `post` for JSON bodies, parsing, validating and rendering
+        the record without DRF (see `sparrow.call_records.validation`)
+        """
+        try:
+            data = parse_call_record(request.body)
+        except ValueError as e:
+            raise ParseError(f'JSON parse error - {e}')
+
+        try:
+            record = validate_call_record(data)
+        except InvalidCallRecordError as e:
+            return Response(e.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if settings.CALL_RECORDS_INGESTION_MODE == buffer.BUFFERED:
+            return self.post_buffered(request, record)
+
+        record['id'], = ingestion.insert_call_records([record], batch_size=1)
+        if record['id'] is None:
+            return Response({'detail': DUPLICATED_RECORD_DETAIL}, status=status.HTTP_409_CONFLICT)
+
+        return HttpResponse(render_call_record(record), status=status.HTTP_201_CREATED,
+                            content_type='application/json')
+
+    def post_buffered(self, request, record):
+        """
+        Hands a validated record to the write-behind buffer, returning
+        202 with the URL where its status can be looked up
+        """
+        ingestion_id = uuid.uuid4()
+        try:
+            result = buffer.submit(ingestion_id, record)
+        except buffer.BufferFullError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        return Response(dict(
+            _ingestion_status_data(result),
+            ingestion_id=str(ingestion_id),
+            url=reverse('call_records:ingestion_status', kwargs={'ingestion_id': ingestion_id}),
+        ), status=status.HTTP_202_ACCEPTED)
+
+
+class CallRecordsBulkView(generics.GenericAPIView):
+    """
+    Creates many call records, start and end mixed, in a single request.
+    The body is either a JSON array or NDJSON (one record per line).
+
+    Every record is validated with the same rules as
+    `CallRecordsView.post`, valid ones are inserted in batches and the
+    response reports the outcome of each record, in the same order
+    they were sent.
+    """
+    parser_classes = (JSONParser, NDJSONParser)
+    serializer_classes = {
+        CallRecord.START: CallRecordStartSerializer,
+        CallRecord.END: CallRecordEndSerializer,
+    }
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return Response({
+                'detail': 'Expected a list of call records'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        results = []
+        valid_records = []
+        for index, data in enumerate(request.data):
+            errors = None
+            if settings.CALL_RECORDS_FAST_PATH:
+                try:
+                    valid_records.append(validate_call_record(data))
+                except InvalidCallRecordError as e:
+                    errors = e.errors
+            elif not isinstance(data, dict) or not CallRecord.is_record_type(data.get('type')):
+                errors = INVALID_TYPE_ERRORS
+            else:
+                serializer = self.serializer_classes[data['type']](data=data)
+                if serializer.is_valid():
+                    valid_records.append(dict(serializer.validated_data, type=data['type']))
+                else:
+                    errors = serializer.errors
+
+            results.append({'index': index, 'status': ingestion.INVALID, 'errors': errors}
+                           if errors else None)
+
+        ingestion.count_invalid_records(len(request.data) - len(valid_records))
+        ids = iter(ingestion.insert_call_records(valid_records, batch_size=settings.CALL_RECORDS_BULK_BATCH_SIZE))
+        for index, result in enumerate(results):
+            if result is not None:
+                continue
+
+            record_id = next(ids)
+            if record_id is None:
+                results[index] = {'index': index, 'status': ingestion.DUPLICATE, 'detail': DUPLICATED_RECORD_DETAIL}
+            else:
+                results[index] = {'index': index, 'status': ingestion.CREATED, 'id': record_id}
+
+        return Response({
+            'created': sum(1 for result in results if result['status'] == ingestion.CREATED),
+            'duplicates': sum(1 for result in results if result['status'] == ingestion.DUPLICATE),
+            'invalid': sum(1 for result in results if result['status'] == ingestion.INVALID),
+            'results': results,
+        })
+
 
 @api_view(['GET'])
 def get_telephone_bill(request):
     f = TelephoneBillForm(request.GET)
     if f.is_valid():
         try:
-            return Response(telephone_bill(
+            if f.cleaned_data['stream']:
+                return StreamingHttpResponse(_render_telephone_bill(stream_telephone_bill(
+                    subscriber=f.cleaned_data['subscriber'],
+                    reference_period=f.cleaned_data['reference_period'],
+                    chunk_size=settings.BILL_STREAM_CHUNK_SIZE
+                )), content_type='application/json')
+
+            return Response(cached_telephone_bill(
                 subscriber=f.cleaned_data['subscriber'],
                 reference_period=f.cleaned_data['reference_period']
             ))
@@ -53,3 +226,91 @@ def get_telephone_bill(request):
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     else:
         return Response(f.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+def get_telephone_bill_summary(request):
+    """
+    Returns the number of calls, total duration and price of a bill,
+    with the same parameters as `get_telephone_bill`
+    """
+    f = TelephoneBillForm(request.GET)
+    if not f.is_valid():
+        return Response(f.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        return Response(telephone_bill_summary(
+            subscriber=f.cleaned_data['subscriber'],
+            reference_period=f.cleaned_data['reference_period']
+        ))
+    except TelephoneBillError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+def get_ingestion_status(request, ingestion_id):
+    """
+    Returns the status of a record posted in the buffered ingestion
+    mode: 202 while pending, 200 once created, 409 if duplicated and
+    500 if it couldn't be written
+    """
+    result = buffer.get_status(ingestion_id)
+    if result is None:
+        return Response({'detail': 'Unknown ingestion id'}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(_ingestion_status_data(result), status={
+        buffer.PENDING: status.HTTP_202_ACCEPTED,
+        ingestion.CREATED: status.HTTP_200_OK,
+        ingestion.DUPLICATE: status.HTTP_409_CONFLICT,
+        buffer.FAILED: status.HTTP_500_INTERNAL_SERVER_ERROR,
+    }[result['status']])
+
+
+def _ingestion_status_data(result):
+    # NOTE: without a shared status cache, the status may be unknown
+    # right after submitting the record
+    result = result or {'status': buffer.PENDING}
+    if result['status'] == ingestion.DUPLICATE:
+        return dict(result, detail=DUPLICATED_RECORD_DETAIL)
+    if result['status'] == buffer.FAILED:
+        return dict(result, detail='Call record could not be written, post it again')
+    return result
+
+
+def _render_telephone_bill(bill):
+    """
+    Renders a bill from `stream_telephone_bill` as JSON, chunk by
+    chunk, the same way JSONRenderer renders the whole of it at once
+    """
+    yield render_bill_head(bill)
+    first = True
+    for call_records in bill['call_records']:
+        yield render_call_records(call_records, first=first)
+        first = False
+
+    yield BILL_TAIL
+
+
+# NOTE: the end of a bill rendered by `render_bill_head` and
+# `render_call_records`
+BILL_TAIL = b']}'
+
+
+def render_bill_head(bill):
+    """
+    Renders the beginning of a bill as JSON, up to its call records
+    """
+    return f'{{"subscriber":{_dumps(bill["subscriber"])},' \
+           f'"reference_period":{_dumps(bill["reference_period"])},"call_records":['.encode()
+
+
+def render_call_records(call_records, *, first):
+    """
+    Renders a chunk of the call records of a bill as JSON, `first`
+    telling whether it's the first chunk
+    """
+    return (('' if first else ',') + ','.join(_dumps(call_record) for call_record in call_records)).encode()
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
@@ -0,0 +1,27 @@
+"""
+ASGI config for sparrow project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The busiest endpoints are served asynchronously (see
+``sparrow.call_records.asgi``), every other request by the WSGI
+application. Run it with an ASGI server, for instance:
+
+    $ gunicorn sparrow.core.asgi -k uvicorn.workers.UvicornWorker
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sparrow.core.settings.production')
+
+wsgi_application = get_wsgi_application()
+
+from sparrow.call_records.asgi import AsyncApplication  # noqa: E402 (needs Django set up)
+from sparrow.call_records.checks import check_settings  # noqa: E402 (needs Django set up)
+
+# NOTE: servers don't run system checks, see sparrow.call_records.checks
+check_settings()
+
+application = AsyncApplication(WsgiToAsgi(wsgi_application))
@@ -0,0 +1,327 @@
+"""
+In-process metrics, exposed in the Prometheus text format by the
+/metrics endpoint.
+
+Metrics are plain counters and histograms kept in memory, cheap enough
+for hot paths: an observation is a dict lookup, a bisect and two
+additions. Each process has its own, so with several gunicorn workers,
+set METRICS_DIR to a directory shared by them: each process writes its
+metrics there at most every METRICS_FLUSH_INTERVAL seconds, and
+/metrics adds up those of every process.
+
+When a process exits, or is found dead, its metrics are added to those
+of the processes that exited before, kept in a single file, and its
+own file is removed: workers come and go, but their files don't pile
+up, and counters never go backwards.
+"""
+__all__ = ['Counter', 'Histogram', 'REGISTRY', 'render']
+
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+
+# NOTE: in seconds, from 1ms to 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# NOTE: in METRICS_DIR, the metrics of processes that exited, and the
+# lock taken to add to them
+EXITED_SNAPSHOT = 'exited.json'
+LOCK_FILE = '.lock'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._next_flush = 0
+        self._lock = threading.Lock()
+        self._written = False
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} already registered')
+        self.metrics[metric.name] = metric
+
+    def snapshot(self):
+        """
+        Returns the current value of every metric, JSON serializable
+        """
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def maybe_flush(self):
+        """
+        Writes the metrics of this process to METRICS_DIR, if set, unless
+        they were written less than METRICS_FLUSH_INTERVAL seconds ago
+        """
+        if not settings.METRICS_DIR or time.monotonic() < self._next_flush:
+            return
+
+        with self._lock:
+            self._next_flush = time.monotonic() + settings.METRICS_FLUSH_INTERVAL
+            self._write(settings.METRICS_DIR)
+
+    def collect(self):
+        """
+        Returns the snapshot of this process added to those of the
+        other processes in METRICS_DIR, if set
+        """
+        snapshot = self.snapshot()
+        if not settings.METRICS_DIR:
+            return snapshot
+
+        self._write(settings.METRICS_DIR)
+        snapshot = {}
+        # NOTE: so processes exiting meanwhile aren't counted twice
+        with _locked(settings.METRICS_DIR):
+            for filename in os.listdir(settings.METRICS_DIR):
+                pid = _snapshot_pid(filename)
+                if pid is not None and not _is_running(pid):
+                    _retire(settings.METRICS_DIR, pid, _read_snapshot(settings.METRICS_DIR, filename))
+
+            for filename in sorted(os.listdir(settings.METRICS_DIR)):
+                if filename.endswith('.json'):
+                    _merge(snapshot, _read_snapshot(settings.METRICS_DIR, filename))
+
+        return snapshot
+
+    def retire(self):
+        """
+        Adds the metrics of this process to those of the processes that
+        exited in METRICS_DIR, and removes its own. Runs at exit
+        """
+        if not settings.METRICS_DIR or not self._written:
+            return
+
+        with self._lock, _locked(settings.METRICS_DIR):
+            _retire(settings.METRICS_DIR, os.getpid(), self.snapshot())
+            self._written = False
+
+    def _write(self, directory):
+        fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as snapshot_file:
+            json.dump(self.snapshot(), snapshot_file)
+        os.replace(path, os.path.join(directory, f'{os.getpid()}.json'))
+        self._written = True
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.retire)
+
+
+class _Metric:
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=(), *, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+        registry.register(self)
+
+    def labels(self, *values):
+        """
+        Returns the child metric for the given label values, in the
+        order of `labelnames`. Keep a reference to it in hot paths
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def snapshot(self):
+        return {
+            'type': self.TYPE,
+            'documentation': self.documentation,
+            'labelnames': list(self.labelnames),
+            'samples': [[list(values), child.snapshot()] for values, child in list(self._children.items())],
+        }
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        # NOTE: no lock, the GIL makes lost increments unlikely enough
+        # for monitoring, and a lock would double the cost
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Counter(_Metric):
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # NOTE: the last count is for values above every bucket (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {'counts': list(self.counts), 'sum': self.sum}
+
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), *, buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry=registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def snapshot(self):
+        return dict(super().snapshot(), buckets=list(self.buckets))
+
+
+def render(snapshot):
+    """
+    Renders a snapshot in the Prometheus text format
+    """
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f'# HELP {name} {metric["documentation"]}')
+        lines.append(f'# TYPE {name} {metric["type"]}')
+        for values, sample in sorted(metric['samples']):
+            labels = list(zip(metric['labelnames'], values))
+            if metric['type'] == 'counter':
+                lines.append(f'{name}{_labels(labels)} {_number(sample)}')
+                continue
+
+            cumulative_count = 0
+            for bucket, count in zip(metric['buckets'] + ['+Inf'], sample['counts']):
+                cumulative_count += count
+                bound = bucket if bucket == '+Inf' else _number(bucket)
+                lines.append(f'{name}_bucket{_labels(labels + [("le", bound)])} {cumulative_count}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(sample["sum"])}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative_count}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class _locked:
+    """
+    Holds the lock of METRICS_DIR, shared by the processes using it
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, LOCK_FILE)
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+def _snapshot_pid(filename):
+    """
+    Returns the pid of the process that wrote the snapshot `filename`,
+    None if it's not the snapshot of a process
+    """
+    name, extension = os.path.splitext(filename)
+    return int(name) if extension == '.json' and name.isdigit() else None
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # NOTE: running, as another user
+        pass
+    return True
+
+
+def _read_snapshot(directory, filename):
+    try:
+        with open(os.path.join(directory, filename)) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        # NOTE: removed, or being replaced, meanwhile
+        return {}
+
+
+def _retire(directory, pid, snapshot):
+    """
+    Adds `snapshot`, of the process `pid`, to EXITED_SNAPSHOT and
+    removes the snapshot of that process. The lock must be held
+    """
+    exited = _read_snapshot(directory, EXITED_SNAPSHOT)
+    _merge(exited, snapshot)
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as snapshot_file:
+        json.dump(exited, snapshot_file)
+    os.replace(path, os.path.join(directory, EXITED_SNAPSHOT))
+
+    try:
+        os.remove(os.path.join(directory, f'{pid}.json'))
+    except FileNotFoundError:
+        pass
+
+
+def _merge(snapshot, other):
+    for name, metric in other.items():
+        if name not in snapshot:
+            snapshot[name] = dict(metric, samples=[])
+
+        samples = {tuple(values): sample for values, sample in snapshot[name]['samples']}
+        for values, sample in metric['samples']:
+            current = samples.get(tuple(values))
+            if current is None:
+                samples[tuple(values)] = sample
+            elif metric['type'] == 'counter':
+                samples[tuple(values)] = current + sample
+            else:
+                samples[tuple(values)] = {'counts': [a + b for a, b in zip(current['counts'], sample['counts'])],
+                                          'sum': current['sum'] + sample['sum']}
+        snapshot[name]['samples'] = [[list(values), sample] for values, sample in samples.items()]
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+    ) for name, value in labels) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
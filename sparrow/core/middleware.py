@@ -0,0 +1,58 @@
+__all__ = ['MetricsMiddleware']
+
+import time
+
+from django.db import connection
+
+from sparrow.core.metrics import REGISTRY, Counter, Histogram
+
+
+REQUESTS = Counter('http_requests_total', 'Requests served, by view and status', ['method', 'view', 'status'])
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time to build responses, by view', ['method', 'view'])
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'Database queries run per request, by view', ['view'],
+                            buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+REQUEST_QUERIES_DURATION = Histogram('http_request_db_duration_seconds',
+                                     'Time spent in database queries per request, by view', ['view'])
+
+
+class MetricsMiddleware:
+    """
+    Measures the latency and database queries of every request, by
+    view name. Streamed responses are measured until they start
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = _QueryCounter()
+        started_at = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started_at
+
+        # NOTE: resolver_match is only set once the URL was resolved
+        view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        REQUESTS.labels(request.method, view, str(response.status_code)).inc()
+        REQUEST_DURATION.labels(request.method, view).observe(elapsed)
+        REQUEST_QUERIES.labels(view).observe(queries.count)
+        REQUEST_QUERIES_DURATION.labels(view).observe(queries.duration)
+
+        REGISTRY.maybe_flush()
+        return response
+
+
+class _QueryCounter:
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started_at
@@ -0,0 +1,130 @@
+"""
+Profiling of single requests on real traffic.
+
+Requests carrying a valid token in the `X-Profile` header (see
+`make_token` and the `profiling_token` command) are run under cProfile,
+recording every query they run along the way. Both are saved to
+PROFILING_DIR: `<id>.prof`, readable with `pstats` or snakeviz, and
+`<id>.json`, with the SQL timeline. The response tells the id in its
+`X-Profile-Id` header. Other requests only pay for a header lookup.
+
+Tokens are signed with SECRET_KEY and expire after
+PROFILING_TOKEN_MAX_AGE seconds. Only the last PROFILING_MAX_PROFILES
+profiles are kept, older ones are deleted after each new one is saved.
+"""
+__all__ = ['ProfilingMiddleware', 'make_token']
+
+import cProfile
+import json
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpResponse
+from django.utils import timezone
+
+
+HEADER = 'HTTP_X_PROFILE'
+ID_HEADER = 'X-Profile-Id'
+
+_signer = signing.TimestampSigner(salt='sparrow.core.profiling')
+
+
+def make_token():
+    """
+    Returns a token enabling profiling of the requests carrying it
+    """
+    return _signer.sign('profile')
+
+
+def _is_valid_token(token):
+    try:
+        return _signer.unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests with a valid `X-Profile` header. Only used when
+    PROFILING_DIR is set
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_DIR:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = request.META.get(HEADER)
+        if token is None or not _is_valid_token(token):
+            return self.get_response(request)
+
+        profile_id = f'{timezone.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}'
+        timeline = _QueryTimeline()
+        profiler = cProfile.Profile()
+        started_at = time.perf_counter()
+        with connection.execute_wrapper(timeline):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+                if response.streaming:
+                    # NOTE: streamed bills do most of their work while
+                    # streaming, so their content is profiled too
+                    response = HttpResponse(b''.join(response.streaming_content), status=response.status_code,
+                                            content_type=response['Content-Type'])
+            finally:
+                profiler.disable()
+        elapsed = time.perf_counter() - started_at
+
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        path = os.path.join(settings.PROFILING_DIR, profile_id)
+        profiler.dump_stats(f'{path}.prof')
+        with open(f'{path}.json', 'w') as timeline_file:
+            json.dump({
+                'request': f'{request.method} {request.get_full_path()}',
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 3),
+                'queries_duration_ms': round(sum(query['duration_ms'] for query in timeline.queries), 3),
+                'queries': timeline.queries,
+            }, timeline_file, indent=2, default=str)
+
+        _delete_old_profiles()
+
+        response[ID_HEADER] = profile_id
+        return response
+
+
+def _delete_old_profiles():
+    # NOTE: ids start with their date, so they sort by age
+    profile_ids = sorted({os.path.splitext(name)[0] for name in os.listdir(settings.PROFILING_DIR)
+                          if name.endswith(('.prof', '.json'))})
+    for profile_id in profile_ids[:-settings.PROFILING_MAX_PROFILES or None]:
+        for extension in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(settings.PROFILING_DIR, profile_id + extension))
+            except FileNotFoundError:
+                # NOTE: already deleted by another worker
+                pass
+
+
+class _QueryTimeline:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'start_ms': round((started_at - self.started_at) * 1000, 3),
+                'duration_ms': round((time.perf_counter() - started_at) * 1000, 3),
+                'sql': sql,
+                'params': params,
+            })
@@ -45,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'sparrow.core.slow_queries.SlowQueryMiddleware',
+    'sparrow.core.middleware.MetricsMiddleware',
+    'sparrow.core.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,6 +85,21 @@ DATABASES = {
     'default': dj_database_url.config()
 }
 
+# NOTE: existing tables have integer primary keys, see models.W042
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+# NOTE: nothing is cached unless a cache shared between processes is
+# configured, see sparrow.call_records.checks
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.dummy.DummyCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -125,3 +143,106 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
     )
 }
+
+
+# Call records
+
+# Maximum number of records written by a single INSERT when
+# ingesting call records in bulk
+CALL_RECORDS_BULK_BATCH_SIZE = config('CALL_RECORDS_BULK_BATCH_SIZE', cast=int, default=1000)
+
+# Either "sync", inserting each record posted to /call_records/ right
+# away, or "buffered", writing them behind in batches (see
+# sparrow.call_records.buffer)
+CALL_RECORDS_INGESTION_MODE = config('CALL_RECORDS_INGESTION_MODE', default='sync')
+
+# Whether JSON call records are validated and rendered without DRF
+# serializers (see sparrow.call_records.validation), with the same rules
+CALL_RECORDS_FAST_PATH = config('CALL_RECORDS_FAST_PATH', cast=bool, default=True)
+
+# Buffered ingestion: maximum number of records waiting in the buffer
+# of each process, the number written at a time, and the maximum
+# seconds a record waits for others to be written along with it
+CALL_RECORDS_BUFFER_MAX_SIZE = config('CALL_RECORDS_BUFFER_MAX_SIZE', cast=int, default=10000)
+CALL_RECORDS_BUFFER_BATCH_SIZE = config('CALL_RECORDS_BUFFER_BATCH_SIZE', cast=int, default=500)
+CALL_RECORDS_BUFFER_FLUSH_INTERVAL = config('CALL_RECORDS_BUFFER_FLUSH_INTERVAL', cast=float, default=0.05)
+
+# Buffered ingestion: either "commit", answering once the record is
+# committed, or "memory", answering once it's buffered at the risk of
+# losing it in a crash
+CALL_RECORDS_BUFFER_DURABILITY = config('CALL_RECORDS_BUFFER_DURABILITY', default='commit')
+
+# Buffered ingestion: times a batch is written before it's dropped,
+# waiting twice as long after each failure, starting from the flush
+# interval
+CALL_RECORDS_BUFFER_MAX_ATTEMPTS = config('CALL_RECORDS_BUFFER_MAX_ATTEMPTS', cast=int, default=10)
+
+# Buffered ingestion: maximum seconds a request waits for room in the
+# buffer, and in the "commit" mode, for its record to be written
+CALL_RECORDS_BUFFER_TIMEOUT = config('CALL_RECORDS_BUFFER_TIMEOUT', cast=float, default=5)
+
+# Alias, in CACHES, of the cache keeping the status of buffered
+# records, which must be shared between processes, and seconds they're
+# kept
+CALL_RECORDS_STATUS_CACHE = config('CALL_RECORDS_STATUS_CACHE', default='default')
+CALL_RECORDS_STATUS_TIMEOUT = config('CALL_RECORDS_STATUS_TIMEOUT', cast=int, default=24 * 60 * 60)
+
+# ASGI entry point (sparrow.core.asgi): minimum and maximum number of
+# database connections of each process, and number of threads running
+# synchronous code like pricing and cache access
+ASYNC_DB_POOL_MIN_SIZE = config('ASYNC_DB_POOL_MIN_SIZE', cast=int, default=2)
+ASYNC_DB_POOL_MAX_SIZE = config('ASYNC_DB_POOL_MAX_SIZE', cast=int, default=20)
+ASYNC_SYNC_THREADS = config('ASYNC_SYNC_THREADS', cast=int, default=4)
+
+# Number of call records per page when listing them, and the maximum
+# one clients may ask for with the `page_size` parameter
+CALL_RECORDS_PAGE_SIZE = config('CALL_RECORDS_PAGE_SIZE', cast=int, default=100)
+CALL_RECORDS_MAX_PAGE_SIZE = config('CALL_RECORDS_MAX_PAGE_SIZE', cast=int, default=1000)
+
+# Alias, in CACHES, of the cache used for telephone bills, which must
+# be shared between processes
+BILL_CACHE = config('BILL_CACHE', default='default')
+
+# Seconds a telephone bill is kept in cache. Bills are invalidated when
+# late calls arrive, so this only bounds memory usage
+BILL_CACHE_TIMEOUT = config('BILL_CACHE_TIMEOUT', cast=int, default=7 * 24 * 60 * 60)
+
+# Maximum seconds a worker waits for another one computing the same
+# telephone bill before computing it itself
+BILL_CACHE_LOCK_TIMEOUT = config('BILL_CACHE_LOCK_TIMEOUT', cast=int, default=10)
+
+# Number of calls read from the database, and sent, at a time when
+# streaming telephone bills
+BILL_STREAM_CHUNK_SIZE = config('BILL_STREAM_CHUNK_SIZE', cast=int, default=2000)
+
+# Maximum seconds a process goes without checking whether tariffs
+# changed, in which case they're reloaded
+TARIFF_REFRESH_INTERVAL = config('TARIFF_REFRESH_INTERVAL', cast=int, default=60)
+
+# Bearer token scrapers must send to read /metrics, in the
+# Authorization header. Empty to disable /metrics
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Directory shared by the processes of a deployment where each one
+# writes its metrics, so /metrics reports those of all of them. Empty
+# to report those of the process answering only
+METRICS_DIR = config('METRICS_DIR', default='')
+
+# Minimum seconds between two writes of the metrics of a process to
+# METRICS_DIR
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', cast=int, default=5)
+
+# Milliseconds above which queries run while serving requests are
+# logged (see sparrow.core.slow_queries), 0 to disable. A share of the
+# slow SELECT queries, SLOW_QUERY_SAMPLE_RATE, is logged along with its
+# EXPLAIN ANALYZE plan, which runs the query once more
+SLOW_QUERY_THRESHOLD = config('SLOW_QUERY_THRESHOLD', cast=float, default=0)
+SLOW_QUERY_SAMPLE_RATE = config('SLOW_QUERY_SAMPLE_RATE', cast=float, default=0.1)
+
+# Directory where profiles of requests sent with a token from the
+# `profiling_token` command are saved (see sparrow.core.profiling),
+# seconds tokens are valid for, and number of profiles kept there.
+# Empty to disable profiling
+PROFILING_DIR = config('PROFILING_DIR', default='')
+PROFILING_TOKEN_MAX_AGE = config('PROFILING_TOKEN_MAX_AGE', cast=int, default=10 * 60)
+PROFILING_MAX_PROFILES = config('PROFILING_MAX_PROFILES', cast=int, default=100)
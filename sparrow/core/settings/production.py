@@ -23,5 +23,8 @@ logging.config.dictConfig({
             'level': 'ERROR',
             'handlers': ['console'],
         },
+        'sparrow.core.slow_queries': {
+            'level': 'WARNING',
+        },
     },
 })
@@ -1,3 +1,20 @@
 from .base import *
 
 DEBUG = True
+
+# NOTE: tests add tariffs within transactions that are rolled back, so
+# they must always be checked for changes
+TARIFF_REFRESH_INTERVAL = 0
+
+# NOTE: tests run within transactions that are never committed, so
+# bills would never be invalidated. Tests for the bill cache use the
+# `bills` cache explicitly
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    'bills': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bills',
+    },
+}
@@ -0,0 +1,125 @@
+"""
+Slow query capture.
+
+With SLOW_QUERY_THRESHOLD set, `SlowQueryMiddleware` times every query
+run while serving a request. Queries slower than the threshold are
+logged as JSON to the `sparrow.core.slow_queries` logger, at the
+WARNING level, with their parameters and duration. A sample
+(SLOW_QUERY_SAMPLE_RATE) of the slow SELECT queries are run again with
+`EXPLAIN (ANALYZE, BUFFERS)`, and logged along with their plan.
+Sampling bounds the cost of capturing plans, which run the query a
+second time, not the number of slow queries logged.
+
+Queries of the ASGI application run with asyncpg, so it captures them
+on its own with `is_slow`, `should_explain` and `log_slow_query`.
+"""
+__all__ = ['SlowQueryMiddleware', 'SlowQueryLogger', 'is_slow', 'should_explain', 'log_slow_query',
+           'EXPLAIN_QUERY']
+
+import json
+import logging
+import random
+import time
+
+import psycopg2
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_QUERY = 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+
+
+class SlowQueryMiddleware:
+    """
+    Captures the slow queries of requests, see `SlowQueryLogger`. Only
+    used when SLOW_QUERY_THRESHOLD is set
+    """
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERY_THRESHOLD:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with connection.execute_wrapper(SlowQueryLogger(f'{request.method} {request.path}')):
+            return self.get_response(request)
+
+
+class SlowQueryLogger:
+    """
+    Execute wrapper (see `connection.execute_wrapper`) logging every
+    query slower than SLOW_QUERY_THRESHOLD milliseconds, with their plan
+    for a sample of them. `origin` tells where queries come from in the log,
+    e.g. the request
+    """
+
+    def __init__(self, origin):
+        self.origin = origin
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started_at
+
+        if is_slow(duration):
+            plan = _explain(sql, params) if not many and should_explain(sql) else None
+            log_slow_query(self.origin, sql, params, duration, plan)
+
+        return result
+
+
+def is_slow(duration):
+    """
+    Tells whether a query that took `duration` seconds is slower than
+    SLOW_QUERY_THRESHOLD
+    """
+    return duration >= settings.SLOW_QUERY_THRESHOLD / 1000
+
+
+def should_explain(sql):
+    """
+    Tells whether the plan of a slow query must be captured, for a
+    sample (SLOW_QUERY_SAMPLE_RATE) of them
+    """
+    # NOTE: EXPLAIN ANALYZE runs the query, so only queries without
+    # side effects are explained
+    return sql.lstrip()[:6].upper() == 'SELECT' and random.random() < settings.SLOW_QUERY_SAMPLE_RATE
+
+
+def log_slow_query(origin, sql, params, duration, plan=None):
+    logger.warning(json.dumps({
+        'origin': origin,
+        'duration_ms': round(duration * 1000, 3),
+        'sql': sql,
+        'params': params,
+        'plan': plan,
+    }, default=str))
+
+
+def _explain(sql, params):
+    """
+    Returns the plan of a query, or None if it couldn't be explained
+    """
+    # NOTE: a cursor of the underlying connection, so that the EXPLAIN
+    # isn't timed, logged or wrapped itself. Within a transaction, a
+    # savepoint keeps a failure from aborting it
+    in_transaction = connection.in_atomic_block
+    with connection.connection.cursor() as cursor:
+        if in_transaction:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute(EXPLAIN_QUERY + sql, params)
+            plan, = cursor.fetchone()
+        except psycopg2.Error:
+            logger.exception('Failed to explain a slow query')
+            if in_transaction:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return None
+
+        if in_transaction:
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+
+    return plan
@@ -15,7 +15,10 @@ Including another URLconf
 """
 from django.urls import include, path
 
+from sparrow.core.views import metrics
+
 
 urlpatterns = [
     path('call_records/', include('sparrow.call_records.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
@@ -0,0 +1,25 @@
+__all__ = ['metrics']
+
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_GET
+
+from sparrow.core.metrics import REGISTRY, render
+
+
+@require_GET
+def metrics(request):
+    """
+    Exposes metrics in the Prometheus text format, to requests with a
+    METRICS_TOKEN bearer token. Disabled unless METRICS_TOKEN is set
+    """
+    if not settings.METRICS_TOKEN:
+        raise Http404()
+
+    authorization = request.META.get('HTTP_AUTHORIZATION', '').encode()
+    if not hmac.compare_digest(authorization, f'Bearer {settings.METRICS_TOKEN}'.encode()):
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+
+    return HttpResponse(render(REGISTRY.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
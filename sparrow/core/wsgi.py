@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sparrow.core.settings.production')
 
 application = get_wsgi_application()
+
+from sparrow.call_records.checks import check_settings  # noqa: E402 (needs Django set up)
+
+# NOTE: servers don't run system checks, see sparrow.call_records.checks
+check_settings()